@@ -0,0 +1,79 @@
+"""Content-addressed blob store: shared blobs, reference counts and no write-through"""
+
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+# The service exits at import time without its audio stack
+pytest.importorskip("spleeter")
+import vocal_separation_service as vss
+
+
+def references(store, digest):
+    return store.db.execute("SELECT COUNT(*) FROM refs WHERE blob_hash = ?", (digest,)).fetchone()[0]
+
+
+@pytest.fixture
+def shared(tmp_path):
+    """The same separated track under two bookings, ingested into one store"""
+    root = tmp_path / "playback_tracks"
+    config = dict(vss.DEFAULT_CONFIG, playback_root=str(root), blob_store=str(root / ".blobs"),
+                  pcm_cache_budget_mb=0, variant_cache_budget_mb=0)
+    service = vss.VocalSeparationService(config)
+    rng = np.random.default_rng(0)
+    stems = {kind: (0.1 * rng.standard_normal((44100, 2))).astype(np.float32)
+             for kind in ("instrumental", "vocals")}
+    for booking in ("b1", "b2"):
+        track_dir = root / booking / "t1"
+        track_dir.mkdir(parents=True)
+        for kind, audio in stems.items():
+            sf.write(str(track_dir / f"song_{kind}.wav"), audio, 44100)
+        service.blob_store.ingest_directory(str(track_dir), booking)
+    path = lambda booking, kind: str(root / booking / "t1" / f"song_{kind}.wav")
+    return service, service.blob_store, path
+
+
+def test_shared_blob_survives_release_of_one_booking_and_gc(shared):
+    _, store, path = shared
+    digest = vss.content_hash(path("b2", "instrumental"))
+    assert references(store, digest) == 2
+
+    assert store.release_booking("b1")["freed_bytes"] == 0
+    store.gc()
+    assert not os.path.exists(path("b1", "instrumental"))
+    assert os.path.exists(store.blob_path(digest))
+    assert os.path.samefile(path("b2", "instrumental"), store.blob_path(digest))
+    assert references(store, digest) == 1
+
+
+def test_reference_counts_return_to_zero(shared):
+    _, store, path = shared
+    digests = {vss.content_hash(path("b1", kind)) for kind in ("instrumental", "vocals")}
+
+    store.release_booking("b1")
+    store.release_booking("b2")
+    assert all(references(store, digest) == 0 for digest in digests)
+    assert not any(os.path.exists(store.blob_path(digest)) for digest in digests)
+    assert store.stats()["references"] == 0 and store.stats()["blobs"] == 0
+
+
+@pytest.mark.parametrize("rewrite", ["normalize", "remix"])
+def test_rewriting_one_bookings_stem_leaves_the_other_unchanged(shared, rewrite):
+    service, store, path = shared
+    target = path("b1", "instrumental")
+    digest = vss.content_hash(target)
+    before = sf.read(path("b2", "instrumental"))[0]
+
+    if rewrite == "normalize":
+        result = service.normalize_loudness(target, -14.0, package=False)
+    else:
+        result = service.remix_stems(path("b1", "vocals"), target, target, vocals_gain_db=0.0)
+    assert result["success"], result
+
+    assert not os.path.samefile(target, store.blob_path(digest))
+    assert vss.content_hash(store.blob_path(digest)) == digest
+    np.testing.assert_array_equal(sf.read(path("b2", "instrumental"))[0], before)
+    store.gc()
+    assert references(store, digest) == 1
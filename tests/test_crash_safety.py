@@ -0,0 +1,120 @@
+"""Interrupted separations resume from the journal; failed writes leave nothing behind"""
+
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+# The service exits at import time without its audio stack
+pytest.importorskip("spleeter")
+import vocal_separation_service as vss
+
+SAMPLE_RATE = 44100
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    """Service whose separation is a cheap fixed split, so no model weights are needed"""
+    config = dict(vss.DEFAULT_CONFIG, journal_dir=str(tmp_path / "journal"), pcm_cache_budget_mb=0,
+                  variant_cache_budget_mb=0, hls_package=False, blob_store=None)
+    service = vss.VocalSeparationService(config)
+    calls = []
+
+    def separate_waveform(waveform, sample_rate, tier=None):
+        calls.append(tier)
+        return {"vocals": 0.25 * waveform, "accompaniment": 0.75 * waveform}, {"silence_skipped_ratio": 0.0}
+
+    monkeypatch.setattr(service, "separate_waveform", separate_waveform)
+    service.separations = calls
+    return service
+
+
+@pytest.fixture
+def track(tmp_path):
+    rng = np.random.default_rng(0)
+    path = str(tmp_path / "track.wav")
+    sf.write(path, (0.1 * rng.standard_normal((5 * SAMPLE_RATE, 2))).astype(np.float32), SAMPLE_RATE)
+    return path
+
+
+def leftovers(directory):
+    return [name for name in os.listdir(directory) if name.endswith((".tmp", ".blobtmp"))]
+
+
+def test_resume_after_crash_reuses_the_written_stem(service, track, tmp_path, monkeypatch):
+    output_dir = str(tmp_path / "out")
+    write_wav_atomic = vss.write_wav_atomic
+
+    def crash_on_vocals(path, *args, **kwargs):
+        if path.endswith("_vocals.wav"):
+            raise KeyboardInterrupt  # The worker is killed after the instrumental checkpoint
+        return write_wav_atomic(path, *args, **kwargs)
+
+    monkeypatch.setattr(vss, "write_wav_atomic", crash_on_vocals)
+    with pytest.raises(KeyboardInterrupt):
+        service.separate_vocals(track, output_dir, "song")
+    instrumental = os.path.join(output_dir, "song_instrumental.wav")
+    assert os.path.exists(instrumental)
+    assert not os.path.exists(os.path.join(output_dir, "song_vocals.wav"))
+    assert not leftovers(output_dir)
+    assert len(vss.unfinished_jobs(service.config["journal_dir"])) == 1
+    written = os.stat(instrumental)
+
+    monkeypatch.setattr(vss, "write_wav_atomic", write_wav_atomic)
+    result = service.separate_vocals(track, output_dir, "song")
+
+    assert result["success"], result
+    assert len(service.separations) == 1  # The checkpointed stems were reused, not inferred again
+    assert os.stat(instrumental).st_mtime_ns == written.st_mtime_ns
+    assert sf.info(result["output_files"]["vocals"]).frames == 5 * SAMPLE_RATE
+    assert not vss.unfinished_jobs(service.config["journal_dir"])
+    assert not leftovers(output_dir)
+
+
+class FailingPackager:
+    """Encoder fed block by block that fails part way through the file"""
+
+    def __init__(self):
+        self.blocks = 0
+        self.aborted = False
+
+    def write(self, block):
+        self.blocks += 1
+        if self.blocks == 2:
+            raise OSError(28, "No space left on device")
+
+    def abort(self):
+        self.aborted = True
+
+
+def test_failed_wav_write_leaves_no_partial_or_temp_file(tmp_path):
+    path = str(tmp_path / "stem.wav")
+    with open(path, "wb") as f:
+        f.write(b"previous")
+    waveform = np.zeros((3 * vss.STREAM_BLOCK_FRAMES, 2), dtype=np.float32)
+    packager = FailingPackager()
+
+    with pytest.raises(OSError):
+        vss.write_wav_atomic(path, waveform, SAMPLE_RATE, packager=packager)
+
+    assert packager.aborted
+    assert os.listdir(tmp_path) == ["stem.wav"]
+    with open(path, "rb") as f:
+        assert f.read() == b"previous"
+
+
+def test_failed_copy_leaves_no_partial_or_temp_file(tmp_path, track, monkeypatch):
+    target_dir = tmp_path / "out"
+    target_dir.mkdir()
+
+    def copy_until_disk_full(source_path, path):
+        with open(path, "wb") as f:
+            f.write(b"RIFF")
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(vss.shutil, "copy2", copy_until_disk_full)
+    with pytest.raises(OSError):
+        vss.copy_atomic(track, str(target_dir / "song_original.wav"))
+
+    assert os.listdir(target_dir) == []
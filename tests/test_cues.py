@@ -0,0 +1,39 @@
+"""Cue points snapped to the bar grid"""
+
+import numpy as np
+import pytest
+
+# The service exits at import time without its audio stack
+pytest.importorskip("spleeter")
+import vocal_separation_service as vss
+
+SAMPLE_RATE = 44100
+FRAME_SECONDS = vss.ANALYSIS_HOP / SAMPLE_RATE
+
+
+def features(seconds, intro_seconds, vocal_seconds, bpm=120.0):
+    """Quiet intro, then full energy; vocals from vocal_seconds; a steady beat from zero"""
+    times = np.arange(int(seconds / FRAME_SECONDS)) * FRAME_SECONDS
+    return {
+        "sample_rate": SAMPLE_RATE,
+        "bpm": bpm,
+        "beat_times": np.arange(0.0, seconds, 60.0 / bpm),
+        "energy_db": np.where(times < intro_seconds, -40.0, 0.0),
+        "vocal_activity": times >= vocal_seconds
+    }
+
+
+def test_intro_end_never_snaps_past_a_vocal_entry_just_before_a_bar_line():
+    # Bars fall every 2 s; the vocal enters just before the bar at 16 s
+    cues = vss.compute_cue_points(features(60.0, intro_seconds=16.0, vocal_seconds=15.9))
+
+    assert 15.0 < cues["first_vocal"] < 16.0
+    assert cues["intro_end"] == pytest.approx(14.0)
+    assert cues["intro_end"] <= cues["first_vocal"]
+
+
+def test_intro_end_snaps_to_the_nearest_bar_without_an_early_vocal():
+    cues = vss.compute_cue_points(features(60.0, intro_seconds=15.7, vocal_seconds=30.0))
+
+    assert cues["intro_end"] == pytest.approx(16.0)
+    assert cues["first_vocal"] == pytest.approx(30.0, abs=0.3)
@@ -0,0 +1,85 @@
+"""Stems of an indexed recording are reused only when enabled and only for aligned copies"""
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+# The service exits at import time without its audio stack
+pytest.importorskip("spleeter")
+import vocal_separation_service as vss
+
+
+@pytest.fixture
+def make_service(tmp_path, monkeypatch):
+    """Services sharing one fingerprint index; separation is a fixed split so no model weights are needed"""
+    def make(**overrides):
+        config = dict(vss.DEFAULT_CONFIG, fingerprint_index=str(tmp_path / "fingerprints.sqlite"),
+                      journal_dir=str(tmp_path / "journal"), playback_root=str(tmp_path / "playback_tracks"),
+                      pcm_cache_budget_mb=0, variant_cache_budget_mb=0, embedding_index=None,
+                      blob_store=None, hls_package=False, **overrides)
+        service = vss.VocalSeparationService(config)
+        monkeypatch.setattr(service, "separate_waveform", lambda waveform, sample_rate, tier=None: (
+            {"vocals": 0.25 * waveform, "accompaniment": 0.75 * waveform}, {"silence_skipped_ratio": 0.0}))
+        return service
+    return make
+
+
+@pytest.fixture
+def song(tmp_path):
+    """A 40 s generated song (each test processes it first so its outputs are indexed)"""
+    return vss.generate_benchmark_fixtures(str(tmp_path / "fixtures"), count=1, seconds=40.0)[0]
+
+
+def process(service, path, tmp_path, title):
+    result = service.process_setlist_track(path, title, str(tmp_path / "playback_tracks" / title))
+    assert "error" not in result, result
+    return result
+
+
+def variant(tmp_path, name, audio, sample_rate):
+    """Re-encode audio in the container of the name's extension"""
+    path = str(tmp_path / name)
+    sf.write(path, audio, sample_rate)
+    return path
+
+
+def test_duplicates_are_separated_again_by_default(make_service, song, tmp_path):
+    service = make_service()
+    process(service, song, tmp_path, "first")
+    audio, sample_rate = sf.read(song, dtype="float32")
+
+    result = process(service, variant(tmp_path, "copy.wav", audio, sample_rate), tmp_path, "copy")
+    assert "duplicate_of" not in result
+
+
+def test_aligned_reencode_reuses_the_indexed_outputs(make_service, song, tmp_path):
+    service = make_service(reuse_duplicate_stems=True)
+    first = process(service, song, tmp_path, "first")
+    audio, sample_rate = sf.read(song, dtype="float32")
+
+    copy = variant(tmp_path, "copy.flac", audio, sample_rate)
+    result = process(service, copy, tmp_path, "copy")
+    assert result["duplicate_of"]["audio_path"] == song
+    assert abs(result["duplicate_of"]["offset_seconds"]) <= vss.REUSE_MAX_OFFSET_SECONDS
+    assert set(result["output_files"]) == set(first["output_files"])
+    # The original is this upload, not the matched file
+    assert vss.content_hash(result["output_files"]["original"]) == vss.content_hash(copy)
+
+
+@pytest.mark.parametrize("edit", ["lead_in", "shorter_cut"])
+def test_misaligned_or_edited_copies_are_not_reused(make_service, song, tmp_path, edit):
+    service = make_service(reuse_duplicate_stems=True)
+    process(service, song, tmp_path, "first")
+    audio, sample_rate = sf.read(song, dtype="float32")
+    if edit == "lead_in":
+        lead_in = 0.05 * np.random.default_rng(1).standard_normal((3 * sample_rate, audio.shape[1]))
+        audio = np.concatenate([lead_in.astype(np.float32), audio])
+    else:
+        audio = audio[:30 * sample_rate]
+
+    path = variant(tmp_path, f"{edit}.wav", audio, sample_rate)
+
+    # The fingerprint still matches; only the alignment gate keeps the stems from being served
+    assert service.find_duplicate(path)["match"]["audio_path"] == song
+    result = process(service, path, tmp_path, edit)
+    assert "duplicate_of" not in result
@@ -0,0 +1,83 @@
+"""BS.1770 / EBU Tech 3341 reference tones through the block-streaming loudness meter"""
+
+import os
+import struct
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+# The service exits at import time without its audio stack
+pytest.importorskip("spleeter")
+import vocal_separation_service as vss
+
+
+def sine(frequency, seconds, sample_rate, level_db=0.0):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (10.0 ** (level_db / 20.0) * np.sin(2.0 * np.pi * frequency * t)).astype(np.float32)
+
+
+def measure(waveform, sample_rate):
+    if waveform.ndim == 1:
+        waveform = waveform[:, None]
+    return vss.measure_loudness(vss.iter_blocks(waveform), sample_rate, waveform.shape[1])
+
+
+def test_k_weighting_matches_bs1770_coefficients_at_48k():
+    expected = np.array([
+        [1.53512485958697, -2.69169618940638, 1.19839281085285, 1.0, -1.69065929318241, 0.73248077421585],
+        [1.0, -2.0, 1.0, 1.0, -1.99004745483398, 0.99007225036621]
+    ])
+    np.testing.assert_allclose(vss.k_weighting_sos(48000), expected, atol=1e-9)
+
+
+@pytest.mark.parametrize("sample_rate", [44100, 48000])
+def test_full_scale_997hz_sine_reads_minus_3_01_lufs(sample_rate):
+    result = measure(sine(997.0, 20.0, sample_rate), sample_rate)
+    assert result["integrated_lufs"] == pytest.approx(-3.01, abs=0.1)
+
+
+def test_stereo_1khz_at_minus_23_dbfs_reads_minus_23_lufs():
+    tone = sine(1000.0, 20.0, 48000, level_db=-23.0)
+    result = measure(np.stack([tone, tone], axis=1), 48000)
+    assert result["integrated_lufs"] == pytest.approx(-23.0, abs=0.1)
+
+
+def test_5_1_excludes_lfe_and_weights_surrounds():
+    tone = sine(1000.0, 10.0, 48000, level_db=-23.0)
+    silence = np.zeros_like(tone)
+
+    lfe_only = np.stack([silence, silence, silence, tone, silence, silence], axis=1)
+    assert measure(lfe_only, 48000)["integrated_lufs"] is None
+
+    front = measure(np.stack([tone, silence, silence, silence, silence, silence], axis=1), 48000)
+    surround = measure(np.stack([silence, silence, silence, silence, tone, silence], axis=1), 48000)
+    assert surround["integrated_lufs"] - front["integrated_lufs"] == pytest.approx(1.5, abs=0.05)
+
+
+def read_peaks_level0(peaks_path):
+    with open(peaks_path, "rb") as f:
+        magic, _, bits, _, _, levels = struct.unpack('<4sHHIQH', f.read(22))
+        assert magic == vss.PEAKS_MAGIC
+        _, count = struct.unpack('<II', f.read(8))
+        f.read(8 * (levels - 1))
+        pairs = np.frombuffer(f.read(count * 2 * bits // 8), dtype='<i1' if bits == 8 else '<i2')
+    return pairs.reshape(-1, 2) / (127 if bits == 8 else 32767)
+
+
+@pytest.mark.parametrize("extension", [".wav", ".flac"])
+def test_normalize_rewrites_peaks_and_keeps_container(tmp_path, extension):
+    path = str(tmp_path / f"track{extension}")
+    tone = sine(440.0, 5.0, 44100, level_db=-30.0)
+    sf.write(path, np.stack([tone, tone], axis=1), 44100)
+    vss.peaks_from_file(path)
+
+    service = vss.VocalSeparationService(dict(vss.DEFAULT_CONFIG, pcm_cache_budget_mb=0))
+    result = service.normalize_loudness(path, -14.0)
+    assert result["success"], result
+
+    assert sf.info(path).format == vss.soundfile_format(path)
+    file_peak = np.abs(sf.read(path, dtype='float32')[0]).max()
+    assert file_peak > 10.0 ** (-20.0 / 20.0)
+    assert read_peaks_level0(result["peaks_file"]).max() == pytest.approx(file_peak, abs=1.0 / 127)
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(path), os.path.basename(path) + ".peaks"])
@@ -0,0 +1,30 @@
+"""Peak allocation of the shared analysis pass, per minute of decoded audio"""
+
+import tracemalloc
+
+import pytest
+
+# The service exits at import time without its audio stack
+pytest.importorskip("spleeter")
+import vocal_separation_service as vss
+
+MAX_MB_PER_AUDIO_MINUTE = 100
+
+
+def test_analysis_peak_memory_per_audio_minute(tmp_path):
+    # The decoded-audio cache would keep the waveform alive; it is not part of the analysis pass
+    service = vss.VocalSeparationService(dict(vss.load_config(), pcm_cache_budget_mb=0))
+    # Warm librosa's filter caches so they are not charged to the measured run
+    service._analyze(vss.generate_benchmark_fixtures(str(tmp_path / "warmup"), count=1, seconds=5.0)[0])
+
+    seconds = 90
+    fixture = vss.generate_benchmark_fixtures(str(tmp_path / "fixtures"), count=1, seconds=seconds)[0]
+    tracemalloc.start()
+    try:
+        result, _ = service._analyze(fixture)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert result["duration"] == pytest.approx(seconds)
+    assert peak / 2**20 / (seconds / 60.0) <= MAX_MB_PER_AUDIO_MINUTE
@@ -0,0 +1,50 @@
+"""Progressive mode separates a preview only for tracks the full pipeline separates"""
+
+import pytest
+
+# The service exits at import time without its audio stack
+pytest.importorskip("spleeter")
+import vocal_separation_service as vss
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    """Service whose separation is a fixed split, so no model weights are needed"""
+    config = dict(vss.DEFAULT_CONFIG, journal_dir=str(tmp_path / "journal"), pcm_cache_budget_mb=0,
+                  variant_cache_budget_mb=0, fingerprint_index=None, embedding_index=None,
+                  blob_store=None, hls_package=False)
+    service = vss.VocalSeparationService(config)
+    monkeypatch.setattr(service, "separate_waveform", lambda waveform, sample_rate, tier=None: (
+        {"vocals": 0.25 * waveform, "accompaniment": 0.75 * waveform}, {"silence_skipped_ratio": 0.0}))
+    return service
+
+
+@pytest.fixture
+def song(tmp_path):
+    return vss.generate_benchmark_fixtures(str(tmp_path / "fixtures"), count=1, seconds=20.0)[0]
+
+
+def test_preview_hook_runs_before_separation(service, song, tmp_path):
+    previews = []
+    result = service.process_setlist_track(song, "My Song", str(tmp_path / "out"),
+                                           before_separation=lambda *args: previews.append(args))
+
+    assert result["separation_performed"]
+    assert previews == [(str(tmp_path / "out" / "My Song"), "My_Song")]
+
+
+def test_no_preview_when_analysis_finds_no_vocals(service, song, tmp_path, monkeypatch):
+    analyze = service._analyze
+
+    def instrumental(path):
+        result, features = analyze(path)
+        return dict(result, recommendation="instrumental"), features
+
+    monkeypatch.setattr(service, "_analyze", instrumental)
+    previews = []
+    result = service.process_setlist_track(song, "My Song", str(tmp_path / "out"),
+                                           before_separation=lambda *args: previews.append(args))
+
+    assert not result["separation_performed"]
+    assert "dj_ready" in result["output_files"]
+    assert previews == []
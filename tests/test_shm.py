@@ -0,0 +1,75 @@
+"""Shared-memory transport: segment names, cleanup and error reporting"""
+
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pytest
+
+# The service exits at import time without its audio stack
+pytest.importorskip("spleeter")
+import vocal_separation_service as vss
+
+pytestmark = pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="needs POSIX shared memory")
+
+
+@pytest.fixture
+def service():
+    return vss.VocalSeparationService(dict(vss.DEFAULT_CONFIG, pcm_cache_budget_mb=0))
+
+
+@pytest.fixture
+def pcm():
+    """A caller-owned input segment holding two seconds of stereo noise"""
+    waveform = (0.1 * np.random.default_rng(0).standard_normal((2 * 44100, 2))).astype(np.float32)
+    segment = shared_memory.SharedMemory(create=True, size=waveform.nbytes)
+    np.ndarray(waveform.shape, dtype=vss.PCM_DTYPE, buffer=segment.buf)[...] = waveform
+    yield waveform, segment
+    segment.close()
+    # Attaching in this same process dropped the segment from its resource tracker
+    resource_tracker.register(f"/{segment.name}", "shared_memory")
+    segment.unlink()
+
+
+def test_stems_round_trip_through_a_new_segment(service, pcm, monkeypatch):
+    waveform, segment = pcm
+    monkeypatch.setattr(service, "separate_waveform", lambda waveform, sample_rate, tier=None: (
+        {"vocals": 0.25 * waveform, "accompaniment": 0.75 * waveform}, {"silence_skipped_ratio": 0.0}))
+    # Callers using shm_open name segments with a leading slash
+    request = {"input": {"shm": f"/{segment.name}", "frames": len(waveform), "channels": 2},
+               "stems": ["vocals", "accompaniment"]}
+
+    result = service.shm_separate(request)
+    assert result["success"], result
+    name = result["stems"]["vocals"]["shm"]
+    assert not name.startswith("/") and name == result["stems"]["accompaniment"]["shm"]
+    stem, output = vss.open_pcm(result["stems"]["accompaniment"])
+    np.testing.assert_allclose(stem, 0.75 * waveform)
+    del stem
+    output.close()
+    assert vss.release_shm(name)
+    assert not os.path.exists(f"/dev/shm/{name}")
+
+
+def test_separation_error_is_reported_even_while_views_are_alive(service, pcm, monkeypatch):
+    waveform, segment = pcm
+    kept = []
+
+    def fail(waveform, sample_rate, tier=None):
+        kept.append(waveform[:10])  # A view that outlives the call, so close() cannot unmap
+        raise RuntimeError("model exploded")
+
+    monkeypatch.setattr(service, "separate_waveform", fail)
+    result = service.shm_separate({"input": {"shm": segment.name, "frames": len(waveform), "channels": 2}})
+
+    assert not result["success"]
+    assert "model exploded" in result["error"]
+
+
+def test_failed_stem_write_unlinks_the_new_segment(monkeypatch):
+    before = set(os.listdir("/dev/shm"))
+    stems = {"vocals": np.zeros((100, 2), dtype=np.float32), "accompaniment": np.zeros((100, 3, 1))}
+
+    with pytest.raises(ValueError):
+        vss.write_pcm_stems(stems, 44100)
+    assert set(os.listdir("/dev/shm")) == before
@@ -0,0 +1,76 @@
+"""Storage manager eviction under a disk budget"""
+
+import os
+
+import pytest
+
+# The service exits at import time without its audio stack
+pytest.importorskip("spleeter")
+import vocal_separation_service as vss
+
+FILE_BYTES = 1000
+KINDS = ("original", "instrumental", "vocals")
+
+
+@pytest.fixture
+def library(tmp_path):
+    """Two bookings with one separated track each; b2's vocals were downloaded longest ago"""
+    root = tmp_path / "playback_tracks"
+    paths, downloads = {}, {}
+    for booking, last_download in (("b1", 2000.0), ("b2", 1000.0)):
+        track_dir = root / booking / "t1"
+        track_dir.mkdir(parents=True)
+        for offset, kind in enumerate(KINDS):
+            path = str(track_dir / f"song_{kind}.wav")
+            with open(path, "wb") as f:
+                f.write(b"\0" * FILE_BYTES)
+            paths[booking, kind] = path
+            downloads[path] = last_download + offset
+    config = dict(vss.DEFAULT_CONFIG, playback_root=str(root), pcm_cache_budget_mb=0, pcm_cache_dir=None,
+                  variant_cache_budget_mb=0, variant_cache_dir=None, blob_store=None)
+    manager = vss.StorageManager(vss.VocalSeparationService(config))
+    return manager, paths, downloads
+
+
+def on_disk(paths):
+    return sum(os.path.getsize(path) for path in paths.values() if os.path.exists(path))
+
+
+def test_originals_and_upcoming_dj_ready_are_never_evicted(library):
+    manager, paths, downloads = library
+    result = manager.enforce(0, downloads, upcoming_bookings=["b1"])
+
+    assert result["over_budget"]
+    assert os.path.exists(paths["b1", "original"]) and os.path.exists(paths["b2", "original"])
+    assert os.path.exists(paths["b1", "instrumental"])
+    assert not os.path.exists(paths["b2", "instrumental"])
+    assert not os.path.exists(paths["b1", "vocals"]) and not os.path.exists(paths["b2", "vocals"])
+
+
+def test_eviction_follows_tier_then_least_recent_download(library):
+    manager, paths, downloads = library
+    result = manager.enforce(0, downloads, upcoming_bookings=[], dry_run=True)
+
+    assert [entry["paths"] for entry in result["evicted"]] == [
+        [paths["b2", "vocals"]], [paths["b1", "vocals"]],
+        [paths["b2", "instrumental"]], [paths["b1", "instrumental"]]
+    ]
+
+
+def test_dry_run_deletes_nothing(library):
+    manager, paths, downloads = library
+    result = manager.enforce(0, downloads, upcoming_bookings=[], dry_run=True)
+
+    assert result["evicted"] and result["freed_bytes"] == 4 * FILE_BYTES
+    assert all(os.path.exists(path) for path in paths.values())
+
+
+def test_usage_fits_the_budget_after_enforcement(library):
+    manager, paths, downloads = library
+    budget = on_disk(paths) - FILE_BYTES // 2
+    result = manager.enforce(budget, downloads, upcoming_bookings=[])
+
+    assert not result["over_budget"]
+    assert on_disk(paths) <= budget
+    assert [entry["paths"] for entry in result["evicted"]] == [[paths["b2", "vocals"]]]
+    assert manager.report(manager.scan(downloads, []))["used_bytes"] == on_disk(paths)
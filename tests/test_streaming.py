@@ -0,0 +1,54 @@
+"""Streamed separation: the JSON header is only a success header if the whole stem follows"""
+
+import io
+import json
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+# The service exits at import time without its audio stack
+pytest.importorskip("spleeter")
+import vocal_separation_service as vss
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """Service whose separation is a fixed split, so no model weights are needed"""
+    service = vss.VocalSeparationService(dict(vss.DEFAULT_CONFIG, pcm_cache_budget_mb=0))
+    monkeypatch.setattr(service, "separate_waveform", lambda waveform, sample_rate, tier=None: (
+        {"vocals": 0.25 * waveform, "accompaniment": 0.75 * waveform}, {"silence_skipped_ratio": 0.0}))
+    return service
+
+
+@pytest.fixture
+def upload():
+    audio = (0.1 * np.random.default_rng(0).standard_normal((2 * 44100, 2))).astype(np.float32)
+    data = io.BytesIO()
+    sf.write(data, audio, 44100, format="WAV")
+    return data.getvalue()
+
+
+def stream(service, upload, output_format):
+    sink = io.BytesIO()
+    ok = service.stream_separate(io.BytesIO(upload), sink, output_format=output_format)
+    line, _, body = sink.getvalue().partition(b"\n")
+    return ok, json.loads(line), body
+
+
+@pytest.mark.parametrize("output_format", ["wav", "flac"])
+def test_success_header_announces_the_complete_stem(service, upload, output_format):
+    ok, header, body = stream(service, upload, output_format)
+
+    assert ok and header["success"]
+    assert header["content_length"] == len(body)
+    assert len(vss.decode_stream(io.BytesIO(body))[0]) == header["frames"]
+
+
+def test_encoder_failure_is_reported_in_the_header(service, upload, monkeypatch):
+    monkeypatch.setitem(vss.STREAM_FORMATS, "flac", ["-c:a", "no_such_encoder", "-f", "flac"])
+    ok, header, body = stream(service, upload, "flac")
+
+    assert not ok and not header["success"]
+    assert "flac" in header["error"]
+    assert body == b""
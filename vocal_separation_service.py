@@ -11,6 +11,19 @@ import logging
 from pathlib import Path
 import tempfile
 import shutil
+import time
+import glob
+import re
+import hashlib
+import sqlite3
+import struct
+import socketserver
+import subprocess
+import threading
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
 
 try:
     from spleeter.separator import Separator
@@ -18,6 +31,8 @@ try:
     import librosa
     import soundfile as sf
     import numpy as np
+    from scipy import signal
+    from scipy.optimize import linear_sum_assignment
 except ImportError as e:
     print(f"Error: Required packages not installed: {e}")
     sys.exit(1)
@@ -26,139 +41,3214 @@ except ImportError as e:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Runtime configuration (written by the autotune command)
+CONFIG_PATH = os.environ.get("VOCAL_SEPARATION_CONFIG", "vocal_separation_config.json")
+BENCHMARK_FIXTURES_DIR = os.environ.get("VOCAL_SEPARATION_FIXTURES", "benchmark_fixtures")
+BENCHMARK_FIXTURE_COUNT = 3       # Generated into the default directory when it holds no audio
+BENCHMARK_FIXTURE_SECONDS = 30.0
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.m4a', '.aac', '.aiff')
+
+# Streaming mode: audio bytes in, one JSON header line plus encoded stem bytes out
+STREAM_SAMPLE_RATE = 44100
+STREAM_CHUNK_BYTES = 1 << 16
+STREAM_BLOCK_FRAMES = 1 << 15
+STREAM_SPOOL_BYTES = 64 << 20  # Compressed stems up to this size are encoded in memory before the header
+STREAM_STEMS = {"vocals": "vocals", "accompaniment": "accompaniment", "instrumental": "accompaniment"}
+STREAM_FORMATS = {
+    "wav": None,  # framed directly as 16-bit PCM
+    "mp3": ["-f", "mp3"],
+    "flac": ["-f", "flac"],
+    "ogg": ["-c:a", "libvorbis", "-f", "ogg"]
+}
+
+# Remixing cached stems
+REMIX_BLOCK_FRAMES = 1 << 16
+STEM_SUFFIXES = {"vocals": "_vocals.wav", "accompaniment": "_instrumental.wav", "instrumental": "_instrumental.wav"}
+
+# Setlist transition previews
+TRANSITION_CROSSFADE_SECONDS = 6.0
+TRANSITION_CONTEXT_SECONDS = 4.0     # Audio kept before and after the crossfade
+TRANSITION_SILENCE_MARGIN = 8.0      # Extra seconds read so silent heads/tails can be skipped
+TRANSITION_SILENCE_DB = -50.0
+
+# Loudness (ITU-R BS.1770 / EBU R128)
+LOUDNESS_BLOCK_FRAMES = 1 << 16
+LOUDNESS_ABSOLUTE_GATE = -70.0
+TRUE_PEAK_TAPS = 49
+
+# Input quality scan
+CLIP_LEVEL = 0.999
+CLIP_RUN = 3                    # Consecutive full-scale samples that count as a clipped run
+TRUNCATION_TOLERANCE_SECONDS = 0.05   # Decoder delay/padding differences are not truncation
+ABRUPT_END_SECONDS = 0.01
+ABRUPT_END_DB = -30.0
+
+# Silence detection ahead of inference
+SILENCE_FRAME = 2048
+
+# Shared analysis spectrogram and beat/cue sidecars (<audio>.cues.json)
+ANALYSIS_N_FFT = 2048
+ANALYSIS_HOP = 512
+ANALYSIS_BLOCK_COLUMNS = 1024  # Spectrogram columns per block for features with full-size float64 temporaries
+TEMPO_WINDOW_SECONDS = 8.0     # Autocorrelation window of librosa's global tempo estimate
+VOCAL_BAND_HZ = (300.0, 3400.0)
+CUE_ENERGY_DROP_DB = 6.0       # Sections quieter than median - 6 dB count as intro/outro
+CUE_SMOOTHING_SECONDS = 2.0
+CUE_MIN_VOCAL_SECONDS = 1.0
+BEATS_PER_BAR = 4
+
+# Audio fingerprints (32-bit sub-fingerprints at a fixed frame rate)
+FINGERPRINT_BITS = 32
+FINGERPRINT_RATE = 32.0          # Sub-fingerprints per second
+FINGERPRINT_BAND_HZ = (300.0, 4000.0)
+FINGERPRINT_EXCERPT = 640        # 20 s of the query compared against each candidate
+FINGERPRINT_MAX_SHIFT = 160      # +/- 5 s alignment search
+FINGERPRINT_CANDIDATES = 10
+REUSE_MAX_OFFSET_SECONDS = 0.1   # Stems are reused only for copies aligned with the indexed track
+REUSE_MAX_DURATION_DIFF = 0.5    # seconds; allows for encoder padding, not edits
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Separation tiers: Spleeter model, Wiener filtering (MWF), overlap between shifted inference
+# passes, stem WAV subtype and process niceness. Real-time factors are measured per machine
+# with `benchmark --tier all --record` and stored under "tier_benchmarks" in the config.
+# Reference (generated fixtures, 1 worker on one Xeon core, TensorFlow 2.12, inference only):
+#   draft 0.34 x real time, standard 0.38, studio 0.93 (two shifted passes plus Wiener filtering)
+SEPARATION_TIERS = {
+    "draft": {"model": "spleeter:2stems", "mwf": False, "overlap": 0.0, "subtype": "PCM_16", "niceness": 0},
+    "standard": {"model": "spleeter:2stems-16kHz", "mwf": False, "overlap": 0.0, "subtype": "PCM_16", "niceness": 0},
+    "studio": {"model": "spleeter:2stems-16kHz", "mwf": True, "overlap": 0.5, "subtype": "PCM_24", "niceness": 10}
+}
+SPLEETER_SEGMENT_FRAMES = 512 * 1024   # Spleeter infers in independent T=512 frame, 1024-hop segments
+
+# Hook finder: chroma self-similarity on a decimated mono signal
+HOOK_SAMPLE_RATE = 11025
+HOOK_HOP = 4096                # ~0.37 s chroma frames
+HOOK_MAX_FRAMES = 2048         # Caps the similarity matrix at 16 MB for very long files
+HOOK_FADE_SECONDS = 0.5
+
+# Progressive mode: a short preview is separated and reported before the full track
+PREVIEW_BACKGROUND_NICENESS = 10
+
+# Energy profiling and setlist ordering
+ENERGY_CURVE_POINTS = 64
+ENERGY_ARCS = {
+    "rise": lambda x: 0.2 + 0.8 * x,
+    "fall": lambda x: 1.0 - 0.8 * x,
+    "peak": lambda x: np.where(x <= 0.75, 0.3 + 0.7 * x / 0.75, 1.0 - 0.5 * (x - 0.75) / 0.25),
+    "wave": lambda x: 0.55 + 0.35 * np.sin(2 * np.pi * (2 * x - 0.25)),
+    "flat": lambda x: np.full_like(x, 0.5)
+}
+SETLIST_BPM_WEIGHT = 0.05       # Cost of a tempo jump of one octave between neighbours
+
+# Key detection (Krumhansl-Kessler profiles) and mixing compatibility
+PITCH_CLASSES = ("C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B")
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+MIX_BPM_TOLERANCE = 0.06        # Tempo ratios within 6% (after half/double time) can be beatmatched
+MIX_MAX_KEY_DISTANCE = 1        # Same key, adjacent on the Camelot wheel, or relative major/minor
+
+# MFCC embeddings: mean, standard deviation and delta deviation of 13 coefficients
+EMBEDDING_MFCCS = 13
+EMBEDDING_DIM = 3 * EMBEDDING_MFCCS
+EMBEDDING_WRITE_BATCH = 64      # Backfilled files whose embeddings are written per transaction
+
+# Storage manager: eviction order by artifact kind (lower goes first)
+EVICTION_TIERS = {"cache": 0, "preview": 0, "vocals": 0, "dj_ready": 1}
+HLS_SUFFIX = ".hls"            # <audio>.hls/index.m3u8 + segment_NNNNN.ts
+VARIANT_NAME = re.compile(r"^[0-9a-f]{64}_[+-]\d+\.\d{2}st_\d+\.\d{4}x\.wav$")
+SIDECAR_SUFFIXES = (".peaks", ".cues.json", ".hook.json", ".analysis.json")
+
+# Waveform peaks sidecars (<audio>.peaks)
+PEAKS_MAGIC = b'WPK1'
+PEAKS_BASE_SAMPLES = 256       # Samples per peak at the finest level
+PEAKS_LEVELS = 9               # 256 .. 65536 samples per peak
+PEAKS_READ_BLOCKS = 1024       # Finest-level peaks decoded per block when reading from disk
+
+# Shared-memory transport: interleaved float32 PCM, (frames, channels), stems 64-byte aligned
+PCM_DTYPE = np.dtype('<f4')
+SHM_ALIGNMENT = 64
+
+DEFAULT_CONFIG = {
+    "workers": 1,            # Pool size; the caller runs each worker as `--worker i`, i in 0..workers-1
+    "intra_op_threads": 0,   # Per worker; 0 lets TensorFlow pick (one thread per core)
+    "inter_op_threads": 0,
+    "cpu_affinity": None,    # Optional list of core ids available to the service
+    "pin_workers": False,    # Give each worker its own slice of cores
+    "pcm_cache_dir": os.path.join("audio_cache", "pcm"),
+    "pcm_cache_budget_mb": 4096,  # 0 disables the decoded-audio cache
+    "peaks_bits": 8,              # 8 or 16-bit waveform peak sidecars
+    "normalize_lufs": None,       # Target integrated loudness for DJ-ready output (None = off)
+    "max_true_peak_dbtp": -1.0,
+    "silence_threshold_db": -60.0,  # Frames quieter than this skip inference
+    "min_silence_seconds": 2.0,     # Shorter gaps are separated as usual
+    "silence_pad_seconds": 0.5,     # Context kept around audible regions
+    "fingerprint_index": os.path.join("audio_cache", "fingerprints.sqlite"),  # None disables dedupe
+    "fingerprint_max_ber": 0.15,    # Bit error rate below which two tracks are the same recording
+    "reuse_duplicate_stems": False, # Opt in to serving an indexed duplicate's stems instead of separating
+    "playback_root": "playback_tracks",
+    "blob_store": os.path.join("playback_tracks", ".blobs"),  # Content-addressed outputs (None disables)
+    "disk_budget_gb": None,         # Storage manager budget for outputs and caches (None = unlimited)
+    "backfill_ledger": os.path.join("audio_cache", "backfill.sqlite"),
+    "backfill_cpu_share": 0.5,      # Fraction of cores the library backfill may use
+    "backfill_io_mb_per_sec": None, # Input read rate cap for the backfill (None = unlimited)
+    "journal_dir": os.path.join("audio_cache", "journal"),  # Write-ahead journals of unfinished jobs
+    "separation_tier": "standard",  # Default tier: draft, standard or studio
+    "preview_seconds": 45.0,        # Excerpt length separated first in progressive mode
+    "preview_tier": "draft",
+    "embedding_index": os.path.join("audio_cache", "embeddings.sqlite"),  # MFCC similarity index (None disables)
+    "variant_cache_dir": os.path.join("audio_cache", "variants"),
+    "variant_cache_budget_mb": 8192,  # Pitch/tempo variants of DJ-ready files
+    "hls_package": True,            # Write HLS renditions next to DJ-ready and preview WAVs
+    "hls_segment_seconds": 4,
+    "hls_bitrate": "192k",
+    "reject_bad_inputs": False,     # Fail jobs whose input scan finds one of reject_issues
+    "reject_issues": ["truncated", "clipping", "dc_offset"],
+    "max_clipped_ratio": 0.001,     # Share of full-scale samples tolerated
+    "max_dc_offset": 0.01,
+    "min_mono_correlation": -0.2    # Below this L/R correlation the mix collapses in mono
+}
+
+
+def load_config(config_path=CONFIG_PATH):
+    """Load service configuration, falling back to defaults for missing keys"""
+    config = dict(DEFAULT_CONFIG)
+    if config_path and os.path.exists(config_path):
+        try:
+            with open(config_path) as f:
+                config.update(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable config {config_path}: {e}")
+    return config
+
+
+def save_config(updates, config_path=CONFIG_PATH):
+    """Merge updates into the config file and return the stored config"""
+    stored = {}
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            stored = json.load(f)
+    stored.update(updates)
+    with open(config_path, "w") as f:
+        json.dump(stored, f, indent=2)
+    return stored
+
+
+def available_cores(config=None):
+    """Cores this process may run on, honouring an explicit cpu_affinity list"""
+    if config and config.get("cpu_affinity"):
+        return [int(c) for c in config["cpu_affinity"]]
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def worker_cores(config, worker_index=None):
+    """
+    Cores a worker should be pinned to
+    With pin_workers each worker gets a contiguous slice of intra_op_threads cores
+    """
+    cores = available_cores(config)
+    threads = int(config.get("intra_op_threads") or 0)
+    if config.get("pin_workers") and worker_index is not None and threads > 0:
+        start = (worker_index * threads) % len(cores)
+        return cores[start:start + threads] or cores
+    if config.get("cpu_affinity"):
+        return cores
+    return None
+
+
+def configure_runtime(config, worker_index=None):
+    """
+    Apply TensorFlow thread counts and CPU pinning
+    Must run before the Spleeter model is loaded for the thread settings to take effect
+    With a multi-worker config the thread counts are one worker's share of the cores, so they
+    apply only to processes started as a pool worker (worker_index set); others keep the defaults
+    """
+    intra_op = int(config.get("intra_op_threads") or 0)
+    inter_op = int(config.get("inter_op_threads") or 0)
+    if worker_index is None and int(config.get("workers") or 1) > 1:
+        intra_op = inter_op = 0
+
+    if intra_op or inter_op:
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+        except RuntimeError as e:
+            logger.warning(f"TensorFlow already initialized, thread settings ignored: {e}")
+
+    cores = worker_cores(config, worker_index)
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    logger.info(f"Runtime configured: intra_op={intra_op or 'auto'} inter_op={inter_op or 'auto'} "
+                f"cores={cores or 'all'}")
+
+
+def content_hash(file_path, chunk_size=1 << 20):
+    """SHA-256 of a file's bytes, read in chunks so large uploads never sit in memory"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_stem_file(track_dir, stem, prefix=None):
+    """Locate a stem written by separate_vocals in a track output directory"""
+    suffix = STEM_SUFFIXES[stem]
+    if prefix:
+        path = os.path.join(track_dir, f"{prefix}{suffix}")
+        return path if os.path.exists(path) else None
+    matches = sorted(glob.glob(os.path.join(glob.escape(track_dir), "**", f"*{suffix}"), recursive=True))
+    return matches[0] if matches else None
+
+
+def db_to_gain(gain_db):
+    """Convert a dB value (or '-inf' for mute) to a linear gain"""
+    gain_db = float(gain_db)
+    return 0.0 if gain_db == float("-inf") else 10.0 ** (gain_db / 20.0)
+
+
+def gain_db_for_json(gain_db):
+    """A dB value as reported in results: JSON has no infinity, so a mute stays the string '-inf'"""
+    gain_db = float(gain_db)
+    return "-inf" if gain_db == float("-inf") else gain_db
+
+
+def read_window(audio_file_path, start_seconds, duration_seconds):
+    """
+    Decode only a window of a file by seeking; a negative start counts from the end
+    Returns float32 (frames, channels) and the sample rate
+    """
+    try:
+        with sf.SoundFile(audio_file_path) as f:
+            start = int(start_seconds * f.samplerate)
+            if start < 0:
+                start = max(0, f.frames + start)
+            f.seek(min(start, f.frames))
+            return f.read(int(duration_seconds * f.samplerate), dtype='float32', always_2d=True), f.samplerate
+    except RuntimeError:
+        # Formats libsndfile cannot open are seeked by ffmpeg instead
+        if start_seconds < 0:
+            start_seconds = max(0.0, librosa.get_duration(path=audio_file_path) + start_seconds)
+        waveform, sample_rate = AudioAdapter.default().load(audio_file_path, offset=start_seconds,
+                                                            duration=duration_seconds, dtype=np.float32)
+        return waveform, int(sample_rate)  # the ffmpeg adapter reports the native rate as a string
+
+
+def _match_format(waveform, sample_rate, target_rate, target_channels):
+    """Resample and up/down-mix a window so two tracks can be mixed"""
+    if sample_rate != target_rate:
+        waveform = librosa.resample(waveform.T, orig_sr=sample_rate, target_sr=target_rate).T
+    if waveform.shape[1] != target_channels:
+        mono = waveform.mean(axis=1, keepdims=True)
+        waveform = np.repeat(mono, target_channels, axis=1)
+    return np.ascontiguousarray(waveform, dtype=np.float32)
+
+
+def _audible_bounds(waveform, threshold_db=TRANSITION_SILENCE_DB):
+    """First and last sample index above the silence threshold"""
+    audible = np.flatnonzero(np.abs(waveform).max(axis=1) > 10.0 ** (threshold_db / 20.0))
+    if not len(audible):
+        return 0, len(waveform)
+    return int(audible[0]), int(audible[-1]) + 1
+
+
+def playback_track_audio(track):
+    """DJ-ready file for a playback track record (camelCase from the API or snake_case from the DB)"""
+    for key in ("djReadyTrackUrl", "dj_ready_track_url", "instrumentalTrackUrl",
+                "instrumental_track_url", "originalFileUrl", "original_file_url"):
+        if track.get(key):
+            return track[key]
+    return None
+
+
+def order_setlist(tracks):
+    """Sort playback tracks by setlistPosition, unpositioned tracks last"""
+    def position(track):
+        value = track.get("setlistPosition", track.get("setlist_position"))
+        return (value is None, value if value is not None else 0, track.get("id", 0))
+    return sorted(tracks, key=position)
+
+
+def iter_blocks(waveform, block_frames=LOUDNESS_BLOCK_FRAMES):
+    """Walk a (frames, channels) buffer, memory-mapped or not, in fixed-size blocks"""
+    for start in range(0, len(waveform), block_frames):
+        yield np.asarray(waveform[start:start + block_frames], dtype=np.float32)
+
+
+def downmix(waveform, block_frames=LOUDNESS_BLOCK_FRAMES):
+    """
+    Float32 mono of a (frames, channels) buffer, averaged block by block into one output array
+    Neither a transposed copy nor a float64 intermediate of the whole buffer is ever built
+    """
+    if waveform.ndim == 1:
+        return np.ascontiguousarray(waveform, dtype=np.float32)
+    if waveform.shape[1] == 1:
+        return np.ascontiguousarray(waveform[:, 0], dtype=np.float32)
+    mono = np.empty(len(waveform), dtype=np.float32)
+    for start in range(0, len(waveform), block_frames):
+        np.mean(waveform[start:start + block_frames], axis=1, dtype=np.float32,
+                out=mono[start:start + block_frames])
+    return mono
+
+
+def k_weighting_sos(sample_rate):
+    """
+    BS.1770 K-weighting (pre-filter shelf, then the RLB high-pass) as second-order sections
+    Uses the bilinear parametrisation the libebur128 constants belong to, so the BS.1770
+    48 kHz coefficients are reproduced exactly and other rates get the same analogue response
+    """
+    # Stage 1: high shelf, +4 dB above ~1.7 kHz
+    k = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10.0 ** (3.999843853973347 / 20.0)
+    vb = vh ** 0.4996667741545416
+    a0 = 1.0 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2.0 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0]
+
+    # Stage 2: RLB high-pass at ~38 Hz
+    k = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1.0 + k / q + k * k
+    high_pass = [1.0, -2.0, 1.0, 1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0]
+    return np.array([shelf, high_pass])
+
+
+class LoudnessMeter:
+    """
+    Block-streaming integrated loudness, loudness range and true peak
+    Feed (frames, channels) float32 blocks to process(), then call result()
+    Only one mean-square value per channel per 100 ms is kept, so memory stays flat
+    """
+
+    def __init__(self, sample_rate, channels):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sos = k_weighting_sos(sample_rate)
+        self.zi = np.zeros((2, 2, channels))
+        self.step = int(round(0.1 * sample_rate))
+        self.pending = np.zeros((0, channels))
+        self.powers = []
+        # Surround channels are weighted +1.5 dB; in 5.1 (L R C LFE Ls Rs) the LFE is not measured
+        self.weights = np.ones(channels)
+        if channels >= 6:
+            self.weights[3] = 0.0
+            self.weights[4:6] = 1.41
+        elif channels == 5:
+            self.weights[3:5] = 1.41
+
+        # True peak: 4x polyphase oversampling below 96 kHz
+        self.oversample = 4 if sample_rate < 96000 else 2
+        # A float32 kernel keeps the 4x upsampled block float32 as well
+        self.fir = (signal.firwin(TRUE_PEAK_TAPS, 1.0 / self.oversample) * self.oversample).astype(np.float32)
+        self.history = np.zeros((TRUE_PEAK_TAPS // self.oversample + 1, channels), dtype=np.float32)
+        self.true_peak = 0.0
+        self.frames = 0
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim == 1:
+            block = block[:, None]
+        self.frames += len(block)
+
+        filtered, self.zi = signal.sosfilt(self.sos, block, axis=0, zi=self.zi)
+        squares = np.concatenate([self.pending, filtered ** 2])
+        usable = len(squares) // self.step * self.step
+        if usable:
+            self.powers.append(squares[:usable].reshape(-1, self.step, self.channels).mean(axis=1))
+        self.pending = squares[usable:]
+
+        # Oversample with enough history that no interpolated sample near a block edge is missed
+        extended = np.concatenate([self.history, block])
+        upsampled = signal.upfirdn(self.fir, extended, up=self.oversample, axis=0)
+        valid = upsampled[len(self.fir) - 1:self.oversample * (len(extended) - 1) + 1]
+        if len(valid):
+            self.true_peak = max(self.true_peak, float(np.abs(valid).max()))
+        self.history = extended[-len(self.history):]
+
+    def _gated_loudness(self, block_powers, relative_gate):
+        """Loudness of blocks surviving the absolute and relative gates"""
+        loudness = -0.691 + 10.0 * np.log10(np.maximum(block_powers, 1e-12))
+        kept = loudness > LOUDNESS_ABSOLUTE_GATE
+        if not kept.any():
+            return None, loudness[:0]
+        threshold = -0.691 + 10.0 * np.log10(block_powers[kept].mean()) + relative_gate
+        kept &= loudness > threshold
+        return block_powers[kept], loudness[kept]
+
+    def _window_powers(self, powers, steps, hop):
+        """Channel-weighted mean square over windows of `steps` 100 ms steps"""
+        if len(powers) < steps:
+            return np.zeros(0)
+        cumulative = np.concatenate([np.zeros((1, self.channels)), np.cumsum(powers, axis=0)])
+        starts = np.arange(0, len(powers) - steps + 1, hop)
+        means = (cumulative[starts + steps] - cumulative[starts]) / steps
+        return means @ self.weights
+
+    def result(self):
+        powers = np.concatenate(self.powers) if self.powers else np.zeros((0, self.channels))
+
+        # Integrated: 400 ms blocks, 75% overlap, -10 LU relative gate
+        gated, _ = self._gated_loudness(self._window_powers(powers, 4, 1), -10.0)
+        integrated = None
+        if gated is not None and len(gated):
+            integrated = float(-0.691 + 10.0 * np.log10(gated.mean()))
+
+        # Loudness range: 3 s short-term blocks, -20 LU relative gate, P95 - P10
+        _, short_term = self._gated_loudness(self._window_powers(powers, 30, 1), -20.0)
+        loudness_range = None
+        if len(short_term):
+            low, high = np.percentile(short_term, [10, 95])
+            loudness_range = float(high - low)
+
+        true_peak = float(20.0 * np.log10(self.true_peak)) if self.true_peak > 0 else None
+        return {
+            "integrated_lufs": None if integrated is None else round(integrated, 2),
+            "loudness_range_lu": None if loudness_range is None else round(loudness_range, 2),
+            "true_peak_dbtp": None if true_peak is None else round(true_peak, 2)
+        }
+
+
+def measure_loudness(blocks, sample_rate, channels):
+    """Run a LoudnessMeter over an iterable of blocks"""
+    meter = LoudnessMeter(sample_rate, channels)
+    for block in blocks:
+        meter.process(block)
+    return meter.result()
+
+
+def measure_file_loudness(audio_file_path):
+    """Loudness of a file on disk, read block by block"""
+    with sf.SoundFile(audio_file_path) as f:
+        return measure_loudness(
+            f.blocks(blocksize=LOUDNESS_BLOCK_FRAMES, dtype='float32', always_2d=True),
+            f.samplerate, f.channels
+        )
+
+
+def declared_frames(audio_file_path):
+    """
+    Frame count promised by the file header, or None when unknown
+    WAV data chunks are read directly because libsndfile silently clamps them to the file size
+    """
+    try:
+        with open(audio_file_path, "rb") as f:
+            head = f.read(12)
+            if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+                block_align = None
+                while True:
+                    chunk = f.read(8)
+                    if len(chunk) < 8:
+                        return None
+                    chunk_id, size = struct.unpack('<4sI', chunk)
+                    if chunk_id == b'fmt ':
+                        block_align = struct.unpack('<H', f.read(size)[12:14])[0]
+                        f.seek(size & 1, 1)
+                    elif chunk_id == b'data':
+                        # Streamed WAVs leave the size unset
+                        if not block_align or size in (0, 0xFFFFFFFF):
+                            return None
+                        return size // block_align
+                    else:
+                        f.seek(size + (size & 1), 1)
+        return sf.info(audio_file_path).frames
+    except (OSError, RuntimeError, struct.error):
+        return None
+
+
+def scan_quality(waveform, sample_rate, expected_frames=None):
+    """
+    Clipping, DC offset, truncation and mono compatibility of a decoded (frames, channels) buffer
+    One block-wise pass with float64 accumulators, so memory-mapped buffers are never copied whole
+    """
+    frames, channels = waveform.shape
+    clipped = clipped_runs = 0
+    sums = np.zeros(channels)
+    squares = np.zeros(channels)
+    cross = 0.0
+    for block in iter_blocks(waveform):
+        full_scale = np.abs(block) >= CLIP_LEVEL
+        block_clipped = int(np.count_nonzero(full_scale))
+        clipped += block_clipped
+        if block_clipped:
+            edges = np.diff(np.pad(full_scale, ((1, 1), (0, 0))).astype(np.int8), axis=0).T
+            run_lengths = np.nonzero(edges == -1)[1] - np.nonzero(edges == 1)[1]
+            clipped_runs += int(np.count_nonzero(run_lengths >= CLIP_RUN))
+        sums += block.sum(axis=0, dtype=np.float64)
+        squares += np.einsum('ij,ij->j', block, block, dtype=np.float64)
+        if channels >= 2:
+            cross += float(np.dot(block[:, 0].astype(np.float64), block[:, 1]))
+
+    report = {
+        "frames": int(frames),
+        "clipped_samples": clipped,
+        "clipped_runs": clipped_runs,
+        "clipped_ratio": round(clipped / float(max(1, frames * channels)), 6),
+        "dc_offset": [round(float(v), 5) for v in sums / max(1, frames)]
+    }
+
+    # Truncation: fewer frames than the header promised, or audio that stops at full level
+    report["truncated_frames"] = max(0, int(expected_frames) - frames) if expected_frames else 0
+    tail = np.asarray(waveform[-max(1, int(ABRUPT_END_SECONDS * sample_rate)):], dtype=np.float32)
+    tail_db = 10.0 * np.log10(float(np.mean(tail ** 2)) + 1e-12) if frames else -120.0
+    report["ends_abruptly"] = bool(tail_db > ABRUPT_END_DB)
+
+    if channels >= 2:
+        mean = sums[:2] / max(1, frames)
+        variance = squares[:2] / max(1, frames) - mean ** 2
+        covariance = cross / max(1, frames) - mean[0] * mean[1]
+        report["mono_correlation"] = round(float(covariance / np.sqrt(max(variance.prod(), 1e-20))), 4)
+        # Level of the mono fold-down relative to the stereo channels
+        mono_energy = (squares[0] + squares[1] + 2.0 * cross) / 4.0
+        report["mono_fold_db"] = round(float(10.0 * np.log10((mono_energy + 1e-12) /
+                                                             ((squares[0] + squares[1]) / 2.0 + 1e-12))), 2)
+    return report
+
+
+def find_audible_regions(waveform, sample_rate, threshold_db=-60.0, min_silence_seconds=2.0, pad_seconds=0.5):
+    """
+    Frame-wise RMS silence detector
+    Returns (start, end) frame ranges worth separating; silent gaps shorter than
+    min_silence_seconds are kept so inference sees continuous material
+    """
+    frames = len(waveform)
+    count = -(-frames // SILENCE_FRAME)
+    if count <= 1:
+        return [(0, frames)] if frames else []
+
+    # Mean power per frame across channels; the short last frame is measured on its own
+    full = frames // SILENCE_FRAME
+    blocks = waveform[:full * SILENCE_FRAME].reshape(full, -1)
+    power = np.einsum('ij,ij->i', blocks, blocks) / blocks.shape[1]
+    if count > full:
+        tail = np.asarray(waveform[full * SILENCE_FRAME:], dtype=np.float32)
+        power = np.append(power, np.mean(tail * tail))
+    audible = power > 10.0 ** (threshold_db / 10.0)
+
+    pad = int(pad_seconds * sample_rate / SILENCE_FRAME)
+    min_gap = int(min_silence_seconds * sample_rate / SILENCE_FRAME)
+
+    # Run boundaries of the audible mask
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], audible.astype(np.int8), [0]])))
+    regions = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        start, end = max(0, start - pad), end + pad
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    return [(int(start) * SILENCE_FRAME, min(int(end) * SILENCE_FRAME, frames)) for start, end in regions]
+
+
+def spectral_vocal_activity(spectrogram, sample_rate):
+    """
+    Per-frame vocal likelihood when no vocals stem exists yet:
+    most of the energy sits in the vocal band and the frame is not near-silent
+    """
+    freqs = librosa.fft_frequencies(sr=sample_rate, n_fft=ANALYSIS_N_FFT)
+    power = spectrogram ** 2
+    total = power.sum(axis=0) + 1e-10
+    band = power[(freqs >= VOCAL_BAND_HZ[0]) & (freqs <= VOCAL_BAND_HZ[1])].sum(axis=0)
+    loud = librosa.power_to_db(total, ref=np.max) > -30.0
+    return (band / total > 0.5) & loud
+
+
+def stem_vocal_activity(vocals, sample_rate, frame_count):
+    """Per-frame vocal activity from a separated vocals stem, on the analysis frame grid"""
+    rms = librosa.feature.rms(y=downmix(vocals), frame_length=ANALYSIS_N_FFT, hop_length=ANALYSIS_HOP)[0]
+    active = librosa.amplitude_to_db(rms, ref=np.max) > -30.0
+    active = active[:frame_count]
+    return np.pad(active, (0, frame_count - len(active)))
+
+
+def vocal_heavy_window(waveform, sample_rate, seconds):
+    """
+    (start, end) frames of the window with the most vocal-band energy
+    Used to pick the preview excerpt before any stem exists
+    """
+    frames = len(waveform)
+    length = min(frames, int(seconds * sample_rate))
+    if length >= frames:
+        return 0, frames
+    spectrogram = np.abs(librosa.stft(downmix(waveform), n_fft=ANALYSIS_N_FFT, hop_length=ANALYSIS_HOP))
+    weight = spectral_vocal_activity(spectrogram, sample_rate) * (spectrogram ** 2).sum(axis=0)
+    window = max(1, length // ANALYSIS_HOP)
+    totals = np.convolve(weight, np.ones(window), mode="valid")
+    start = int(np.argmax(totals)) * ANALYSIS_HOP if totals.any() else (frames - length) // 2
+    start = min(start, frames - length)
+    return start, start + length
+
+
+def find_hook(mono, sample_rate, seconds=30.0):
+    """
+    Most repeated section of a (decimated) mono signal, as (start_seconds, end_seconds, score)
+    Each candidate segment is scored by its best match along the diagonals of the chroma
+    self-similarity matrix, weighted towards louder sections
+    """
+    hop = max(HOOK_HOP, -(-len(mono) // HOOK_MAX_FRAMES // 512) * 512)
+    chroma = librosa.feature.chroma_stft(y=mono, sr=sample_rate, n_fft=HOOK_HOP, hop_length=hop)
+    rms = librosa.feature.rms(y=mono, frame_length=HOOK_HOP, hop_length=hop)[0][:chroma.shape[1]]
+    frame_seconds = hop / float(sample_rate)
+    n = chroma.shape[1]
+    length = max(1, int(round(seconds / frame_seconds)))
+    if n <= length:
+        return 0.0, n * frame_seconds, 0.0
+
+    # Cosine similarity; silent frames match nothing
+    chroma = chroma.astype(np.float32)
+    chroma /= np.linalg.norm(chroma, axis=0, keepdims=True) + 1e-6
+    chroma[:, rms < rms.max() * 1e-3] = 0.0
+    similarity = chroma.T @ chroma
+
+    # Repetition score of the segment starting at each frame: best mean similarity along any lag
+    repetition = np.zeros(n - length + 1, dtype=np.float32)
+    for lag in range(max(1, length // 2), n - length + 1):
+        sums = np.concatenate([[0.0], np.cumsum(np.diagonal(similarity, lag))])
+        means = ((sums[length:] - sums[:-length]) / length).astype(np.float32)
+        np.maximum(repetition[:len(means)], means, out=repetition[:len(means)])
+        np.maximum(repetition[lag:lag + len(means)], means, out=repetition[lag:lag + len(means)])
+
+    sums = np.concatenate([[0.0], np.cumsum(rms)])
+    energy = (sums[length:] - sums[:-length]) / length
+    score = repetition * (0.5 + 0.5 * energy / (energy.max() + 1e-10))
+    start = int(np.argmax(score))
+    return start * frame_seconds, (start + length) * frame_seconds, float(score[start])
+
+
+def extract_excerpt(audio_file_path, start_seconds, duration_seconds, output_path, fade_seconds=HOOK_FADE_SECONDS):
+    """Seek to and decode only the excerpt, fade its edges and encode it by output extension"""
+    waveform, sample_rate = read_window(audio_file_path, start_seconds, duration_seconds)
+    fade = min(int(fade_seconds * sample_rate), len(waveform) // 2)
+    if fade:
+        ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, None]
+        waveform[:fade] *= ramp
+        waveform[-fade:] *= ramp[::-1]
+
+    output_format = os.path.splitext(output_path)[1].lstrip(".").lower()
+    if output_format == "wav":
+        return write_wav_atomic(output_path, waveform, sample_rate)
+    tmp_path = os.path.join(os.path.dirname(output_path), f".{os.path.basename(output_path)}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            encode_stream(waveform, sample_rate, f, output_format)
+        _replace_durably(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return output_path
+
+
+def _moving_average(values, width):
+    width = max(1, min(int(width), len(values)))
+    return np.convolve(values, np.ones(width) / width, mode="same")
+
+
+def compute_cue_points(features):
+    """
+    Suggested cue points in seconds, snapped to bar lines of the beat grid:
+    intro end, first sustained vocal entry and outro start
+    """
+    frame_seconds = ANALYSIS_HOP / float(features["sample_rate"])
+    energy = _moving_average(features["energy_db"], CUE_SMOOTHING_SECONDS / frame_seconds)
+    if not len(energy):
+        return {"intro_end": None, "first_vocal": None, "outro_start": None}
+
+    full = np.flatnonzero(energy >= np.median(energy) - CUE_ENERGY_DROP_DB)
+    intro_end = full[0] * frame_seconds if len(full) else 0.0
+    outro_start = full[-1] * frame_seconds if len(full) else len(energy) * frame_seconds
+
+    # First vocal entry: activity sustained for most of a one-second window
+    width = max(1, int(CUE_MIN_VOCAL_SECONDS / frame_seconds))
+    sustained = np.convolve(features["vocal_activity"].astype(np.float32), np.ones(width), mode="valid")
+    entries = np.flatnonzero(sustained >= 0.8 * width)
+    first_vocal = entries[0] * frame_seconds if len(entries) else None
+    if first_vocal is not None:
+        intro_end = min(intro_end, first_vocal)
+        last_vocal = (entries[-1] + width) * frame_seconds
+        outro_start = max(outro_start, last_vocal)
+
+    bars = np.asarray(features["beat_times"])[::BEATS_PER_BAR]
+
+    def snap(seconds, latest=None):
+        """Nearest bar line, but never after latest (unsnapped when no bar line qualifies)"""
+        if seconds is None:
+            return None
+        candidates = bars if latest is None else bars[bars <= latest]
+        if len(candidates):
+            seconds = candidates[np.abs(candidates - seconds).argmin()]
+        return round(float(seconds), 3)
+
+    return {
+        # The intro must end before the vocal comes in, even if a later bar line is nearer
+        "intro_end": snap(intro_end, first_vocal),
+        "first_vocal": round(float(first_vocal), 3) if first_vocal is not None else None,
+        "outro_start": snap(outro_start)
+    }
+
+
+def write_cues_sidecar(audio_file_path, features, cue_points):
+    """Write the beat grid and cue points as a compact JSON sidecar for static serving"""
+    sidecar_path = f"{audio_file_path}.cues.json"
+    payload = {
+        "version": 1,
+        "bpm": round(features["bpm"], 2),
+        "beats_per_bar": BEATS_PER_BAR,
+        "beats": [round(float(t), 3) for t in features["beat_times"]],
+        "cues": cue_points
+    }
+    tmp_path = f"{sidecar_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f, separators=(",", ":"))
+    os.replace(tmp_path, sidecar_path)
+    return sidecar_path
+
+
+def global_tempo(onset_envelope, sample_rate):
+    """
+    Global tempo exactly as librosa.feature.tempo estimates it, with the mean autocorrelation
+    tempogram accumulated over blocks of frames instead of materialising the full
+    (window x frames) float64 tempogram and its FFT buffers
+    """
+    win_length = int(librosa.time_to_frames(TEMPO_WINDOW_SECONDS, sr=sample_rate, hop_length=ANALYSIS_HOP))
+    frames = len(onset_envelope)
+    padded = np.pad(onset_envelope, win_length // 2, mode="linear_ramp", end_values=[0, 0])
+    total = np.zeros(win_length)
+    for start in range(0, frames, ANALYSIS_BLOCK_COLUMNS):
+        count = min(ANALYSIS_BLOCK_COLUMNS, frames - start)
+        tempogram = librosa.feature.tempogram(onset_envelope=padded[start:start + count + win_length - 1],
+                                              sr=sample_rate, hop_length=ANALYSIS_HOP,
+                                              win_length=win_length, center=False)
+        total += tempogram[:, :count].sum(axis=1)
+    mean = (total / max(frames, 1))[:, None]
+    return float(librosa.feature.tempo(tg=mean, sr=sample_rate, hop_length=ANALYSIS_HOP)[0])
+
+
+def energy_features(spectrogram, onset_envelope, sample_rate):
+    """
+    Energy curve and summary features from the shared spectrogram and onset envelope
+    Spectral flux is normalized by the mean magnitude so it does not depend on level
+    """
+    rms = librosa.feature.rms(S=spectrogram, frame_length=ANALYSIS_N_FFT)[0]
+    duration = len(rms) * ANALYSIS_HOP / float(sample_rate)
+    bounds = np.linspace(0, len(rms), min(ENERGY_CURVE_POINTS, len(rms)) + 1).astype(int)
+    curve = np.add.reduceat(rms, bounds[:-1]) / np.diff(bounds)
+    onsets = librosa.onset.onset_detect(onset_envelope=onset_envelope, sr=sample_rate, hop_length=ANALYSIS_HOP)
+    flux = np.maximum(np.diff(spectrogram, axis=1), 0.0).sum(axis=0)
+    return {
+        "mean_rms_db": round(float(librosa.amplitude_to_db(np.atleast_1d(rms.mean()))[0]), 2),
+        "onset_density": round(len(onsets) / duration, 3) if duration else 0.0,
+        "spectral_flux": round(float(flux.mean() / (spectrogram.sum(axis=0).mean() + 1e-10)), 4) if len(flux) else 0.0,
+        "curve_db": [round(float(v), 1) for v in librosa.amplitude_to_db(curve)]
+    }
+
+
+def camelot_code(tonic, mode):
+    """Camelot wheel position of a key, e.g. (9, 'minor') -> '8A' for A minor"""
+    major_tonic = tonic if mode == "major" else (tonic + 3) % 12
+    number = (7 * major_tonic + 7) % 12 + 1
+    return f"{number}{'B' if mode == 'major' else 'A'}"
+
+
+def mean_chroma(spectrogram, sample_rate):
+    """
+    Mean of librosa.feature.chroma_stft over the shared spectrogram, computed block by block
+    Tuning estimation and chroma projection are per-frame, so only the sparse pitch peaks
+    and one block of power spectrum are held at a time instead of several float64 copies
+    """
+    columns = spectrogram.shape[1]
+    pitches, magnitudes = [], []
+    for start in range(0, columns, ANALYSIS_BLOCK_COLUMNS):
+        pitch, magnitude = librosa.piptrack(S=spectrogram[:, start:start + ANALYSIS_BLOCK_COLUMNS] ** 2,
+                                            sr=sample_rate, n_fft=ANALYSIS_N_FFT)
+        peaks = pitch > 0
+        pitches.append(pitch[peaks])
+        magnitudes.append(magnitude[peaks])
+    pitches, magnitudes = np.concatenate(pitches), np.concatenate(magnitudes)
+    threshold = np.median(magnitudes) if len(magnitudes) else 0.0
+    tuning = librosa.pitch_tuning(pitches[magnitudes >= threshold], bins_per_octave=12)
+
+    filters = librosa.filters.chroma(sr=sample_rate, n_fft=ANALYSIS_N_FFT, tuning=tuning).astype(np.float32)
+    total = np.zeros(12)
+    for start in range(0, columns, ANALYSIS_BLOCK_COLUMNS):
+        raw = filters @ spectrogram[:, start:start + ANALYSIS_BLOCK_COLUMNS] ** 2
+        total += librosa.util.normalize(raw, norm=np.inf, axis=0).sum(axis=1)
+    return total / max(columns, 1)
+
+
+def detect_key(spectrogram, sample_rate):
+    """Key from the mean chroma of the shared spectrogram, by correlation with all 24 key profiles"""
+    chroma = mean_chroma(spectrogram, sample_rate)
+    profiles = np.stack([np.roll(profile, tonic) for profile in (MAJOR_PROFILE, MINOR_PROFILE) for tonic in range(12)])
+    profiles = (profiles - profiles.mean(axis=1, keepdims=True)) / profiles.std(axis=1, keepdims=True)
+    centered = (chroma - chroma.mean()) / (chroma.std() + 1e-10)
+    correlation = profiles @ centered / 12.0
+    best = int(np.argmax(correlation))
+    tonic, mode = best % 12, ("major", "minor")[best // 12]
+    return {
+        "tonic": PITCH_CLASSES[tonic],
+        "mode": mode,
+        "camelot": camelot_code(tonic, mode),
+        "confidence": round(float(correlation[best]), 3)
+    }
+
+
+def compatibility_matrices(analyses):
+    """
+    Pairwise mixing compatibility (from row track into column track) for analysis summaries
+    Returns Camelot key distance, tempo ratio folded to the nearest half/double time, and loudness delta
+    """
+    camelot = [a.get("key", {}).get("camelot") for a in analyses]
+    numbers = np.array([int(c[:-1]) if c else -1 for c in camelot])
+    letters = np.array([c[-1] if c else "" for c in camelot])
+    steps = np.abs(numbers[:, None] - numbers[None, :])
+    key_distance = np.minimum(steps, 12 - steps) + (letters[:, None] != letters[None, :])
+    key_distance = np.where((numbers[:, None] < 0) | (numbers[None, :] < 0), -1, key_distance)
+
+    bpm = np.array([a.get("bpm") or np.nan for a in analyses], dtype=np.float64)
+    ratio = bpm[None, :] / bpm[:, None]
+    folded = ratio * 2.0 ** -np.round(np.log2(ratio))
+
+    lufs = np.array([np.nan if a.get("integrated_lufs") is None else a["integrated_lufs"] for a in analyses])
+    loudness_delta = lufs[None, :] - lufs[:, None]
+
+    compatible = (key_distance >= 0) & (key_distance <= MIX_MAX_KEY_DISTANCE) & \
+        (np.abs(folded - 1.0) <= MIX_BPM_TOLERANCE)
+    return {
+        "key_distance": key_distance,
+        "bpm_ratio": folded,
+        "loudness_delta_lu": loudness_delta,
+        "compatible": compatible
+    }
+
+
+def write_analysis_sidecar(audio_file_path, analysis):
+    """Write the track-level analysis summary (tempo, loudness, energy) next to the audio"""
+    sidecar_path = f"{audio_file_path}.analysis.json"
+    payload = {"version": 1}
+    payload.update({key: analysis[key] for key in ("duration", "bpm", "integrated_lufs", "loudness_range_lu",
+                                                   "true_peak_dbtp", "key", "energy") if key in analysis})
+    tmp_path = f"{sidecar_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f, separators=(",", ":"))
+    os.replace(tmp_path, sidecar_path)
+    return sidecar_path
+
+
+def read_analysis_sidecar(audio_file_path):
+    """Cached analysis summary, or None if missing or older than the audio"""
+    sidecar_path = f"{audio_file_path}.analysis.json"
+    try:
+        if os.path.getmtime(sidecar_path) < os.path.getmtime(audio_file_path):
+            return None
+        with open(sidecar_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def energy_scores(analyses):
+    """0..1 energy score per track: z-scored RMS level, onset density and flux, averaged and rescaled"""
+    matrix = np.array([[a["energy"]["mean_rms_db"], a["energy"]["onset_density"], a["energy"]["spectral_flux"]]
+                       for a in analyses], dtype=np.float64)
+    z = (matrix - matrix.mean(axis=0)) / (matrix.std(axis=0) + 1e-9)
+    score = z.mean(axis=1)
+    span = score.max() - score.min()
+    return (score - score.min()) / span if span > 0 else np.full(len(score), 0.5)
+
+
+def target_arc(arc, count):
+    """Target energy per setlist position: a named shape or a list of values interpolated to count"""
+    x = np.linspace(0.0, 1.0, count)
+    if isinstance(arc, str) and arc in ENERGY_ARCS:
+        return ENERGY_ARCS[arc](x).astype(np.float64)
+    points = np.asarray([float(v) for v in (arc.split(",") if isinstance(arc, str) else arc)])
+    return np.interp(x, np.linspace(0.0, 1.0, len(points)), points)
+
+
+def order_by_energy(scores, bpms, target):
+    """
+    Setlist order matching a target energy arc
+    The arc is fitted exactly with linear_sum_assignment, then neighbouring swaps that reduce
+    the combined arc error and tempo jumps are applied until none helps
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    cost = (scores[:, None] - target[None, :]) ** 2
+    rows, cols = linear_sum_assignment(cost)
+    order = rows[np.argsort(cols)]
+
+    log_bpm = np.log2(np.maximum(np.asarray(bpms, dtype=np.float64), 1.0))
+
+    def total(order):
+        arc_error = cost[order, np.arange(len(order))].sum()
+        return arc_error + SETLIST_BPM_WEIGHT * np.abs(np.diff(log_bpm[order])).sum()
+
+    best = total(order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(order) - 1):
+            candidate = order.copy()
+            candidate[i], candidate[i + 1] = candidate[i + 1], candidate[i]
+            candidate_cost = total(candidate)
+            if candidate_cost < best - 1e-12:
+                order, best, improved = candidate, candidate_cost, True
+    return order, best
+
+
+def compute_fingerprint(mel_db, sample_rate):
+    """
+    Compact fingerprint from the analysis mel spectrogram
+    Returns uint32 sub-fingerprints (sign of band-energy differences across frequency and time,
+    resampled to a fixed frame rate) and a unit-length spectral-shape summary for fast lookup
+    """
+    centers = librosa.mel_frequencies(n_mels=mel_db.shape[0] + 2, fmax=sample_rate / 2.0)[1:-1]
+    rows = np.flatnonzero((centers >= FINGERPRINT_BAND_HZ[0]) & (centers <= FINGERPRINT_BAND_HZ[1]))
+    bands = np.stack([mel_db[group].mean(axis=0) for group in np.array_split(rows, FINGERPRINT_BITS + 1)])
+
+    frame_times = np.arange(bands.shape[1]) * ANALYSIS_HOP / float(sample_rate)
+    targets = np.arange(0.0, frame_times[-1] if len(frame_times) else 0.0, 1.0 / FINGERPRINT_RATE)
+    bands = np.stack([np.interp(targets, frame_times, band) for band in bands])
+
+    delta = bands[:-1] - bands[1:]
+    bits = (delta[:, 1:] - delta[:, :-1]) > 0
+    fingerprint = np.packbits(np.ascontiguousarray(bits.T), axis=1, bitorder='little').view('<u4').ravel()
+
+    shape = bands - bands.mean(axis=0)
+    summary = np.concatenate([shape.mean(axis=1), shape.std(axis=1)]).astype(np.float32)
+    summary /= np.linalg.norm(summary) + 1e-9
+    return fingerprint, summary
+
+
+def fingerprint_distance(query, reference, max_shift=FINGERPRINT_MAX_SHIFT):
+    """
+    Lowest bit error rate between the middle of query and reference over time shifts
+    Returns (bit_error_rate, shift_in_frames)
+    """
+    length = min(FINGERPRINT_EXCERPT, len(query), len(reference))
+    if length == 0:
+        return 1.0, 0
+    start = (len(query) - length) // 2
+    first = max(0, start - max_shift)
+    last = min(len(reference) - length, start + max_shift)
+    if last < first:
+        return 1.0, 0
+
+    windows = np.lib.stride_tricks.sliding_window_view(reference[first:last + length], length)
+    errors = POPCOUNT[np.bitwise_xor(windows, query[start:start + length]).view(np.uint8)].sum(axis=1)
+    best = int(errors.argmin())
+    return float(errors[best]) / (FINGERPRINT_BITS * length), first + best - start
+
+
+class FingerprintIndex:
+    """
+    Local SQLite index of audio fingerprints for duplicate detection
+    lookup() ranks all tracks by summary similarity in one matrix product, then confirms
+    the top candidates by fingerprint bit error rate
+    """
+
+    def __init__(self, db_path, max_ber=0.15):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.max_ber = max_ber
+        self.db = sqlite3.connect(db_path, timeout=30)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                id INTEGER PRIMARY KEY,
+                content_hash TEXT UNIQUE,
+                audio_path TEXT,
+                duration REAL,
+                summary BLOB,
+                fingerprint BLOB,
+                analysis TEXT,
+                output_files TEXT,
+                separation_performed INTEGER,
+                created_at TEXT
+            )
+        """)
+        self.db.commit()
+        self._ids = None
+        self._summaries = None
+
+    def _load(self):
+        rows = self.db.execute("SELECT id, summary FROM fingerprints ORDER BY id").fetchall()
+        self._ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self._summaries = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) \
+            if rows else np.zeros((0, 2 * FINGERPRINT_BITS + 2), dtype=np.float32)
+
+    def add(self, content_hash, audio_path, duration, fingerprint, summary,
+            analysis=None, output_files=None, separation_performed=False):
+        """Insert or replace one track"""
+        self.db.execute(
+            "INSERT OR REPLACE INTO fingerprints (content_hash, audio_path, duration, summary, fingerprint, "
+            "analysis, output_files, separation_performed, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (content_hash, audio_path, float(duration), summary.astype(np.float32).tobytes(),
+             fingerprint.astype('<u4').tobytes(), json.dumps(analysis), json.dumps(output_files),
+             int(bool(separation_performed)), time.strftime("%Y-%m-%dT%H:%M:%S"))
+        )
+        self.db.commit()
+        self._ids = None
+
+    def lookup(self, fingerprint, summary, candidates=FINGERPRINT_CANDIDATES):
+        """Best matching indexed track, or None if nothing is within the bit error threshold"""
+        if self._ids is None:
+            self._load()
+        if not len(self._ids):
+            return None
+
+        similarity = self._summaries @ summary.astype(np.float32)
+        count = min(candidates, len(similarity))
+        top = np.argpartition(-similarity, count - 1)[:count]
+
+        best = None
+        for index in top[np.argsort(-similarity[top])]:
+            row = self.db.execute(
+                "SELECT content_hash, audio_path, duration, fingerprint, analysis, output_files, "
+                "separation_performed FROM fingerprints WHERE id = ?", (int(self._ids[index]),)
+            ).fetchone()
+            if row is None:
+                continue
+            ber, shift = fingerprint_distance(fingerprint, np.frombuffer(row[3], dtype='<u4'))
+            if ber <= self.max_ber and (best is None or ber < best["bit_error_rate"]):
+                best = {
+                    "content_hash": row[0],
+                    "audio_path": row[1],
+                    "duration": row[2],
+                    "bit_error_rate": round(ber, 4),
+                    "offset_seconds": round(shift / FINGERPRINT_RATE, 3),
+                    "similarity": round(float(similarity[index]), 4),
+                    "analysis": json.loads(row[4]) if row[4] else None,
+                    "output_files": json.loads(row[5]) if row[5] else None,
+                    "separation_performed": bool(row[6])
+                }
+        return best
+
+
+def mfcc_embedding(mfccs):
+    """Fixed-size track embedding from a (13, frames) MFCC matrix"""
+    deltas = np.diff(mfccs, axis=1) if mfccs.shape[1] > 1 else np.zeros_like(mfccs)
+    return np.concatenate([mfccs.mean(axis=1), mfccs.std(axis=1), deltas.std(axis=1)]).astype(np.float32)
+
+
+class EmbeddingIndex:
+    """
+    Local SQLite index of per-track MFCC embeddings (float16 BLOBs keyed by content hash)
+    Inserts are single-row upserts; queries load the matrix once per database change, z-score
+    every dimension over the catalog and rank by cosine similarity in one matrix-vector product
+    """
+
+    def __init__(self, db_path):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.db = sqlite3.connect(db_path, timeout=30)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                id INTEGER PRIMARY KEY,
+                content_hash TEXT UNIQUE,
+                audio_path TEXT,
+                vector BLOB,
+                created_at TEXT
+            )
+        """)
+        self.db.commit()
+        self._version = None
+        self._tracks = None
+        self._vectors = None
+
+    def _load(self):
+        # data_version changes whenever another connection commits, so other writers are seen too
+        version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if self._tracks is None or version != self._version:
+            rows = self.db.execute("SELECT content_hash, audio_path, vector FROM embeddings ORDER BY id").fetchall()
+            self._tracks = [{"content_hash": row[0], "audio_path": row[1]} for row in rows]
+            self._vectors = np.stack([np.frombuffer(row[2], dtype='<f2') for row in rows]) \
+                if rows else np.zeros((0, EMBEDDING_DIM), dtype=np.float16)
+            self._version = version
+        return self._tracks, self._vectors
+
+    def add_many(self, entries):
+        """Insert or replace (content_hash, audio_path, embedding) entries in one transaction"""
+        created_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO embeddings (content_hash, audio_path, vector, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(content_hash, audio_path, np.asarray(embedding, dtype='<f2').tobytes(), created_at)
+                 for content_hash, audio_path, embedding in entries]
+            )
+        self._tracks = None
+
+    def add(self, content_hash, audio_path, embedding):
+        """Insert or replace one track's embedding"""
+        self.add_many([(content_hash, audio_path, embedding)])
+
+    def get(self, content_hash):
+        row = self.db.execute("SELECT vector FROM embeddings WHERE content_hash = ?", (content_hash,)).fetchone()
+        return np.frombuffer(row[0], dtype='<f2').astype(np.float32) if row else None
+
+    def query(self, embedding, k=10, exclude=None):
+        """The k most similar tracks as dicts with content_hash, audio_path and similarity"""
+        tracks, vectors = self._load()
+        if not tracks:
+            return []
+        vectors = np.asarray(vectors, dtype=np.float32)
+        mean = vectors.mean(axis=0)
+        std = vectors.std(axis=0) + 1e-6
+        normalized = (vectors - mean) / std
+        normalized /= np.linalg.norm(normalized, axis=1, keepdims=True) + 1e-9
+        target = (np.asarray(embedding, dtype=np.float32) - mean) / std
+        target /= np.linalg.norm(target) + 1e-9
+
+        similarity = normalized @ target
+        if exclude is not None:
+            for i, track in enumerate(tracks):
+                if track["content_hash"] == exclude:
+                    similarity[i] = -np.inf
+        k = min(int(k), int(np.isfinite(similarity).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-similarity, k - 1)[:k]
+        top = top[np.argsort(-similarity[top])]
+        return [dict(tracks[i], similarity=round(float(similarity[i]), 4)) for i in top]
+
+
+def link_or_copy(source_path, target_path):
+    """Hard-link a file into place, copying when the filesystem does not allow links"""
+    if os.path.exists(target_path):
+        os.unlink(target_path)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy2(source_path, target_path)
+    return target_path
+
+
+def link_or_copy_tree(source_dir, target_dir):
+    """Hard-link a directory's files (e.g. an HLS rendition) into a fresh directory swapped into place"""
+    tmp_dir = os.path.join(os.path.dirname(target_dir), f".{os.path.basename(target_dir)}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name in os.listdir(source_dir):
+        if os.path.isfile(os.path.join(source_dir, name)):
+            link_or_copy(os.path.join(source_dir, name), os.path.join(tmp_dir, name))
+    old_dir = f"{tmp_dir}.old"
+    if os.path.isdir(target_dir):
+        os.rename(target_dir, old_dir)
+    os.rename(tmp_dir, target_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return target_dir
+
+
+def soundfile_format(path):
+    """libsndfile container for a path's extension (needed when writing under a temp name)"""
+    extension = os.path.splitext(path)[1].lstrip(".").upper()
+    container = {"AIF": "AIFF", "OGA": "OGG"}.get(extension, extension)
+    if container not in sf.available_formats():
+        raise ValueError(f"Unsupported output container: {os.path.splitext(path)[1] or path}")
+    return container
+
+
+def _replace_durably(tmp_path, path):
+    """fsync a finished temp file and rename it over path, so readers see all or nothing"""
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class HlsPackager:
+    """
+    Encodes PCM blocks into an HLS rendition (AAC segments + index.m3u8) as they are produced
+    Fed from the same block loop that writes the WAV, so the audio is only walked once. The
+    rendition is built in a hidden directory and swapped in whole by close().
+    """
+
+    def __init__(self, audio_file_path, sample_rate, channels, segment_seconds=4, bitrate="192k"):
+        self.hls_dir = f"{audio_file_path}{HLS_SUFFIX}"
+        self.tmp_dir = os.path.join(os.path.dirname(self.hls_dir), f".{os.path.basename(self.hls_dir)}.tmp")
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self.process = subprocess.Popen(
+            ["ffmpeg", "-v", "error", "-f", "f32le", "-ar", str(int(sample_rate)), "-ac", str(channels),
+             "-i", "pipe:0", "-c:a", "aac", "-b:a", str(bitrate),
+             "-f", "hls", "-hls_time", str(segment_seconds), "-hls_playlist_type", "vod",
+             "-hls_segment_filename", os.path.join(self.tmp_dir, "segment_%05d.ts"),
+             os.path.join(self.tmp_dir, "index.m3u8")],
+            stdin=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        self.failed = False
+
+    def write(self, block):
+        if self.failed:
+            return
+        try:
+            self.process.stdin.write(np.ascontiguousarray(block, dtype='<f4').tobytes())
+        except BrokenPipeError:
+            self.failed = True
+
+    def close(self):
+        """Finish encoding and move the rendition into place; returns the playlist path"""
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            self.failed = True
+        if self.process.wait() != 0 or self.failed:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            raise RuntimeError("HLS packaging failed")
+        old_dir = f"{self.tmp_dir}.old"
+        if os.path.exists(self.hls_dir):
+            os.rename(self.hls_dir, old_dir)
+        os.rename(self.tmp_dir, self.hls_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return os.path.join(self.hls_dir, "index.m3u8")
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def hls_packager(config, audio_file_path, sample_rate, channels):
+    """A packager for this output when HLS packaging is enabled and ffmpeg is available, else None"""
+    if not config.get("hls_package") or shutil.which("ffmpeg") is None:
+        return None
+    return HlsPackager(audio_file_path, sample_rate, channels,
+                       config.get("hls_segment_seconds", 4), config.get("hls_bitrate", "192k"))
+
+
+def finish_packaging(packager, audio_file_path):
+    """Close a packager; a failed rendition is logged and never fails the WAV it accompanies"""
+    if packager is None:
+        return None
+    try:
+        return packager.close()
+    except (RuntimeError, OSError) as e:
+        logger.warning(f"HLS packaging failed for {audio_file_path}: {e}")
+        return None
+
+
+def package_hls(config, audio_file_path, waveform, sample_rate):
+    """HLS rendition for audio that is already on disk (e.g. a copied DJ-ready file)"""
+    packager = hls_packager(config, audio_file_path, sample_rate, waveform.shape[1])
+    if packager is None:
+        return None
+    for start in range(0, len(waveform), STREAM_BLOCK_FRAMES):
+        packager.write(waveform[start:start + STREAM_BLOCK_FRAMES])
+    return finish_packaging(packager, audio_file_path)
+
+
+def hls_playlists(output_files):
+    """Playlist paths of the outputs that have an HLS rendition"""
+    playlists = {}
+    for kind, path in output_files.items():
+        playlist = os.path.join(f"{path}{HLS_SUFFIX}", "index.m3u8")
+        if os.path.exists(playlist):
+            playlists[kind] = playlist
+    return playlists
+
+
+def write_wav_atomic(path, waveform, sample_rate, subtype=None, packager=None):
+    """
+    Write a WAV next to its destination under a temporary name, then rename it into place
+    With a packager, each block is also fed to its encoder in the same pass
+    """
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    try:
+        channels = waveform.shape[1] if waveform.ndim > 1 else 1
+        with sf.SoundFile(tmp_path, 'w', samplerate=int(sample_rate), channels=channels,
+                          format='WAV', subtype=subtype) as f:
+            for start in range(0, len(waveform), STREAM_BLOCK_FRAMES):
+                block = waveform[start:start + STREAM_BLOCK_FRAMES]
+                f.write(block)
+                if packager is not None:
+                    packager.write(block)
+        _replace_durably(tmp_path, path)
+        finish_packaging(packager, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        if packager is not None:
+            packager.abort()
+        raise
+    return path
+
+
+def copy_atomic(source_path, path):
+    """shutil.copy2 through a temporary name"""
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    try:
+        shutil.copy2(source_path, tmp_path)
+        _replace_durably(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return path
+
+
+class JobJournal:
+    """
+    Write-ahead journal of one track's completed stages
+    Stored as fsynced JSON lines under journal_dir: a header with the job (command, arguments
+    and input content hash), then one record per stage. A job rerun with the same arguments and
+    input picks up its records; the journal and its checkpoints are removed once the job finishes.
+    """
+
+    def __init__(self, journal_dir, command, args, input_file_path, options=None):
+        os.makedirs(journal_dir, exist_ok=True)
+        options = options or {}
+        job_id = hashlib.sha256(json.dumps([command, args, options], sort_keys=True).encode()).hexdigest()[:24]
+        self.path = os.path.join(journal_dir, f"{job_id}.jsonl")
+        self.checkpoint_prefix = os.path.join(journal_dir, job_id)
+        self.job = {"command": command, "args": args, "options": options,
+                    "input_hash": content_hash(input_file_path)}
+        self.stages = {}
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                lines = f.read().splitlines()
+            header = json.loads(lines[0]) if lines else None
+            if header == self.job:
+                for line in lines[1:]:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # Torn final record from a crash mid-write
+                    self.stages[record["stage"]] = record
+            else:
+                self.discard()
+        if not self.stages:
+            with open(self.path, "w") as f:
+                f.write(json.dumps(self.job) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            logger.info(f"Resuming {command} after stages: {', '.join(self.stages)}")
+
+    def done(self, stage):
+        """The stage's record, or None if it has not completed"""
+        return self.stages.get(stage)
+
+    def record(self, stage, **data):
+        record = dict(data, stage=stage, at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.stages[stage] = record
+        return record
+
+    def save_checkpoint(self, name, array):
+        """Persist an intermediate array (e.g. an inferred stem) for the resume path"""
+        path = f"{self.checkpoint_prefix}.{name}.npy"
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(array, dtype=np.float32))
+        _replace_durably(tmp_path, path)
+
+    def load_checkpoint(self, name):
+        path = f"{self.checkpoint_prefix}.{name}.npy"
+        return np.load(path, mmap_mode='r') if os.path.exists(path) else None
+
+    def discard(self):
+        """Remove the journal and its checkpoints"""
+        for path in glob.glob(f"{self.checkpoint_prefix}.*.npy") + [self.path]:
+            if os.path.exists(path):
+                os.unlink(path)
+        self.stages = {}
+
+
+def unfinished_jobs(journal_dir):
+    """Job headers of journals left behind by interrupted runs"""
+    jobs = []
+    for path in sorted(glob.glob(os.path.join(journal_dir, "*.jsonl"))):
+        with open(path) as f:
+            line = f.readline()
+        try:
+            jobs.append(dict(json.loads(line), journal=path))
+        except ValueError:
+            logger.warning(f"Unreadable journal header: {path}")
+    return jobs
+
+
+class BlobStore:
+    """
+    Content-addressed storage for track outputs
+    Each file under playback_tracks/{bookingId}/... becomes a hard link to a blob named by its
+    SHA-256, with one reference row per link. A blob is deleted only when its last reference goes.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(root, "refs.sqlite"), timeout=30)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS refs (
+                link_path TEXT PRIMARY KEY,
+                blob_hash TEXT NOT NULL,
+                booking_id TEXT,
+                size INTEGER,
+                created_at TEXT
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS refs_booking ON refs (booking_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS refs_blob ON refs (blob_hash)")
+        self.db.commit()
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _point_at(self, link_path, blob_path):
+        """Atomically replace link_path with a link to the blob"""
+        tmp_path = f"{link_path}.blobtmp"
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            os.symlink(os.path.abspath(blob_path), tmp_path)
+        os.replace(tmp_path, link_path)
+
+    def ingest(self, file_path, booking_id):
+        """Move a file into the store (or dedupe it against an existing blob) and record the reference"""
+        digest = content_hash(file_path)
+        blob_path = self.blob_path(digest)
+        size = os.path.getsize(file_path)
+        deduplicated = os.path.exists(blob_path)
+
+        if not deduplicated:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            try:
+                os.link(file_path, blob_path)
+            except OSError:
+                shutil.copy2(file_path, blob_path)
+        if not os.path.samefile(file_path, blob_path):
+            self._point_at(file_path, blob_path)
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO refs (link_path, blob_hash, booking_id, size, created_at) VALUES (?, ?, ?, ?, ?)",
+            (os.path.abspath(file_path), digest, str(booking_id), size, time.strftime("%Y-%m-%dT%H:%M:%S"))
+        )
+        self.db.commit()
+        return deduplicated
+
+    def ingest_directory(self, directory, booking_id):
+        """Ingest every output file under a track directory"""
+        ingested = deduplicated = 0
+        for dir_path, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(dir_path, name)
+                if name.endswith((".tmp", ".blobtmp")) or not os.path.isfile(path):
+                    continue
+                deduplicated += self.ingest(path, booking_id)
+                ingested += 1
+        return {"ingested": ingested, "deduplicated": deduplicated}
+
+    def _drop_unreferenced(self, digests):
+        """Delete blobs from digests that no longer have references; returns bytes freed"""
+        freed = 0
+        for digest in digests:
+            if self.db.execute("SELECT 1 FROM refs WHERE blob_hash = ? LIMIT 1", (digest,)).fetchone():
+                continue
+            blob_path = self.blob_path(digest)
+            if os.path.exists(blob_path):
+                freed += os.path.getsize(blob_path)
+                os.unlink(blob_path)
+        return freed
+
+    def release_booking(self, booking_id):
+        """Remove a booking's links; blobs are freed only when no other booking references them"""
+        rows = self.db.execute("SELECT link_path, blob_hash FROM refs WHERE booking_id = ?",
+                               (str(booking_id),)).fetchall()
+        for link_path, _ in rows:
+            if os.path.lexists(link_path):
+                os.unlink(link_path)
+        self.db.execute("DELETE FROM refs WHERE booking_id = ?", (str(booking_id),))
+        self.db.commit()
+
+        # Prune the now-empty track directories
+        for link_dir in sorted({os.path.dirname(link_path) for link_path, _ in rows}, key=len, reverse=True):
+            try:
+                os.removedirs(link_dir)
+            except OSError:
+                pass
+
+        return {
+            "released_links": len(rows),
+            "freed_bytes": self._drop_unreferenced({digest for _, digest in rows})
+        }
+
+    def gc(self):
+        """Drop references whose file was deleted or rewritten outside the store, then orphaned blobs"""
+        stale = []
+        for link_path, digest in self.db.execute("SELECT link_path, blob_hash FROM refs").fetchall():
+            blob_path = self.blob_path(digest)
+            if not os.path.exists(link_path) or not os.path.exists(blob_path) \
+                    or not os.path.samefile(link_path, blob_path):
+                stale.append(link_path)
+        self.db.executemany("DELETE FROM refs WHERE link_path = ?", [(path,) for path in stale])
+        self.db.commit()
+
+        referenced = {row[0] for row in self.db.execute("SELECT DISTINCT blob_hash FROM refs")}
+        orphans = []
+        for dir_path, _, names in os.walk(self.root):
+            for name in names:
+                if len(name) == 64 and name not in referenced:
+                    orphans.append(name)
+        return {
+            "stale_references": len(stale),
+            "orphaned_blobs": len(orphans),
+            "freed_bytes": self._drop_unreferenced(orphans)
+        }
+
+    def forget(self, link_paths):
+        """Drop references for links removed elsewhere and free blobs left without references"""
+        link_paths = [os.path.abspath(path) for path in link_paths]
+        digests = set()
+        for path in link_paths:
+            row = self.db.execute("SELECT blob_hash FROM refs WHERE link_path = ?", (path,)).fetchone()
+            if row:
+                digests.add(row[0])
+        self.db.executemany("DELETE FROM refs WHERE link_path = ?", [(path,) for path in link_paths])
+        self.db.commit()
+        return self._drop_unreferenced(digests)
+
+    def stats(self):
+        """Logical (per-reference) versus physical (per-blob) bytes"""
+        references, logical = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM refs").fetchone()
+        bookings = self.db.execute("SELECT COUNT(DISTINCT booking_id) FROM refs").fetchone()[0]
+        blobs = physical = 0
+        for dir_path, _, names in os.walk(self.root):
+            for name in names:
+                if len(name) == 64:
+                    blobs += 1
+                    physical += os.path.getsize(os.path.join(dir_path, name))
+        return {
+            "bookings": bookings,
+            "references": references,
+            "blobs": blobs,
+            "logical_bytes": logical,
+            "physical_bytes": physical,
+            "saved_bytes": logical - physical,
+            "dedup_ratio": round(logical / physical, 3) if physical else 1.0
+        }
+
+
+def _parse_timestamp(value):
+    """Epoch seconds from an ISO timestamp as exported by the API (trailing Z allowed), None if unset"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+def artifact_kind(path):
+    """Classify a managed file: original, dj_ready, vocals, preview or cache (None for unmanaged)"""
+    name = os.path.basename(path)
+    parent = os.path.basename(os.path.dirname(path))
+    if parent.endswith(HLS_SUFFIX):
+        name = parent[:-len(HLS_SUFFIX)]
+    for suffix in SIDECAR_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    if name.endswith("_original.wav"):
+        return "original"
+    if name.endswith(("_instrumental.wav", "_dj_ready.wav")):
+        return "dj_ready"
+    if name.endswith("_vocals.wav"):
+        return "vocals"
+    if name.endswith(".npy") or VARIANT_NAME.match(name):
+        return "cache"
+    if name.startswith(("transition_", "preview_")) or "_preview" in name:
+        return "preview"
+    return None
+
+
+class StorageManager:
+    """
+    Keeps playback_tracks/ and the audio caches under a disk budget
+    Derived artifacts (vocals stems, previews, caches) are evicted first, least recently
+    downloaded first. Originals are never evicted, and DJ-ready files only for bookings
+    known not to have an upcoming event.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.config = service.config
+
+    def _roots(self):
+        roots = [self.config.get("playback_root", "playback_tracks"), self.config.get("pcm_cache_dir"),
+                 self.config.get("variant_cache_dir")]
+        return [root for root in roots if root and os.path.isdir(root)]
+
+    def scan(self, downloads=None, upcoming_bookings=None):
+        """
+        Group managed files by inode (hard links to one blob count once)
+        downloads maps file paths to their last download time; file atimes are used otherwise
+        """
+        blob_root = self.config.get("blob_store")
+        blob_root = os.path.abspath(blob_root) if blob_root else None
+        downloads = {os.path.abspath(path): when for path, when in (downloads or {}).items()}
+        upcoming = {str(booking) for booking in upcoming_bookings} if upcoming_bookings is not None else None
+
+        groups = {}
+        for root in self._roots():
+            for dir_path, dir_names, names in os.walk(root):
+                if blob_root and os.path.abspath(dir_path) == blob_root:
+                    dir_names[:] = []
+                    continue
+                for name in names:
+                    path = os.path.abspath(os.path.join(dir_path, name))
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    kind = artifact_kind(path)
+                    group = groups.setdefault((stat.st_dev, stat.st_ino), {
+                        "paths": [], "size": stat.st_size, "kinds": set(), "bookings": set(),
+                        "last_access": 0.0
+                    })
+                    group["paths"].append(path)
+                    group["kinds"].add(kind)
+                    group["bookings"].add(self.service.booking_id_for(dir_path))
+                    base_path = dir_path if dir_path.endswith(HLS_SUFFIX) else path
+                    for suffix in SIDECAR_SUFFIXES + (HLS_SUFFIX,):
+                        if base_path.endswith(suffix):
+                            base_path = base_path[:-len(suffix)]
+                    access = downloads.get(base_path, max(stat.st_atime, stat.st_mtime))
+                    group["last_access"] = max(group["last_access"], access)
+
+        for group in groups.values():
+            kinds = group["kinds"]
+            if None in kinds or "original" in kinds:
+                group["tier"] = None
+            elif "dj_ready" in kinds and (upcoming is None or group["bookings"] & upcoming
+                                          or None in group["bookings"]):
+                group["tier"] = None
+            else:
+                group["tier"] = max(EVICTION_TIERS[kind] for kind in kinds)
+        return list(groups.values())
+
+    def report(self, groups):
+        """Bytes and file counts per artifact kind"""
+        by_kind = {}
+        for group in groups:
+            kind = "/".join(sorted(str(k) for k in group["kinds"]))
+            entry = by_kind.setdefault(kind, {"files": 0, "bytes": 0})
+            entry["files"] += len(group["paths"])
+            entry["bytes"] += group["size"]
+        return {
+            "used_bytes": sum(group["size"] for group in groups),
+            "evictable_bytes": sum(group["size"] for group in groups if group["tier"] is not None),
+            "by_kind": by_kind
+        }
+
+    def enforce(self, budget_bytes, downloads=None, upcoming_bookings=None, dry_run=False):
+        """Evict until usage fits the budget; with dry_run only the plan is returned"""
+        groups = self.scan(downloads, upcoming_bookings)
+        summary = self.report(groups)
+        used = summary["used_bytes"]
+
+        candidates = sorted((group for group in groups if group["tier"] is not None),
+                            key=lambda group: (group["tier"], group["last_access"]))
+        evicted = []
+        for group in candidates:
+            if used <= budget_bytes:
+                break
+            evicted.append({
+                "paths": group["paths"],
+                "bytes": group["size"],
+                "last_access": datetime.fromtimestamp(group["last_access"]).isoformat(timespec="seconds")
+            })
+            used -= group["size"]
+            if dry_run:
+                continue
+            for path in group["paths"]:
+                if os.path.lexists(path):
+                    os.unlink(path)
+            if self.service.blob_store is not None:
+                self.service.blob_store.forget(group["paths"])
+
+        return dict(
+            summary,
+            budget_bytes=budget_bytes,
+            dry_run=dry_run,
+            evicted=evicted,
+            freed_bytes=summary["used_bytes"] - used,
+            over_budget=used > budget_bytes
+        )
+
+
+def _block_peaks(block, samples_per_peak):
+    """Min/max per run of samples_per_peak frames, taken across all channels"""
+    full = len(block) // samples_per_peak * samples_per_peak
+    frames = block[:full].reshape(-1, samples_per_peak * block.shape[1])
+    mins, maxs = frames.min(axis=1), frames.max(axis=1)
+    if full < len(block):
+        tail = block[full:]
+        mins = np.append(mins, tail.min())
+        maxs = np.append(maxs, tail.max())
+    return mins.astype(np.float32), maxs.astype(np.float32)
+
+
+def _halve_peaks(mins, maxs):
+    """Next pyramid level: merge neighbouring peak pairs"""
+    if len(mins) % 2:
+        mins, maxs = np.append(mins, mins[-1]), np.append(maxs, maxs[-1])
+    return mins.reshape(-1, 2).min(axis=1), maxs.reshape(-1, 2).max(axis=1)
+
+
+def write_peaks(peaks_path, mins, maxs, sample_rate, frames, bits=8):
+    """
+    Write a min/max peak pyramid as a compact binary sidecar
+    Layout (little endian): magic 'WPK1', u16 version, u16 bits, u32 sample rate, u64 frames,
+    u16 level count, then per level (u32 samples per peak, u32 peak count), then each level's
+    interleaved min/max pairs as int8 or int16
+    """
+    scale = 127 if bits == 8 else 32767
+    dtype = '<i1' if bits == 8 else '<i2'
+
+    levels = []
+    samples_per_peak = PEAKS_BASE_SAMPLES
+    for _ in range(PEAKS_LEVELS):
+        pairs = np.empty((len(mins), 2), dtype=dtype)
+        pairs[:, 0] = np.round(np.clip(mins, -1.0, 1.0) * scale)
+        pairs[:, 1] = np.round(np.clip(maxs, -1.0, 1.0) * scale)
+        levels.append((samples_per_peak, pairs))
+        if len(mins) <= 1:
+            break
+        mins, maxs = _halve_peaks(mins, maxs)
+        samples_per_peak *= 2
+
+    tmp_path = f"{peaks_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack('<4sHHIQH', PEAKS_MAGIC, 1, bits, int(sample_rate), int(frames), len(levels)))
+        for samples_per_peak, pairs in levels:
+            f.write(struct.pack('<II', samples_per_peak, len(pairs)))
+        for _, pairs in levels:
+            f.write(pairs.tobytes())
+    os.replace(tmp_path, peaks_path)
+    return peaks_path
+
+
+def write_peaks_sidecar(audio_file_path, waveform, sample_rate, bits=8):
+    """Peak pyramid for an already-decoded (frames, channels) buffer, written next to the audio"""
+    mins, maxs = _block_peaks(waveform, PEAKS_BASE_SAMPLES)
+    return write_peaks(f"{audio_file_path}.peaks", mins, maxs, sample_rate, len(waveform), bits)
+
+
+def peaks_from_file(audio_file_path, bits=8):
+    """Stream a file from disk block by block and write its peaks sidecar"""
+    block_frames = PEAKS_BASE_SAMPLES * PEAKS_READ_BLOCKS
+    mins, maxs = [], []
+    with sf.SoundFile(audio_file_path) as f:
+        sample_rate, frames = f.samplerate, f.frames
+        for block in f.blocks(blocksize=block_frames, dtype='float32', always_2d=True):
+            block_mins, block_maxs = _block_peaks(block, PEAKS_BASE_SAMPLES)
+            mins.append(block_mins)
+            maxs.append(block_maxs)
+    if not mins:
+        raise ValueError("No audio frames")
+    return write_peaks(f"{audio_file_path}.peaks", np.concatenate(mins), np.concatenate(maxs),
+                       sample_rate, frames, bits)
+
+
+class PcmCache:
+    """
+    Decoded-audio cache keyed by content hash
+    Entries are float32 (frames, channels) .npy files named <hash>-<sample_rate>.npy, opened
+    memory-mapped on a hit. File mtimes record last use for LRU eviction.
+    """
+    pattern = "*.npy"
+
+    def __init__(self, cache_dir, budget_bytes):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def lookup(self, key):
+        """Return (waveform, sample_rate) for a cached key, or None"""
+        matches = glob.glob(os.path.join(self.cache_dir, f"{key}-*.npy"))
+        if not matches:
+            return None
+        path = matches[0]
+        os.utime(path)
+        sample_rate = int(os.path.basename(path)[len(key) + 1:-len(".npy")])
+        return np.load(path, mmap_mode='r'), sample_rate
+
+    def store(self, key, waveform, sample_rate):
+        """Write a decoded waveform atomically, then evict down to the budget"""
+        path = os.path.join(self.cache_dir, f"{key}-{int(sample_rate)}.npy")
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(waveform, dtype=np.float32))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits its budget"""
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, self.pattern)):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.budget_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        if evicted:
+            logger.info(f"PCM cache evicted {evicted} entries ({total / 2**20:.0f} MB in use)")
+        return evicted
+
+
+class VariantCache(PcmCache):
+    """
+    Pitch/tempo variants of DJ-ready files, keyed by (content hash, semitones, tempo ratio)
+    Entries are ready-to-serve WAVs; eviction is LRU by mtime like the PCM cache
+    """
+    pattern = "*.wav"
+
+    def path_for(self, digest, semitones, tempo_ratio):
+        return os.path.join(self.cache_dir, f"{digest}_{semitones:+.2f}st_{tempo_ratio:.4f}x.wav")
+
+    def lookup(self, digest, semitones, tempo_ratio):
+        """Cached variant path (marked as recently used), or None"""
+        path = self.path_for(digest, semitones, tempo_ratio)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return path
+
+    def store(self, digest, semitones, tempo_ratio, waveform, sample_rate):
+        path = write_wav_atomic(self.path_for(digest, semitones, tempo_ratio), waveform, sample_rate)
+        self.evict(keep=path)
+        return path
+
+
+def shift_pitch_and_tempo(waveform, sample_rate, semitones=0.0, tempo_ratio=1.0):
+    """
+    Pitch shift and time stretch a (frames, channels) waveform in one phase-vocoder pass
+    The stretch absorbs the pitch factor and a resample restores the length, as in
+    librosa.effects.pitch_shift
+    """
+    pitch_rate = 2.0 ** (-float(semitones) / 12.0)
+    y = np.ascontiguousarray(waveform.T, dtype=np.float32)
+    rate = float(tempo_ratio) * pitch_rate
+    if abs(rate - 1.0) > 1e-6:
+        y = librosa.effects.time_stretch(y, rate=rate)
+    if semitones:
+        y = librosa.resample(y, orig_sr=float(sample_rate) / pitch_rate, target_sr=sample_rate)
+    return np.clip(y.T, -1.0, 1.0).astype(np.float32)
+
+
 class VocalSeparationService:
-    def __init__(self):
-        """Initialize the vocal separation service with Spleeter models"""
+    def __init__(self, config=None, worker_index=None):
+        """
+        Initialize the vocal separation service
+        The Spleeter model is loaded on first use, after thread and CPU settings are applied
+        """
+        self.config = config if config is not None else load_config()
+        self.audio_adapter = AudioAdapter.default()
+        self._separators = {}
+        budget_mb = float(self.config.get("pcm_cache_budget_mb") or 0)
+        self.pcm_cache = PcmCache(self.config["pcm_cache_dir"], int(budget_mb * 2**20)) if budget_mb > 0 else None
+        self._fingerprint_index = None
+        self._blob_store = None
+        self._embedding_index = None
+        # When a list, embeddings are collected here for the caller to write in batches (backfill)
+        self.embedding_batch = None
+        variant_mb = float(self.config.get("variant_cache_budget_mb") or 0)
+        self.variant_cache = VariantCache(self.config["variant_cache_dir"], int(variant_mb * 2**20)) \
+            if variant_mb > 0 and self.config.get("variant_cache_dir") else None
+        configure_runtime(self.config, worker_index)
+
+    def tier_spec(self, tier=None):
+        """Settings of a separation tier (the configured default when tier is None)"""
+        tier = tier or self.config.get("separation_tier", "standard")
+        if tier not in SEPARATION_TIERS:
+            raise ValueError(f"Unknown separation tier: {tier} (expected one of {', '.join(SEPARATION_TIERS)})")
+        return dict(SEPARATION_TIERS[tier], name=tier)
+    
+    def separator_for(self, tier=None):
+        """Spleeter separator for a tier, loaded on first use and shared by tiers with the same model"""
+        spec = self.tier_spec(tier)
+        key = (spec["model"], spec["mwf"])
+        if key not in self._separators:
+            try:
+                self._separators[key] = Separator(spec["model"], MWF=spec["mwf"])
+                logger.info(f"Spleeter initialized successfully with {spec['model']} (MWF={spec['mwf']})")
+            except Exception as e:
+                logger.error(f"Failed to initialize Spleeter: {e}")
+                raise
+        return self._separators[key]
+    
+    @property
+    def separator(self):
+        """Spleeter separator of the default tier, loaded lazily (vocals/accompaniment)"""
+        return self.separator_for()
+    
+    def _infer(self, waveform, spec):
+        """
+        Run Spleeter once, or for overlapping tiers once per shifted pass
+        Each pass starts Spleeter's fixed segments at a different offset; the passes are blended
+        with triangular weights that fall to zero at each pass's segment edges
+        """
+        separator = self.separator_for(spec["name"])
+        passes = int(round(1.0 / (1.0 - spec["overlap"])))
+        if passes <= 1:
+            return separator.separate(waveform)
+
+        frames = len(waveform)
+        segment = SPLEETER_SEGMENT_FRAMES
+        stems = {}
+        weight_total = np.zeros(frames, dtype=np.float32)
+        for index in range(passes):
+            shift = index * segment // passes
+            padded = np.concatenate([np.zeros((shift, waveform.shape[1]), dtype=waveform.dtype), waveform]) \
+                if shift else waveform
+            prediction = separator.separate(padded)
+            position = (np.arange(frames) + shift) % segment / segment
+            weights = (1.0 - np.abs(2.0 * position - 1.0)).astype(np.float32) + 1e-3
+            weight_total += weights
+            for stem, audio in prediction.items():
+                audio = audio[shift:shift + frames] * weights[:, None]
+                if stem in stems:
+                    stems[stem] += audio
+                else:
+                    stems[stem] = audio
+        for audio in stems.values():
+            audio /= weight_total[:, None]
+        return stems
+    
+    @property
+    def fingerprint_index(self):
+        """Local fingerprint index, opened on first use (None when disabled in the config)"""
+        if self._fingerprint_index is None and self.config.get("fingerprint_index"):
+            self._fingerprint_index = FingerprintIndex(
+                self.config["fingerprint_index"], float(self.config.get("fingerprint_max_ber", 0.15))
+            )
+        return self._fingerprint_index
+    
+    @property
+    def blob_store(self):
+        """Content-addressed output store (None when disabled in the config)"""
+        if self._blob_store is None and self.config.get("blob_store"):
+            self._blob_store = BlobStore(self.config["blob_store"])
+        return self._blob_store
+    
+    @property
+    def embedding_index(self):
+        """MFCC similarity index (None when disabled in the config)"""
+        if self._embedding_index is None and self.config.get("embedding_index"):
+            self._embedding_index = EmbeddingIndex(self.config["embedding_index"])
+        return self._embedding_index
+    
+    def booking_id_for(self, output_dir):
+        """Booking id from an output path of the form playback_tracks/{bookingId}/{trackId}/..."""
+        root = os.path.abspath(self.config.get("playback_root", "playback_tracks"))
+        relative = os.path.relpath(os.path.abspath(output_dir), root)
+        if relative.startswith(os.pardir) or relative == os.curdir:
+            return None
+        return relative.split(os.sep)[0]
+    
+    def _store_outputs(self, result, output_dir):
+        """Move a track's outputs into the blob store, linked under its booking"""
+        store = self.blob_store
+        booking_id = self.booking_id_for(output_dir)
+        if store is None or booking_id is None or not os.path.isdir(output_dir):
+            return
+        try:
+            result["storage"] = store.ingest_directory(output_dir, booking_id)
+        except OSError as e:
+            logger.warning(f"Could not move outputs into the blob store: {e}")
+    
+    def load_audio(self, audio_file_path):
+        """
+        Decode an audio file to float32 (frames, channels) at its native sample rate
+        Repeat loads of the same content are served memory-mapped from the PCM cache
+        Every caller may rely on the float32 contract; decoders returning float64 are narrowed here
+        """
+        if self.pcm_cache is None:
+            waveform, sample_rate = self.audio_adapter.load(audio_file_path, dtype=np.float32)
+            # Spleeter's ffmpeg adapter reports the probed native rate as a string
+            return np.asarray(waveform, dtype=np.float32), int(sample_rate)
+
+        key = content_hash(audio_file_path)
+        cached = self.pcm_cache.lookup(key)
+        if cached is not None:
+            logger.info(f"Decoded audio cache hit for: {audio_file_path}")
+            return cached
+
+        waveform, sample_rate = self.audio_adapter.load(audio_file_path, dtype=np.float32)
+        waveform, sample_rate = np.asarray(waveform, dtype=np.float32), int(sample_rate)
+        try:
+            self.pcm_cache.store(key, waveform, sample_rate)
+        except OSError as e:
+            logger.warning(f"Could not cache decoded audio: {e}")
+        return waveform, sample_rate
+    
+    def separate_waveform(self, waveform, sample_rate, tier=None):
+        """
+        Run Spleeter only on audible regions of a (frames, channels) waveform
+        Silent regions are passed through to the accompaniment and left as zeros in the vocals
+        Returns the stems and the share of audio that skipped inference
+        """
+        spec = self.tier_spec(tier)
+        frames = len(waveform)
+        regions = find_audible_regions(
+            waveform, sample_rate,
+            threshold_db=float(self.config.get("silence_threshold_db", -60.0)),
+            min_silence_seconds=float(self.config.get("min_silence_seconds", 2.0)),
+            pad_seconds=float(self.config.get("silence_pad_seconds", 0.5))
+        )
+        separated = sum(end - start for start, end in regions)
+        stats = {"silence_skipped_ratio": round(float(1.0 - separated / frames), 4) if frames else 0.0}
+
+        if regions == [(0, frames)]:
+            return self._infer(waveform, spec), stats
+
+        # Spleeter always returns stereo stems
+        vocals = np.zeros((frames, 2), dtype=np.float32)
+        accompaniment = np.empty((frames, 2), dtype=np.float32)
+        accompaniment[...] = waveform if waveform.shape[1] in (1, 2) else waveform[:, :2]
+
+        for start, end in regions:
+            prediction = self._infer(waveform[start:end], spec)
+            vocals[start:end] = prediction['vocals'][:end - start]
+            accompaniment[start:end] = prediction['accompaniment'][:end - start]
+
+        logger.info(f"Skipped inference on {stats['silence_skipped_ratio']:.1%} silent audio "
+                    f"({len(regions)} audible regions)")
+        return {"vocals": vocals, "accompaniment": accompaniment}, stats
+    
+    def _analyze(self, audio_file_path):
+        """
+        Shared analysis pass: decode once, compute one STFT and derive every feature from it
+        Returns the analysis result and the frame-level features used by sidecar writers
+        """
+        # Load audio file as (frames, channels) and scan the decoded buffer for damage
+        waveform, sample_rate = self.load_audio(audio_file_path)
+        quality = self.check_quality(audio_file_path, waveform, sample_rate)
+        
+        # Loudness is measured block by block over the (memory-mapped) buffer
+        loudness = measure_loudness(iter_blocks(waveform), sample_rate, waveform.shape[1])
+        
+        # Everything below works on float32 mono; the multichannel buffer is dropped
+        # before the STFT so the two are never both held alongside the spectrogram
+        frames, channels = waveform.shape
+        waveform_mono = downmix(waveform)
+        del waveform
+        
+        # One magnitude spectrogram shared by all spectral features (complex64 -> float32)
+        stft = librosa.stft(waveform_mono, n_fft=ANALYSIS_N_FFT, hop_length=ANALYSIS_HOP)
+        del waveform_mono
+        spectrogram = np.abs(stft)
+        del stft
+        mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=spectrogram ** 2, sr=sample_rate))
+        
+        # Detect vocal presence using spectral features; the centroid is one float32 projection
+        # (librosa's spectral_centroid broadcasts a float64 frequency grid over the spectrogram)
+        freqs = librosa.fft_frequencies(sr=sample_rate, n_fft=ANALYSIS_N_FFT).astype(np.float32)
+        column_sums = spectrogram.sum(axis=0)
+        spectral_centroids = np.divide(freqs @ spectrogram, column_sums,
+                                       out=np.zeros_like(column_sums), where=column_sums > 0)
+        mfccs = librosa.feature.mfcc(S=mel_db, n_mfcc=13)
+        
+        # Calculate vocal likelihood based on spectral characteristics
+        high_freq_energy = np.mean(spectral_centroids > 2000)  # Vocal frequency range
+        vocal_formant_energy = np.mean(mfccs[1:4])  # Formant-related MFCCs
+        
+        # Combine metrics for vocal confidence score
+        vocal_confidence = (high_freq_energy * 0.6) + (abs(vocal_formant_energy) * 0.4)
+        vocal_confidence = min(max(vocal_confidence, 0.0), 1.0)  # Clamp to 0-1
+        
+        # Determine recommendation
+        if vocal_confidence > 0.7:
+            recommendation = "high_confidence_vocals"
+            message = "High confidence vocals detected - recommend vocal separation"
+        elif vocal_confidence > 0.4:
+            recommendation = "moderate_vocals"
+            message = "Moderate vocal content detected - separation may be beneficial"
+        else:
+            recommendation = "instrumental"
+            message = "Appears to be instrumental - separation may not be necessary"
+        
+        # Beat grid and cue points from the same spectrogram
+        onset_envelope = librosa.onset.onset_strength(S=mel_db, sr=sample_rate)
+        tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sample_rate,
+                                                     hop_length=ANALYSIS_HOP,
+                                                     bpm=global_tempo(onset_envelope, sample_rate))
+        features = {
+            "sample_rate": sample_rate,
+            "bpm": float(np.atleast_1d(tempo)[0]),
+            "beat_times": librosa.frames_to_time(beat_frames, sr=sample_rate, hop_length=ANALYSIS_HOP),
+            "energy_db": librosa.power_to_db((spectrogram ** 2).sum(axis=0)),
+            "vocal_activity": spectral_vocal_activity(spectrogram, sample_rate),
+            "embedding": mfcc_embedding(mfccs),
+            "quality": quality
+        }
+        features["fingerprint"], features["fingerprint_summary"] = compute_fingerprint(mel_db, sample_rate)
+        cue_points = compute_cue_points(features)
+        energy = energy_features(spectrogram, onset_envelope, sample_rate)
+        key = detect_key(spectrogram, sample_rate)
+        
+        result = {
+            "vocal_confidence": float(vocal_confidence),
+            **loudness,
+            "recommendation": recommendation,
+            "message": message,
+            "duration": frames / float(sample_rate),
+            "sample_rate": int(sample_rate),
+            "channels": int(channels),
+            "bpm": round(features["bpm"], 2),
+            "key": key,
+            "cue_points": cue_points,
+            "energy": energy,
+            "quality": quality
+        }
+        return result, features
+    
+    def analyze_audio(self, audio_file_path):
+        """
+        Analyze audio file to detect if vocals are present
+        Returns confidence score and recommendations
+        """
         try:
-            # Initialize Spleeter with 2stems model (vocals/accompaniment)
-            self.separator = Separator('spleeter:2stems-16kHz')
-            self.audio_adapter = AudioAdapter.default()
-            logger.info("Spleeter initialized successfully with 2stems model")
+            result, features = self._analyze(audio_file_path)
+            self._index_embedding(audio_file_path, features)
+            try:
+                result["analysis_file"] = write_analysis_sidecar(audio_file_path, result)
+            except OSError as e:
+                logger.warning(f"Could not write analysis sidecar: {e}")
+            return result
+            
         except Exception as e:
-            logger.error(f"Failed to initialize Spleeter: {e}")
-            raise
+            logger.error(f"Audio analysis failed: {e}")
+            return {
+                "error": f"Analysis failed: {str(e)}",
+                "vocal_confidence": 0.0,
+                "recommendation": "error"
+            }
+    
+    def check_quality(self, audio_file_path, waveform, sample_rate):
+        """Scan a decoded input and decide, per the config, whether the job should be rejected"""
+        report = scan_quality(waveform, sample_rate, declared_frames(audio_file_path))
+        issues = []
+        if report["clipped_ratio"] > float(self.config.get("max_clipped_ratio", 0.001)):
+            issues.append("clipping")
+        if max(abs(v) for v in report["dc_offset"]) > float(self.config.get("max_dc_offset", 0.01)):
+            issues.append("dc_offset")
+        if report["truncated_frames"] > TRUNCATION_TOLERANCE_SECONDS * sample_rate:
+            issues.append("truncated")
+        if report.get("mono_correlation", 1.0) < float(self.config.get("min_mono_correlation", -0.2)):
+            issues.append("mono_incompatible")
+        report["issues"] = issues
+        report["rejected"] = bool(self.config.get("reject_bad_inputs")) and \
+            any(issue in self.config.get("reject_issues", []) for issue in issues)
+        if issues:
+            logger.warning(f"Input quality issues in {audio_file_path}: {', '.join(issues)}")
+        return report
+    
+    def scan_files(self, paths):
+        """Quality reports for every audio file under paths (one decode each)"""
+        reports = []
+        for audio_file_path in find_audio_files(paths):
+            try:
+                waveform, sample_rate = self.load_audio(audio_file_path)
+                reports.append(dict(self.check_quality(audio_file_path, waveform, sample_rate), file=audio_file_path))
+            except Exception as e:
+                logger.error(f"Quality scan failed for {audio_file_path}: {e}")
+                reports.append({"file": audio_file_path, "error": str(e)})
+        return {
+            "success": all("error" not in r for r in reports),
+            "files": reports,
+            "with_issues": sum(1 for r in reports if r.get("issues"))
+        }
+    
+    def _index_embedding(self, audio_file_path, features, digest=None):
+        """Persist the track's MFCC embedding for similarity queries"""
+        if self.embedding_batch is not None:
+            self.embedding_batch.append((digest or content_hash(audio_file_path), audio_file_path,
+                                         features["embedding"]))
+            return
+        index = self.embedding_index
+        if index is None:
+            return
+        try:
+            index.add(digest or content_hash(audio_file_path), audio_file_path, features["embedding"])
+        except OSError as e:
+            logger.warning(f"Could not store MFCC embedding: {e}")
+    
+    def find_similar(self, audio_file_path, k=10):
+        """Nearest catalog tracks by MFCC embedding (the file is analyzed if not yet indexed)"""
+        try:
+            index = self.embedding_index
+            if index is None:
+                raise ValueError("Embedding index is disabled in the configuration")
+            digest = content_hash(audio_file_path)
+            embedding = index.get(digest)
+            if embedding is None:
+                _, features = self._analyze(audio_file_path)
+                embedding = features["embedding"]
+                self._index_embedding(audio_file_path, features, digest)
+            return {
+                "success": True,
+                "similar": index.query(embedding, k, exclude=digest)
+            }
+        except Exception as e:
+            logger.error(f"Similarity lookup failed: {e}")
+            return {
+                "success": False,
+                "error": f"Similarity lookup failed: {str(e)}"
+            }
+    
+    def open_journal(self, command, args, input_file_path, options=None):
+        """Write-ahead journal for one job (resumes the records of an interrupted identical run)"""
+        return JobJournal(self.config.get("journal_dir") or os.path.join("audio_cache", "journal"),
+                          command, args, input_file_path, options)
+    
+    def _write_stem(self, journal, stage, path, write, expected_frames):
+        """Write one output atomically unless the journal shows it intact from an earlier run"""
+        record = journal.done(stage)
+        if record and os.path.exists(path) and os.path.getsize(path) == record["bytes"]:
+            return path
+        write(path)
+        journal.record(stage, path=path, bytes=os.path.getsize(path), frames=expected_frames)
+        return path
+    
+    def _verify_outputs(self, output_files, journal):
+        """Re-open every written stem and check its header against the journal"""
+        for kind, path in output_files.items():
+            expected = journal.done(f"stem:{kind}")["frames"]
+            if expected is None:
+                # Copied inputs keep their source encoding; size was checked when journaled
+                continue
+            frames = sf.info(path).frames
+            if frames != expected:
+                raise IOError(f"{path} has {frames} frames, expected {expected}")
+        journal.record("verified", files=output_files)
+    
+    def separate_vocals(self, input_file_path, output_dir, filename_prefix="track", peaks=False,
+                        analysis_features=None, journal=None, tier=None, package=None):
+        """
+        Separate vocals from audio track using Spleeter
+        Returns paths to separated tracks (and their waveform peak sidecars if requested)
+        With analysis_features, a beat/cue sidecar is written using the vocals stem as vocal timeline
+        Each stage is journaled and every file is written through a temp name, so an interrupted
+        run resumes from its last completed stage and never leaves a partial WAV in place
+        tier selects the model, overlap and stem WAV subtype (see SEPARATION_TIERS)
+        package (default: hls_package config) also writes an HLS rendition of the instrumental
+        """
+        owns_journal = journal is None
+        try:
+            spec = self.tier_spec(tier)
+            
+            # Create output directory if it doesn't exist
+            os.makedirs(output_dir, exist_ok=True)
+            if owns_journal:
+                journal = self.open_journal("separate", [input_file_path, output_dir, filename_prefix],
+                                            input_file_path, {"tier": spec["name"]})
+            
+            # Load audio (decoded once, then served from the PCM cache)
+            waveform, sample_rate = self.load_audio(input_file_path)
+            
+            # Damaged inputs can be turned away before any inference is spent on them
+            quality = analysis_features["quality"] if analysis_features is not None \
+                else self.check_quality(input_file_path, waveform, sample_rate)
+            if quality["rejected"]:
+                if owns_journal:
+                    journal.discard()
+                return {
+                    "success": False,
+                    "error": f"Input rejected before separation: {', '.join(quality['issues'])}",
+                    "quality": quality
+                }
+            
+            if not journal.done("decoded"):
+                journal.record("decoded", frames=len(waveform), sample_rate=sample_rate)
+            
+            # Perform separation, or pick up the stems checkpointed by an interrupted run
+            prediction = None
+            if journal.done("inferred"):
+                prediction = {stem: journal.load_checkpoint(stem) for stem in ("vocals", "accompaniment")}
+                if any(stem is None for stem in prediction.values()):
+                    prediction = None
+                else:
+                    separation_stats = {"silence_skipped_ratio": journal.done("inferred")["silence_skipped_ratio"]}
+                    logger.info(f"Reusing checkpointed stems for: {input_file_path}")
+            if prediction is None:
+                logger.info(f"Starting vocal separation for: {input_file_path}")
+                prediction, separation_stats = self.separate_waveform(waveform, sample_rate, spec["name"])
+                for stem in ("vocals", "accompaniment"):
+                    journal.save_checkpoint(stem, prediction[stem])
+                journal.record("inferred", **separation_stats)
+            
+            # Save separated tracks
+            output_files = {}
+            frames = len(prediction['accompaniment'])
+            
+            # Save instrumental (accompaniment) track - this is what DJs need
+            instrumental_path = os.path.join(output_dir, f"{filename_prefix}_instrumental.wav")
+            if package is None:
+                package = self.config.get("hls_package")
+            output_files['instrumental'] = self._write_stem(
+                journal, "stem:instrumental", instrumental_path,
+                lambda path: write_wav_atomic(
+                    path, prediction['accompaniment'], sample_rate, spec["subtype"],
+                    hls_packager(self.config, path, sample_rate, prediction['accompaniment'].shape[1])
+                    if package else None
+                ), frames
+            )
+            
+            # Save vocals track (for reference/quality check)
+            vocals_path = os.path.join(output_dir, f"{filename_prefix}_vocals.wav")
+            output_files['vocals'] = self._write_stem(
+                journal, "stem:vocals", vocals_path,
+                lambda path: write_wav_atomic(path, prediction['vocals'], sample_rate, spec["subtype"]), frames
+            )
+            
+            # Save original for comparison
+            original_path = os.path.join(output_dir, f"{filename_prefix}_original.wav")
+            output_files['original'] = self._write_stem(
+                journal, "stem:original", original_path,
+                lambda path: copy_atomic(input_file_path, path), None
+            )
+            
+            self._verify_outputs(output_files, journal)
+            
+            result = {
+                "success": True,
+                "output_files": output_files,
+                "tier": spec["name"],
+                **separation_stats,
+                "quality": quality,
+                "message": "Vocal separation completed successfully"
+            }
+            streaming_files = hls_playlists(output_files)
+            if streaming_files:
+                result["streaming_files"] = streaming_files
+            
+            # Waveform overviews from the buffers already in memory
+            if peaks:
+                bits = int(self.config.get("peaks_bits", 8))
+                result["peaks_files"] = {
+                    "instrumental": write_peaks_sidecar(instrumental_path, prediction['accompaniment'], sample_rate, bits),
+                    "original": write_peaks_sidecar(original_path, waveform, sample_rate, bits)
+                }
+            
+            if analysis_features is not None:
+                features = dict(analysis_features, vocal_activity=stem_vocal_activity(
+                    prediction['vocals'], sample_rate, len(analysis_features["energy_db"])
+                ))
+                cue_points = compute_cue_points(features)
+                result["cue_points"] = cue_points
+                result["cues_file"] = write_cues_sidecar(instrumental_path, features, cue_points)
+            
+            if owns_journal:
+                journal.discard()
+            logger.info(f"Vocal separation completed successfully")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Vocal separation failed: {e}")
+            # Errors are not interruptions: rerunning would fail the same way, so nothing is kept to resume
+            if owns_journal and journal is not None:
+                journal.discard()
+            return {
+                "success": False,
+                "error": f"Separation failed: {str(e)}"
+            }
+    
+    def stream_separate(self, source, sink, stem="accompaniment", output_format="wav", content_length=None):
+        """
+        Separate an audio byte stream and write the selected stem back as an encoded stream
+        The sink receives one JSON header line followed by the encoded audio bytes
+        Every step that can fail runs before the header, so a success header is always followed
+        by the complete stem (compressed formats are encoded to a spooled buffer first)
+        """
+        encoded = None
+        try:
+            if stem not in STREAM_STEMS:
+                raise ValueError(f"Unknown stem '{stem}' (expected one of {', '.join(STREAM_STEMS)})")
+            if output_format not in STREAM_FORMATS:
+                raise ValueError(f"Unsupported format '{output_format}'")
+            if shutil.which("ffmpeg") is None:
+                raise RuntimeError("ffmpeg is required for streamed separation but was not found")
+
+            waveform, sample_rate = decode_stream(source, content_length)
+            if not len(waveform):
+                raise ValueError("No audio decoded from stream")
+
+            logger.info(f"Starting streamed vocal separation ({len(waveform) / sample_rate:.1f}s)")
+            prediction, separation_stats = self.separate_waveform(waveform, sample_rate)
+            output = prediction[STREAM_STEMS[stem]]
+            frames, channels = output.shape
+            header = {
+                "success": True,
+                "stem": stem,
+                "format": output_format,
+                "sample_rate": sample_rate,
+                "channels": int(channels),
+                "frames": int(frames),
+                "duration": float(frames / sample_rate),
+                "content_length": 44 + frames * channels * 2,
+                **separation_stats
+            }
+            if output_format != "wav":
+                encoded = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_BYTES)
+                encode_stream(output, sample_rate, encoded, output_format)
+                header["content_length"] = encoded.tell()
+                encoded.seek(0)
+        except Exception as e:
+            logger.error(f"Streamed separation failed: {e}")
+            if encoded is not None:
+                encoded.close()
+            write_stream_header(sink, {"success": False, "error": f"Separation failed: {str(e)}"})
+            return False
+
+        try:
+            write_stream_header(sink, header)
+            if encoded is None:
+                encode_stream(output, sample_rate, sink)
+            else:
+                shutil.copyfileobj(encoded, sink, STREAM_CHUNK_BYTES)
+            sink.flush()
+        except OSError as e:
+            # Only the sink can fail here (e.g. the caller hung up); there is nobody left to tell
+            logger.error(f"Streaming the separated {stem} failed: {e}")
+            return False
+        finally:
+            if encoded is not None:
+                encoded.close()
+        return True
+    
+    def shm_separate(self, request):
+        """
+        Separate PCM that a co-located caller placed in shared memory
+        Returns a control message with the offsets of the separated stems
+        """
+        try:
+            stems = request.get("stems") or ["accompaniment"]
+            unknown = [stem for stem in stems if stem not in STREAM_STEMS]
+            if unknown:
+                raise ValueError(f"Unknown stems: {', '.join(unknown)}")
+
+            descriptor = request["input"]
+            sample_rate = int(descriptor.get("sample_rate", STREAM_SAMPLE_RATE))
+            waveform, segment = open_pcm(descriptor)
+            try:
+                logger.info(f"Starting shared-memory vocal separation ({len(waveform) / sample_rate:.1f}s)")
+                prediction, separation_stats = self.separate_waveform(waveform, sample_rate)
+            finally:
+                del waveform
+                if segment is not None:
+                    _close_shm(segment)
+
+            outputs = write_pcm_stems(
+                {stem: prediction[STREAM_STEMS[stem]] for stem in stems},
+                sample_rate, request.get("output")
+            )
+            return {"success": True, "transport": "shm", "stems": outputs, **separation_stats}
+        except Exception as e:
+            logger.error(f"Shared-memory separation failed: {e}")
+            return {"success": False, "error": f"Separation failed: {str(e)}"}
+    
+    def preview_separate(self, input_file_path, output_dir, filename_prefix="track", seconds=None, tier=None):
+        """
+        Separate only a short excerpt around the most vocal-heavy section
+        Gives listeners audio within seconds; the full job runs afterwards
+        """
+        try:
+            seconds = float(seconds or self.config.get("preview_seconds", 45.0))
+            spec = self.tier_spec(tier or self.config.get("preview_tier", "draft"))
+            started = time.perf_counter()
+            
+            waveform, sample_rate = self.load_audio(input_file_path)
+            start, end = vocal_heavy_window(waveform, sample_rate, seconds)
+            prediction, _ = self.separate_waveform(waveform[start:end], sample_rate, spec["name"])
+            
+            os.makedirs(output_dir, exist_ok=True)
+            output_files = {}
+            for kind, stem in (("instrumental", "accompaniment"), ("vocals", "vocals")):
+                path = os.path.join(output_dir, f"{filename_prefix}_{kind}_preview.wav")
+                packager = hls_packager(self.config, path, sample_rate, prediction[stem].shape[1]) \
+                    if kind == "instrumental" else None
+                output_files[kind] = write_wav_atomic(path, prediction[stem], sample_rate, spec["subtype"], packager)
+            
+            return {
+                "success": True,
+                "output_files": output_files,
+                "streaming_files": hls_playlists(output_files),
+                "tier": spec["name"],
+                "start_seconds": round(start / sample_rate, 3),
+                "end_seconds": round(end / sample_rate, 3),
+                "seconds_to_preview": round(time.perf_counter() - started, 3)
+            }
+            
+        except Exception as e:
+            logger.error(f"Preview separation failed: {e}")
+            return {
+                "success": False,
+                "error": f"Preview failed: {str(e)}"
+            }
+    
+    def remix_stems(self, vocals_path, accompaniment_path, output_path,
+                    vocals_gain_db=-12.0, accompaniment_gain_db=0.0, block_frames=REMIX_BLOCK_FRAMES):
+        """
+        Render a gain mix of cached vocals and accompaniment stems
+        Streams both stems block by block; no model is loaded
+        """
+        try:
+            vocals_gain = db_to_gain(vocals_gain_db)
+            accompaniment_gain = db_to_gain(accompaniment_gain_db)
+
+            with sf.SoundFile(vocals_path) as vocals, sf.SoundFile(accompaniment_path) as accompaniment:
+                if vocals.samplerate != accompaniment.samplerate or vocals.channels != accompaniment.channels:
+                    raise ValueError("Stems have different sample rates or channel counts")
+
+                sample_rate, channels = accompaniment.samplerate, accompaniment.channels
+                output_dir = os.path.dirname(output_path)
+                if output_dir:
+                    os.makedirs(output_dir, exist_ok=True)
+
+                vocals_block = np.zeros((block_frames, channels), dtype=np.float32)
+                mix_block = np.zeros((block_frames, channels), dtype=np.float32)
+                frames = clipped = 0
+
+                # Rendered under a temporary name (keeping the extension for the format) and renamed,
+                # so an existing output hard-linked into the blob store is replaced, not written through
+                tmp_path = os.path.join(output_dir, f".tmp.{os.path.basename(output_path)}")
+                try:
+                    with sf.SoundFile(tmp_path, 'w', samplerate=sample_rate, channels=channels) as output:
+                        while True:
+                            accompaniment_read = len(accompaniment.read(out=mix_block))
+                            vocals_read = len(vocals.read(out=vocals_block))
+                            count = max(accompaniment_read, vocals_read)
+                            if count == 0:
+                                break
+                            # Zero the tail of whichever stem ran out first
+                            mix_block[accompaniment_read:count] = 0.0
+                            vocals_block[vocals_read:count] = 0.0
+
+                            mix = mix_block[:count]
+                            mix *= accompaniment_gain
+                            mix += vocals_gain * vocals_block[:count]
+                            clipped += int(np.count_nonzero(np.abs(mix) > 1.0))
+                            np.clip(mix, -1.0, 1.0, out=mix)
+                            output.write(mix)
+                            frames += count
+                    _replace_durably(tmp_path, output_path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.unlink(tmp_path)
+                    raise
+
+            logger.info(f"Remix rendered: {output_path}")
+            return {
+                "success": True,
+                "output_file": output_path,
+                "vocals_gain_db": gain_db_for_json(vocals_gain_db),
+                "accompaniment_gain_db": gain_db_for_json(accompaniment_gain_db),
+                "duration": float(frames / sample_rate),
+                "clipped_samples": clipped,
+                "message": "Remix rendered from cached stems"
+            }
+
+        except Exception as e:
+            logger.error(f"Remix failed: {e}")
+            return {
+                "success": False,
+                "error": f"Remix failed: {str(e)}"
+            }
+    
+    def render_transition(self, from_file_path, to_file_path, output_path,
+                          crossfade_seconds=TRANSITION_CROSSFADE_SECONDS,
+                          context_seconds=TRANSITION_CONTEXT_SECONDS):
+        """
+        Render a short equal-power crossfade preview between two tracks
+        Only the tail of the first track and the head of the second are decoded
+        """
+        try:
+            window = context_seconds + crossfade_seconds + TRANSITION_SILENCE_MARGIN
+            tail, sample_rate = read_window(from_file_path, -window, window)
+            head, head_rate = read_window(to_file_path, 0.0, window)
+            if not len(tail) or not len(head):
+                raise ValueError("One of the tracks is empty")
+
+            channels = max(tail.shape[1], head.shape[1])
+            tail = _match_format(tail, sample_rate, sample_rate, channels)
+            head = _match_format(head, head_rate, sample_rate, channels)
+
+            # Skip dead air at the end of the outgoing track and the start of the incoming one
+            tail = tail[:_audible_bounds(tail)[1]]
+            head = head[_audible_bounds(head)[0]:]
+
+            fade_frames = min(int(crossfade_seconds * sample_rate), len(tail), len(head))
+            context_frames = int(context_seconds * sample_rate)
+            tail = tail[-(fade_frames + context_frames):]
+            head = head[:fade_frames + context_frames]
+
+            ramp = np.linspace(0.0, np.pi / 2, fade_frames, dtype=np.float32)[:, None]
+            preview = np.concatenate([
+                tail[:-fade_frames] if fade_frames else tail,
+                tail[len(tail) - fade_frames:] * np.cos(ramp) + head[:fade_frames] * np.sin(ramp),
+                head[fade_frames:]
+            ])
+
+            output_dir = os.path.dirname(output_path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            # Renamed into place so a preview hard-linked into the blob store is replaced, not written through
+            tmp_path = os.path.join(output_dir, f".tmp.{os.path.basename(output_path)}")
+            try:
+                sf.write(tmp_path, np.clip(preview, -1.0, 1.0), sample_rate)
+                _replace_durably(tmp_path, output_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+
+            return {
+                "success": True,
+                "output_file": output_path,
+                "duration": float(len(preview) / sample_rate),
+                "crossfade_seconds": float(fade_frames / sample_rate)
+            }
+
+        except Exception as e:
+            logger.error(f"Transition preview failed: {e}")
+            return {
+                "success": False,
+                "error": f"Transition preview failed: {str(e)}"
+            }
+    
+    def render_setlist_transitions(self, tracks, output_dir, crossfade_seconds=TRANSITION_CROSSFADE_SECONDS,
+                                   output_format="ogg"):
+        """
+        Render crossfade previews for every consecutive pair in a booking's setlist
+        Tracks are ordered by setlistPosition and rendered from their DJ-ready files
+        """
+        ordered = [track for track in order_setlist(tracks) if playback_track_audio(track)]
+        transitions = []
+
+        for position, (current, following) in enumerate(zip(ordered, ordered[1:]), start=1):
+            from_id = current.get("id", position)
+            to_id = following.get("id", position + 1)
+            output_path = os.path.join(output_dir, f"transition_{position:02d}_{from_id}_to_{to_id}.{output_format}")
+            logger.info(f"Rendering transition {position}: {from_id} -> {to_id}")
+            result = self.render_transition(
+                playback_track_audio(current), playback_track_audio(following),
+                output_path, crossfade_seconds
+            )
+            result.update({
+                "from_track_id": from_id,
+                "to_track_id": to_id,
+                "transition_notes": current.get("transitionNotes") or current.get("transition_notes")
+            })
+            transitions.append(result)
+
+        return {
+            "success": all(t["success"] for t in transitions),
+            "transitions": transitions,
+            "skipped_tracks": len(tracks) - len(ordered),
+            "message": f"Rendered {sum(t['success'] for t in transitions)} of {len(transitions)} transition previews"
+        }
+    
+    def render_variant(self, audio_file_path, semitones=0.0, tempo_ratio=1.0, target_bpm=None):
+        """
+        Pitch-shifted and/or time-stretched copy of a DJ-ready file, served from the variant cache
+        target_bpm sets the tempo ratio from the file's analysis sidecar
+        """
+        try:
+            if target_bpm:
+                analysis = read_analysis_sidecar(audio_file_path) or self.analyze_audio(audio_file_path)
+                if not analysis.get("bpm"):
+                    raise ValueError("No tempo known for this file")
+                tempo_ratio = float(target_bpm) / analysis["bpm"]
+            semitones, tempo_ratio = round(float(semitones), 2), round(float(tempo_ratio), 4)
+            if not -12.0 <= semitones <= 12.0 or not 0.5 <= tempo_ratio <= 2.0:
+                raise ValueError("Variants are limited to +/-12 semitones and 0.5-2x tempo")
+            if self.variant_cache is None:
+                raise ValueError("Variant cache is disabled in the configuration")
+            
+            digest = content_hash(audio_file_path)
+            started = time.perf_counter()
+            output_path = self.variant_cache.lookup(digest, semitones, tempo_ratio)
+            cached = output_path is not None
+            if not cached:
+                waveform, sample_rate = self.load_audio(audio_file_path)
+                variant = shift_pitch_and_tempo(waveform, sample_rate, semitones, tempo_ratio)
+                output_path = self.variant_cache.store(digest, semitones, tempo_ratio, variant, sample_rate)
+            
+            return {
+                "success": True,
+                "source_file": audio_file_path,
+                "output_file": output_path,
+                "semitones": semitones,
+                "tempo_ratio": tempo_ratio,
+                "cached": cached,
+                "seconds": round(time.perf_counter() - started, 3)
+            }
+        except Exception as e:
+            logger.error(f"Variant rendering failed: {e}")
+            return {
+                "success": False,
+                "error": f"Variant rendering failed: {str(e)}"
+            }
+    
+    def profile_energy(self, paths, force=False):
+        """Energy features for every audio file under paths, from the analysis sidecar when up to date"""
+        profiles, failed = [], []
+        for audio_file_path in find_audio_files(paths):
+            analysis = None if force else read_analysis_sidecar(audio_file_path)
+            if analysis is None or "energy" not in analysis:
+                analysis = self.analyze_audio(audio_file_path)
+                if "error" in analysis:
+                    failed.append({"file": audio_file_path, "error": analysis["error"]})
+                    continue
+            profiles.append({"file": audio_file_path, "bpm": analysis.get("bpm"), **analysis["energy"]})
+        return {
+            "success": not failed,
+            "tracks": profiles,
+            "failed": failed
+        }
+    
+    def optimize_setlist(self, tracks, arc="peak"):
+        """
+        Order a booking's setlist to follow a target energy arc
+        Uses only the analysis sidecars of the tracks' DJ-ready files; nothing is decoded
+        """
+        try:
+            usable, analyses, missing = [], [], []
+            for track in tracks:
+                audio_file_path = track if isinstance(track, str) else playback_track_audio(track)
+                analysis = read_analysis_sidecar(audio_file_path) if audio_file_path else None
+                if analysis is None or "energy" not in analysis:
+                    missing.append(track if isinstance(track, str) else track.get("id", audio_file_path))
+                    continue
+                usable.append(track)
+                analyses.append(analysis)
+            if not usable:
+                raise ValueError("No track has an analysis sidecar; run the energy command first")
+            
+            scores = energy_scores(analyses)
+            target = target_arc(arc, len(usable))
+            order, cost = order_by_energy(scores, [a.get("bpm") or 120.0 for a in analyses], target)
+            
+            setlist = []
+            for position, index in enumerate(order, start=1):
+                track = usable[index]
+                entry = {"file": track} if isinstance(track, str) else dict(track)
+                entry.update({
+                    "setlistPosition": position,
+                    "energy": round(float(scores[index]), 3),
+                    "target_energy": round(float(target[position - 1]), 3),
+                    "bpm": analyses[index].get("bpm")
+                })
+                setlist.append(entry)
+            return {
+                "success": True,
+                "arc": arc,
+                "setlist": setlist,
+                "cost": round(float(cost), 4),
+                "missing_analysis": missing
+            }
+        except Exception as e:
+            logger.error(f"Setlist optimization failed: {e}")
+            return {
+                "success": False,
+                "error": f"Setlist optimization failed: {str(e)}"
+            }
+    
+    def setlist_compatibility(self, tracks):
+        """
+        Full pairwise key/tempo/loudness compatibility matrix for a booking's tracks
+        Computed from the analysis sidecars of the DJ-ready files; nothing is decoded
+        """
+        try:
+            ordered, analyses, missing = [], [], []
+            for track in order_setlist([t for t in tracks if not isinstance(t, str)]) + \
+                    [t for t in tracks if isinstance(t, str)]:
+                audio_file_path = track if isinstance(track, str) else playback_track_audio(track)
+                analysis = read_analysis_sidecar(audio_file_path) if audio_file_path else None
+                if analysis is None or "key" not in analysis:
+                    missing.append(track if isinstance(track, str) else track.get("id", audio_file_path))
+                    continue
+                ordered.append(track)
+                analyses.append(analysis)
+            
+            matrices = compatibility_matrices(analyses)
+            ids = [track if isinstance(track, str) else track.get("id", playback_track_audio(track))
+                   for track in ordered]
+            
+            # The consecutive pairs of the current running order
+            transitions = [{
+                "from": ids[i],
+                "to": ids[i + 1],
+                "key_distance": int(matrices["key_distance"][i, i + 1]),
+                "bpm_ratio": round(float(matrices["bpm_ratio"][i, i + 1]), 4),
+                "loudness_delta_lu": None if np.isnan(matrices["loudness_delta_lu"][i, i + 1])
+                else round(float(matrices["loudness_delta_lu"][i, i + 1]), 2),
+                "compatible": bool(matrices["compatible"][i, i + 1])
+            } for i in range(len(ordered) - 1)]
+            
+            def to_list(matrix, digits):
+                return [[None if np.isnan(v) else round(float(v), digits) for v in row] for row in matrix]
+            
+            return {
+                "success": True,
+                "tracks": [{"id": track_id, "key": a["key"]["camelot"], "bpm": a.get("bpm"),
+                            "integrated_lufs": a.get("integrated_lufs")} for track_id, a in zip(ids, analyses)],
+                "key_distance": matrices["key_distance"].tolist(),
+                "bpm_ratio": to_list(matrices["bpm_ratio"], 4),
+                "loudness_delta_lu": to_list(matrices["loudness_delta_lu"], 2),
+                "compatible": matrices["compatible"].tolist(),
+                "transitions": transitions,
+                "missing_analysis": missing
+            }
+        except Exception as e:
+            logger.error(f"Compatibility matrix failed: {e}")
+            return {
+                "success": False,
+                "error": f"Compatibility matrix failed: {str(e)}"
+            }
     
-    def analyze_audio(self, audio_file_path):
+    def backfill_peaks(self, paths, bits=8, force=False):
         """
-        Analyze audio file to detect if vocals are present
-        Returns confidence score and recommendations
+        Write peaks sidecars for existing audio files (e.g. playback_tracks/ directories)
+        Files whose sidecar is newer than the audio are skipped unless force is set
+        """
+        written, skipped, failed = [], 0, []
+        for audio_file_path in find_audio_files(paths):
+            peaks_path = f"{audio_file_path}.peaks"
+            if not force and os.path.exists(peaks_path) and \
+                    os.path.getmtime(peaks_path) >= os.path.getmtime(audio_file_path):
+                skipped += 1
+                continue
+            try:
+                try:
+                    written.append(peaks_from_file(audio_file_path, bits))
+                except RuntimeError:
+                    # Not readable by libsndfile: decode through ffmpeg instead
+                    waveform, sample_rate = self.load_audio(audio_file_path)
+                    written.append(write_peaks_sidecar(audio_file_path, waveform, sample_rate, bits))
+            except Exception as e:
+                logger.error(f"Peaks failed for {audio_file_path}: {e}")
+                failed.append({"file": audio_file_path, "error": str(e)})
+
+        return {
+            "success": not failed,
+            "written": written,
+            "skipped": skipped,
+            "failed": failed,
+            "message": f"Wrote {len(written)} peaks files, skipped {skipped} up to date"
+        }
+    
+    def find_hooks(self, paths, seconds=30.0, output_dir=None, output_format="mp3", force=False):
+        """
+        Find the hook of every audio file under paths and write a .hook.json sidecar
+        With output_dir, the excerpt is also extracted there as <name>_hook.<format>
+        Files are decoded one at a time at HOOK_SAMPLE_RATE, so memory stays bounded per track
+        """
+        found, skipped, failed = [], 0, []
+        for audio_file_path in find_audio_files(paths):
+            sidecar_path = f"{audio_file_path}.hook.json"
+            excerpt_path = None
+            if output_dir:
+                excerpt_path = os.path.join(output_dir, f"{Path(audio_file_path).stem}_hook.{output_format}")
+            try:
+                hook = None
+                source_mtime = os.path.getmtime(audio_file_path)
+                if not force and os.path.exists(sidecar_path) and os.path.getmtime(sidecar_path) >= source_mtime:
+                    with open(sidecar_path) as f:
+                        hook = json.load(f)
+                    if hook.get("seconds") != seconds:
+                        hook = None
+                
+                # An up-to-date sidecar only skips the file if the requested excerpt exists too
+                if hook is not None and (excerpt_path is None or (
+                        os.path.exists(excerpt_path) and os.path.getmtime(excerpt_path) >= source_mtime)):
+                    skipped += 1
+                    continue
+                
+                if hook is None:
+                    waveform, sample_rate = self.audio_adapter.load(audio_file_path, sample_rate=HOOK_SAMPLE_RATE,
+                                                                    dtype=np.float32)
+                    start, end, score = find_hook(downmix(waveform), sample_rate, seconds)
+                    hook = {"seconds": seconds, "start_seconds": round(start, 3), "end_seconds": round(end, 3),
+                            "score": round(score, 4)}
+                    del waveform
+                
+                if excerpt_path:
+                    os.makedirs(output_dir, exist_ok=True)
+                    start, end = hook["start_seconds"], hook["end_seconds"]
+                    hook["excerpt"] = extract_excerpt(audio_file_path, start, end - start, excerpt_path)
+                
+                tmp_path = f"{sidecar_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(hook, f)
+                os.replace(tmp_path, sidecar_path)
+                found.append(dict(hook, file=audio_file_path))
+            except Exception as e:
+                logger.error(f"Hook detection failed for {audio_file_path}: {e}")
+                failed.append({"file": audio_file_path, "error": str(e)})
+        
+        return {
+            "success": not failed,
+            "hooks": found,
+            "skipped": skipped,
+            "failed": failed,
+            "message": f"Found {len(found)} hooks, skipped {skipped} up to date"
+        }
+    
+    def normalize_loudness(self, audio_file_path, target_lufs, output_path=None, max_true_peak_dbtp=-1.0,
+                           package=None, peaks=None):
+        """
+        Apply a static gain so the file reaches the target integrated loudness
+        The gain is capped so the true peak stays under max_true_peak_dbtp
+        An HLS rendition and the .peaks sidecar are rebuilt in the same pass when package/peaks
+        is set (by default only if the output or the source already has one)
+        The output keeps the container of its extension
         """
         try:
-            # Load audio file
-            waveform, sample_rate = librosa.load(audio_file_path, sr=None, mono=False)
+            before = measure_file_loudness(audio_file_path)
+            if before["integrated_lufs"] is None:
+                raise ValueError("Track is silent; nothing to normalize")
+
+            gain_db = float(target_lufs) - before["integrated_lufs"]
+            if before["true_peak_dbtp"] is not None:
+                gain_db = min(gain_db, float(max_true_peak_dbtp) - before["true_peak_dbtp"])
+            gain = db_to_gain(gain_db)
+
+            output_path = output_path or audio_file_path
+            if package is None:
+                package = os.path.isdir(f"{output_path}{HLS_SUFFIX}")
+            if peaks is None:
+                peaks = any(os.path.exists(f"{path}.peaks") for path in (output_path, audio_file_path))
+            output_format = soundfile_format(output_path)
             
-            # Convert to mono for analysis if stereo
-            if len(waveform.shape) > 1:
-                waveform_mono = librosa.to_mono(waveform)
-            else:
-                waveform_mono = waveform
-            
-            # Detect vocal presence using spectral features
-            spectral_centroids = librosa.feature.spectral_centroid(y=waveform_mono, sr=sample_rate)[0]
-            mfccs = librosa.feature.mfcc(y=waveform_mono, sr=sample_rate, n_mfcc=13)
-            
-            # Calculate vocal likelihood based on spectral characteristics
-            high_freq_energy = np.mean(spectral_centroids > 2000)  # Vocal frequency range
-            vocal_formant_energy = np.mean(mfccs[1:4])  # Formant-related MFCCs
-            
-            # Combine metrics for vocal confidence score
-            vocal_confidence = (high_freq_energy * 0.6) + (abs(vocal_formant_energy) * 0.4)
-            vocal_confidence = min(max(vocal_confidence, 0.0), 1.0)  # Clamp to 0-1
-            
-            # Determine recommendation
-            if vocal_confidence > 0.7:
-                recommendation = "high_confidence_vocals"
-                message = "High confidence vocals detected - recommend vocal separation"
-            elif vocal_confidence > 0.4:
-                recommendation = "moderate_vocals"
-                message = "Moderate vocal content detected - separation may be beneficial"
-            else:
-                recommendation = "instrumental"
-                message = "Appears to be instrumental - separation may not be necessary"
+            # Hidden temp name in the destination directory, fsynced and renamed into place
+            tmp_path = os.path.join(os.path.dirname(output_path), f".{os.path.basename(output_path)}.tmp")
+            mins, maxs = [], []
+            try:
+                with sf.SoundFile(audio_file_path) as source:
+                    subtype = source.subtype if source.format == output_format and \
+                        sf.check_format(output_format, source.subtype) else sf.default_subtype(output_format)
+                    sample_rate, frames = source.samplerate, source.frames
+                    packager = hls_packager(dict(self.config, hls_package=package), output_path,
+                                            source.samplerate, source.channels)
+                    with sf.SoundFile(tmp_path, 'w', samplerate=source.samplerate, channels=source.channels,
+                                      subtype=subtype, format=output_format) as output:
+                        try:
+                            for block in source.blocks(blocksize=LOUDNESS_BLOCK_FRAMES, dtype='float32',
+                                                       always_2d=True):
+                                block *= gain
+                                output.write(np.clip(block, -1.0, 1.0, out=block))
+                                if packager is not None:
+                                    packager.write(block)
+                                # The waveform overview follows the gain in the same pass
+                                if peaks:
+                                    block_mins, block_maxs = _block_peaks(block, PEAKS_BASE_SAMPLES)
+                                    mins.append(block_mins)
+                                    maxs.append(block_maxs)
+                        except BaseException:
+                            if packager is not None:
+                                packager.abort()
+                            raise
+                _replace_durably(tmp_path, output_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+            finish_packaging(packager, output_path)
             
+            peaks_file = None
+            if peaks and mins:
+                peaks_file = write_peaks(f"{output_path}.peaks", np.concatenate(mins), np.concatenate(maxs),
+                                         sample_rate, frames, int(self.config.get("peaks_bits", 8)))
+
             return {
-                "vocal_confidence": float(vocal_confidence),
-                "recommendation": recommendation,
-                "message": message,
-                "duration": float(librosa.get_duration(y=waveform_mono, sr=sample_rate)),
-                "sample_rate": int(sample_rate),
-                "channels": int(waveform.shape[0] if len(waveform.shape) > 1 else 1)
+                "success": True,
+                "output_file": output_path,
+                "gain_db": round(gain_db, 2),
+                "before": before,
+                "after": measure_file_loudness(output_path),
+                "peaks_file": peaks_file
             }
-            
+
         except Exception as e:
-            logger.error(f"Audio analysis failed: {e}")
+            logger.error(f"Loudness normalization failed: {e}")
             return {
-                "error": f"Analysis failed: {str(e)}",
-                "vocal_confidence": 0.0,
-                "recommendation": "error"
+                "success": False,
+                "error": f"Normalization failed: {str(e)}"
             }
     
-    def separate_vocals(self, input_file_path, output_dir, filename_prefix="track"):
+    def _reuse_outputs(self, match, input_file_path, output_dir, filename_prefix, duration):
         """
-        Separate vocals from audio track using Spleeter
-        Returns paths to separated tracks
+        Link a matched track's outputs (with their sidecars and HLS renditions) into a new track directory
+        The 'original' is always this upload, not the earlier one
+        Returns the new output_files, or None if the match is missing, misaligned or its files are gone
+        """
+        if not match or not match.get("output_files"):
+            return None
+        # A lead-in, edit or different cut would be served a shifted or shorter instrumental
+        if abs(match["offset_seconds"]) > REUSE_MAX_OFFSET_SECONDS or \
+                abs(float(match["duration"]) - float(duration)) > REUSE_MAX_DURATION_DIFF:
+            logger.info(f"Fingerprint match {match['audio_path']} is not aligned with this upload "
+                        f"(offset {match['offset_seconds']} s, duration {match['duration']:.2f} s "
+                        f"vs {duration:.2f} s) - separating instead")
+            return None
+        sources = match["output_files"]
+        if not all(os.path.exists(path) for path in sources.values()):
+            return None
+        if any(os.path.dirname(os.path.abspath(path)) == os.path.abspath(output_dir) for path in sources.values()):
+            return None  # The match is this track's own earlier (interrupted) run
+
+        os.makedirs(output_dir, exist_ok=True)
+        output_files = {}
+        for kind, source_path in sources.items():
+            target_path = os.path.join(output_dir, f"{filename_prefix}_{kind}.wav")
+            if kind == "original":
+                # A rename, never a write through: target_path may be a hard link to a shared blob
+                output_files[kind] = copy_atomic(input_file_path, target_path)
+                continue
+            output_files[kind] = link_or_copy(source_path, target_path)
+            for sidecar in SIDECAR_SUFFIXES:
+                if os.path.exists(source_path + sidecar):
+                    link_or_copy(source_path + sidecar, target_path + sidecar)
+            if os.path.isdir(f"{source_path}{HLS_SUFFIX}"):
+                link_or_copy_tree(f"{source_path}{HLS_SUFFIX}", f"{target_path}{HLS_SUFFIX}")
+        return output_files
+    
+    def find_duplicate(self, audio_file_path, add=False):
+        """
+        Fingerprint a file and look it up in the local index in one call
+        With add, the file is inserted afterwards so later uploads can match it
         """
         try:
-            # Create output directory if it doesn't exist
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # Load audio using Spleeter's audio adapter
-            waveform, sample_rate = self.audio_adapter.load(input_file_path)
-            
-            # Perform separation
-            logger.info(f"Starting vocal separation for: {input_file_path}")
-            prediction = self.separator.separate(waveform)
-            
-            # Save separated tracks
-            output_files = {}
-            
-            # Save instrumental (accompaniment) track - this is what DJs need
-            instrumental_path = os.path.join(output_dir, f"{filename_prefix}_instrumental.wav")
-            sf.write(instrumental_path, prediction['accompaniment'], sample_rate)
-            output_files['instrumental'] = instrumental_path
-            
-            # Save vocals track (for reference/quality check)
-            vocals_path = os.path.join(output_dir, f"{filename_prefix}_vocals.wav")
-            sf.write(vocals_path, prediction['vocals'], sample_rate)
-            output_files['vocals'] = vocals_path
-            
-            # Save original for comparison
-            original_path = os.path.join(output_dir, f"{filename_prefix}_original.wav")
-            shutil.copy2(input_file_path, original_path)
-            output_files['original'] = original_path
-            
-            logger.info(f"Vocal separation completed successfully")
+            analysis_result, features = self._analyze(audio_file_path)
+            index = self.fingerprint_index
+            if index is None:
+                raise ValueError("Fingerprint index is disabled in the configuration")
+            match = index.lookup(features["fingerprint"], features["fingerprint_summary"])
+            if add:
+                index.add(content_hash(audio_file_path), audio_file_path, analysis_result["duration"],
+                          features["fingerprint"], features["fingerprint_summary"], analysis_result)
             return {
                 "success": True,
-                "output_files": output_files,
-                "message": "Vocal separation completed successfully"
+                "duplicate": match is not None,
+                "match": match
             }
-            
         except Exception as e:
-            logger.error(f"Vocal separation failed: {e}")
+            logger.error(f"Fingerprint lookup failed: {e}")
             return {
                 "success": False,
-                "error": f"Separation failed: {str(e)}"
+                "error": f"Fingerprint lookup failed: {str(e)}"
             }
     
-    def process_setlist_track(self, input_file_path, song_title, output_base_dir):
+    def process_setlist_track(self, input_file_path, song_title, output_base_dir, tier=None, before_separation=None):
         """
         Process a single setlist track for DJ use
         Combines analysis and separation in one workflow
+        The journal outlives only interruptions; any job that returns, failed or not, discards it
+        before_separation(output_dir, filename_prefix) runs only when the track is actually going
+        to be separated (progressive mode renders its preview there)
         """
+        journal = None
         try:
             # Create song-specific output directory
             safe_title = "".join(c for c in song_title if c.isalnum() or c in (' ', '-', '_')).rstrip()
             song_output_dir = os.path.join(output_base_dir, safe_title)
+            tier = self.tier_spec(tier)["name"]
+            journal = self.open_journal("process", [input_file_path, song_title, output_base_dir],
+                                        input_file_path, {"tier": tier})
             
-            # Step 1: Analyze audio
+            # Step 1: Analyze audio (one spectrogram pass also yields the beat grid)
             logger.info(f"Analyzing track: {song_title}")
-            analysis_result = self.analyze_audio(input_file_path)
+            try:
+                analysis_result, analysis_features = self._analyze(input_file_path)
+            except Exception as e:
+                logger.error(f"Audio analysis failed: {e}")
+                journal.discard()
+                return {
+                    "error": f"Analysis failed: {str(e)}",
+                    "vocal_confidence": 0.0,
+                    "recommendation": "error"
+                }
             
-            if "error" in analysis_result:
-                return analysis_result
+            if analysis_result["quality"]["rejected"]:
+                journal.discard()
+                return {
+                    "song_title": song_title,
+                    "analysis": analysis_result,
+                    "error": f"Input rejected: {', '.join(analysis_result['quality']['issues'])}"
+                }
             
-            # Step 2: Decide if separation is needed
+            # Step 2: Reuse the stems of an already processed copy of the same recording
+            # (opt-in: a false match would silently serve another song's stems)
+            index = self.fingerprint_index
+            if index is not None and self.config.get("reuse_duplicate_stems"):
+                match = index.lookup(analysis_features["fingerprint"], analysis_features["fingerprint_summary"])
+                reused = self._reuse_outputs(match, input_file_path, song_output_dir, safe_title.replace(' ', '_'),
+                                             analysis_result["duration"])
+                if reused:
+                    logger.info(f"Duplicate of {match['audio_path']} - reusing existing outputs")
+                    result = {
+                        "song_title": song_title,
+                        "analysis": analysis_result,
+                        "separation_performed": match["separation_performed"],
+                        "success": True,
+                        "output_files": reused,
+                        "duplicate_of": {key: match[key] for key in
+                                         ("content_hash", "audio_path", "bit_error_rate", "offset_seconds")},
+                        "message": "Duplicate recording - existing stems reused without separation"
+                    }
+                    
+                    # Linked stems brought their sidecars; the original is this upload and gets its own
+                    peaks_files = {kind: f"{path}.peaks" for kind, path in reused.items()
+                                   if kind != "original" and os.path.exists(f"{path}.peaks")}
+                    if "original" in reused:
+                        waveform, sample_rate = self.load_audio(input_file_path)
+                        peaks_files["original"] = write_peaks_sidecar(reused["original"], waveform, sample_rate,
+                                                                      int(self.config.get("peaks_bits", 8)))
+                        del waveform
+                    result["peaks_files"] = peaks_files
+                    result["cue_points"] = analysis_result["cue_points"]
+                    result["streaming_files"] = hls_playlists(reused)
+                    dj_ready_path = reused.get("instrumental") or reused.get("dj_ready")
+                    if dj_ready_path:
+                        if os.path.exists(f"{dj_ready_path}.cues.json"):
+                            result["cues_file"] = f"{dj_ready_path}.cues.json"
+                        result["analysis_file"] = f"{dj_ready_path}.analysis.json"
+                        if not os.path.exists(result["analysis_file"]):
+                            result["analysis_file"] = write_analysis_sidecar(dj_ready_path, analysis_result)
+                    self._index_embedding(input_file_path, analysis_features)
+                    
+                    self._store_outputs(result, song_output_dir)
+                    journal.discard()
+                    return result
+            
+            # Step 3: Decide if separation is needed
             should_separate = analysis_result["recommendation"] in ["high_confidence_vocals", "moderate_vocals"]
             
             result = {
@@ -167,71 +3257,1281 @@ class VocalSeparationService:
                 "separation_performed": should_separate
             }
             
+            # With normalization ahead, the HLS rendition is built in the normalization pass instead
+            target_lufs = self.config.get("normalize_lufs")
+            package = bool(self.config.get("hls_package")) and target_lufs is None
+            
             if should_separate:
-                # Step 3: Perform separation
+                if before_separation is not None:
+                    before_separation(song_output_dir, safe_title.replace(' ', '_'))
+                
+                # Step 4: Perform separation
                 logger.info(f"Performing vocal separation for: {song_title}")
                 separation_result = self.separate_vocals(
                     input_file_path, 
                     song_output_dir, 
-                    safe_title.replace(' ', '_')
+                    safe_title.replace(' ', '_'),
+                    peaks=True,
+                    analysis_features=analysis_features,
+                    journal=journal,
+                    tier=tier,
+                    package=package
                 )
                 result.update(separation_result)
             else:
                 # Just copy original file for DJ use
                 os.makedirs(song_output_dir, exist_ok=True)
                 dj_track_path = os.path.join(song_output_dir, f"{safe_title.replace(' ', '_')}_dj_ready.wav")
-                shutil.copy2(input_file_path, dj_track_path)
+                self._write_stem(journal, "stem:dj_ready", dj_track_path,
+                                 lambda path: copy_atomic(input_file_path, path), None)
                 result["output_files"] = {"dj_ready": dj_track_path}
                 result["message"] = "No vocal separation needed - original track copied for DJ use"
+                
+                # Waveform peaks (decoded buffer comes from the PCM cache)
+                waveform, sample_rate = self.load_audio(input_file_path)
+                result["peaks_files"] = {
+                    "dj_ready": write_peaks_sidecar(dj_track_path, waveform, sample_rate,
+                                                    int(self.config.get("peaks_bits", 8)))
+                }
+                result["cue_points"] = analysis_result["cue_points"]
+                result["cues_file"] = write_cues_sidecar(dj_track_path, analysis_features,
+                                                         analysis_result["cue_points"])
+                if package:
+                    playlist = package_hls(self.config, dj_track_path, waveform, sample_rate)
+                    if playlist:
+                        result["streaming_files"] = {"dj_ready": playlist}
+            
+            # Step 5: Optional loudness normalization of the DJ-ready output
+            output_files = result.get("output_files") or {}
+            dj_ready_path = output_files.get("instrumental") or output_files.get("dj_ready")
+            if target_lufs is not None and dj_ready_path:
+                # The peaks sidecar written above is regenerated in the gain pass so it matches the served file
+                result["normalization"] = self.normalize_loudness(
+                    dj_ready_path, target_lufs,
+                    max_true_peak_dbtp=self.config.get("max_true_peak_dbtp", -1.0),
+                    package=self.config.get("hls_package"),
+                    peaks=True
+                )
+                result["streaming_files"] = hls_playlists(output_files)
+            
+            # Analysis sidecar for setlist tools, with the loudness of the file actually served
+            if dj_ready_path:
+                served = dict(analysis_result)
+                if (result.get("normalization") or {}).get("success"):
+                    served.update(result["normalization"]["after"])
+                result["analysis_file"] = write_analysis_sidecar(dj_ready_path, served)
+            
+            # Step 6: Index the fingerprint so later uploads of this recording reuse the outputs
+            digest = content_hash(input_file_path)
+            self._index_embedding(input_file_path, analysis_features, digest)
+            if index is not None and result.get("success", True) and result.get("output_files"):
+                index.add(
+                    digest, input_file_path, analysis_result["duration"],
+                    analysis_features["fingerprint"], analysis_features["fingerprint_summary"],
+                    analysis_result, result["output_files"], should_separate
+                )
+            
+            # Step 7: Deduplicate the outputs against every other booking
+            if result.get("success", True):
+                self._store_outputs(result, song_output_dir)
+            journal.discard()
             
             return result
             
         except Exception as e:
             logger.error(f"Failed to process setlist track: {e}")
+            if journal is not None:
+                journal.discard()
             return {
                 "song_title": song_title,
                 "error": f"Processing failed: {str(e)}"
             }
 
+# Streaming transport: decode/encode through pipes so uploads never touch disk
+
+def _pump(source, sink, content_length=None):
+    """Copy bytes from a reader into a writable pipe, then close the pipe"""
+    remaining = content_length
+    try:
+        while remaining is None or remaining > 0:
+            size = STREAM_CHUNK_BYTES if remaining is None else min(STREAM_CHUNK_BYTES, remaining)
+            chunk = source.read(size)
+            if not chunk:
+                break
+            sink.write(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    except BrokenPipeError:
+        pass  # ffmpeg exited early; its stderr carries the reason
+    finally:
+        try:
+            sink.close()
+        except BrokenPipeError:
+            pass
+
+
+def decode_stream(source, content_length=None, sample_rate=STREAM_SAMPLE_RATE):
+    """
+    Decode an audio byte stream with ffmpeg while it is still arriving
+    Returns a float32 (frames, 2) waveform without writing anything to disk
+    """
+    process = subprocess.Popen(
+        ["ffmpeg", "-v", "error", "-i", "pipe:0", "-f", "f32le", "-ac", "2", "-ar", str(sample_rate), "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    feeder = threading.Thread(target=_pump, args=(source, process.stdin, content_length), daemon=True)
+    feeder.start()
+
+    pcm = bytearray()
+    while True:
+        chunk = process.stdout.read(STREAM_CHUNK_BYTES)
+        if not chunk:
+            break
+        pcm.extend(chunk)
+    feeder.join()
+    errors = process.stderr.read().decode(errors="replace").strip()
+    if process.wait() != 0:
+        raise RuntimeError(f"Decode failed: {errors}")
+
+    frames = len(pcm) // 8
+    return np.frombuffer(pcm, dtype=np.float32, count=frames * 2).reshape(frames, 2), sample_rate
+
+
+def _wav_header(frames, sample_rate, channels, bits=16):
+    """RIFF header for a PCM WAV whose length is known up front"""
+    data_size = frames * channels * bits // 8
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1, channels, sample_rate,
+        sample_rate * channels * bits // 8, channels * bits // 8, bits, b'data', data_size
+    )
+
+
+def _pcm_blocks(waveform, dtype):
+    """Yield a waveform as little-endian PCM bytes, one block at a time"""
+    for start in range(0, len(waveform), STREAM_BLOCK_FRAMES):
+        block = waveform[start:start + STREAM_BLOCK_FRAMES]
+        if dtype == '<i2':
+            block = np.clip(block, -1.0, 1.0) * 32767
+        yield block.astype(dtype).tobytes()
+
+
+def _write_pcm(blocks, sink):
+    try:
+        for data in blocks:
+            sink.write(data)
+    except BrokenPipeError:
+        pass
+    finally:
+        sink.close()
+
+
+def encode_stream(waveform, sample_rate, sink, output_format="wav"):
+    """
+    Encode a waveform block by block into a writable byte stream
+    WAV is framed directly; compressed formats are piped through ffmpeg
+    """
+    frames, channels = waveform.shape
+    if output_format == "wav":
+        sink.write(_wav_header(frames, sample_rate, channels))
+        for data in _pcm_blocks(waveform, '<i2'):
+            sink.write(data)
+        return
+
+    process = subprocess.Popen(
+        ["ffmpeg", "-v", "error", "-f", "f32le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0"]
+        + STREAM_FORMATS[output_format] + ["pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    feeder = threading.Thread(target=_write_pcm, args=(_pcm_blocks(waveform, '<f4'), process.stdin), daemon=True)
+    feeder.start()
+    while True:
+        chunk = process.stdout.read(STREAM_CHUNK_BYTES)
+        if not chunk:
+            break
+        sink.write(chunk)
+    feeder.join()
+    if process.wait() != 0:
+        raise RuntimeError(f"Encoding to {output_format} failed")
+
+
+def write_stream_header(sink, header):
+    """Write the single JSON header line that precedes streamed audio"""
+    sink.write(json.dumps(header).encode() + b"\n")
+    sink.flush()
+
+
+# Shared-memory transport: PCM handed over in POSIX shared memory or memory-mapped files
+#
+# A PCM descriptor is {"shm": name | "file": path, "offset": bytes, "frames": n,
+# "channels": c, "sample_rate": sr}. Callers without POSIX shm bindings (Node) can use
+# files under /dev/shm, which are memory-backed as well.
+
+def _untrack_shm(segment):
+    """Keep the resource tracker from unlinking a segment whose lifetime the caller owns"""
+    # Only POSIX segments are tracked, keyed by their shm_open name: .name with a leading slash
+    if os.name == "posix":
+        resource_tracker.unregister(f"/{segment.name}", "shared_memory")
+
+
+def _attach_shm(name):
+    """Attach to a caller-owned segment without letting this process unlink it at exit"""
+    # Names may arrive in shm_open form ("/name"); SharedMemory adds the slash itself
+    segment = shared_memory.SharedMemory(name=name.lstrip("/"))
+    _untrack_shm(segment)
+    return segment
+
+
+def _close_shm(segment):
+    """
+    Close a segment during cleanup
+    Views still alive (e.g. held by an exception traceback) make close() raise BufferError;
+    that is logged instead, so it never replaces the error being handled
+    """
+    try:
+        segment.close()
+    except BufferError as e:
+        logger.warning(f"Shared memory segment {segment.name} still mapped: {e}")
+
+
+def open_pcm(descriptor, writable=False):
+    """
+    Map a PCM descriptor onto a float32 (frames, channels) array without copying
+    Returns (array, segment); drop the array before closing the segment
+    """
+    frames = int(descriptor["frames"])
+    channels = int(descriptor.get("channels", 2))
+    offset = int(descriptor.get("offset", 0))
+
+    if "shm" in descriptor:
+        segment = _attach_shm(descriptor["shm"])
+        if offset + frames * channels * PCM_DTYPE.itemsize > segment.size:
+            _close_shm(segment)
+            raise ValueError(f"Descriptor exceeds shared memory segment {descriptor['shm']}")
+        array = np.ndarray((frames, channels), dtype=PCM_DTYPE, buffer=segment.buf, offset=offset)
+        array.flags.writeable = writable
+        return array, segment
+
+    if "file" in descriptor:
+        mode = "r+" if writable else "r"
+        return np.memmap(descriptor["file"], dtype=PCM_DTYPE, mode=mode, offset=offset,
+                         shape=(frames, channels)), None
+
+    raise ValueError("PCM descriptor needs either 'shm' or 'file'")
+
+
+def release_shm(name):
+    """Unlink a segment handed out by the daemon once the consumer is done with it"""
+    try:
+        segment = shared_memory.SharedMemory(name=name.lstrip("/"))
+    except FileNotFoundError:
+        return False
+    segment.close()
+    segment.unlink()
+    return True
+
+
+def write_pcm_stems(stems, sample_rate, output=None):
+    """
+    Place stems back to back in one shared buffer and describe them by offset
+    output may name a caller-allocated segment or file; otherwise a new segment is created
+    and ownership passes to the caller, who must release it
+    """
+    output = output or {}
+    base = int(output.get("offset", 0))
+    layout, cursor = {}, base
+    for stem, waveform in stems.items():
+        layout[stem] = cursor
+        cursor += -(-waveform.nbytes // SHM_ALIGNMENT) * SHM_ALIGNMENT
+
+    created = False
+    if "file" in output:
+        buffer = np.memmap(output["file"], dtype=np.uint8, mode="r+" if os.path.exists(output["file"]) else "w+",
+                           shape=(cursor,))
+        segment, target = None, {"file": output["file"]}
+    else:
+        if "shm" in output:
+            segment = _attach_shm(output["shm"])
+            if segment.size < cursor:
+                _close_shm(segment)
+                raise ValueError(f"Output segment {output['shm']} too small ({segment.size} < {cursor} bytes)")
+        else:
+            segment = shared_memory.SharedMemory(create=True, size=cursor)
+            created = True
+        buffer = np.ndarray((segment.size,), dtype=np.uint8, buffer=segment.buf)
+        target = {"shm": segment.name}
+
+    descriptors, view, done = {}, None, False
+    try:
+        for stem, waveform in stems.items():
+            frames, channels = waveform.shape
+            view = np.ndarray((frames, channels), dtype=PCM_DTYPE, buffer=buffer, offset=layout[stem])
+            view[...] = waveform
+            descriptors[stem] = dict(target, offset=layout[stem], frames=int(frames),
+                                     channels=int(channels), sample_rate=int(sample_rate))
+        if segment is None:
+            buffer.flush()
+        done = True
+    finally:
+        # Every view into the segment has to go before close() can unmap it
+        view = buffer = None
+        if segment is not None:
+            _close_shm(segment)
+            if created and done:
+                _untrack_shm(segment)  # Ownership passes to the caller
+            elif created:
+                segment.unlink()  # Never handed out, so nobody else would release it
+    return descriptors
+
+
+class StreamRequestHandler(socketserver.StreamRequestHandler):
+    """
+    One separation request per connection
+    The client sends a JSON header line ({"stem", "format", "content_length"}) then audio bytes.
+    With "transport": "shm" the header carries PCM descriptors instead and the reply is a
+    single JSON line describing where the stems were placed.
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline() or b"{}")
+        except ValueError as e:
+            write_stream_header(self.wfile, {"success": False, "error": f"Bad request header: {e}"})
+            return
+        if request.get("transport") == "shm":
+            if "release" in request:
+                released = [name for name in request["release"] if release_shm(name)]
+                write_stream_header(self.wfile, {"success": True, "released": released})
+            else:
+                write_stream_header(self.wfile, self.server.service.shm_separate(request))
+            return
+        self.server.service.stream_separate(
+            self.rfile, self.wfile,
+            stem=request.get("stem", "accompaniment"),
+            output_format=request.get("format", "wav"),
+            content_length=request.get("content_length")
+        )
+
+
+def serve(service, socket_path=None, host="127.0.0.1", port=None):
+    """
+    Run the separation daemon on a Unix socket (or TCP port) with the model kept loaded
+    Requests are handled one at a time since they share the model
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socketserver.UnixStreamServer(socket_path, StreamRequestHandler)
+        address = socket_path
+    else:
+        socketserver.TCPServer.allow_reuse_address = True
+        server = socketserver.TCPServer((host, int(port)), StreamRequestHandler)
+        address = f"{host}:{port}"
+
+    server.service = service
+    service.separator
+    logger.info(f"Separation daemon listening on {address}")
+    with server:
+        server.serve_forever()
+
+
+# Per-process service used by benchmark pool workers
+_worker_service = None
+
+
+def _init_benchmark_worker(config, slots, ready):
+    """Process pool initializer: claim a worker slot, build a pinned service and load the model"""
+    global _worker_service
+    _worker_service = VocalSeparationService(config, worker_index=slots.get())
+    _worker_service.separator
+    # Wait for every worker so model loading stays outside the timed section
+    ready.wait(timeout=600)
+
+
+def _warmup_job(_):
+    return os.getpid()
+
+
+def _memory_mb(field):
+    """A VmRSS/VmHWM line of /proc/self/status in MB, or None off Linux"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reset_peak_memory():
+    """Reset the kernel's peak-RSS mark for this process and return the current RSS in MB"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    return _memory_mb("VmRSS")
+
+
+def _benchmark_job(audio_file_path, analyze=False):
+    """
+    Separate one fixture in a pool worker and time the inference
+    Peak RSS growth over the job is reported too; with analyze the shared analysis pass
+    runs first, inside the measured section but outside the timed one
+    """
+    baseline = _reset_peak_memory()
+    if analyze:
+        _worker_service._analyze(audio_file_path)
+    waveform, sample_rate = _worker_service.audio_adapter.load(audio_file_path, dtype=np.float32)
+    started = time.perf_counter()
+    _worker_service._infer(waveform, _worker_service.tier_spec())
+    seconds = time.perf_counter() - started
+    peak = _memory_mb("VmHWM")
+    return {
+        "file": audio_file_path,
+        "duration": waveform.shape[0] / float(sample_rate),
+        "seconds": seconds,
+        "peak_mb": None if peak is None or baseline is None else max(0.0, peak - baseline)
+    }
+
+
+class BackfillLedger:
+    """
+    SQLite progress ledger for the library backfill
+    A file counts as done only while its size and mtime match the recorded ones, so edited
+    uploads are picked up again and a crash mid-run loses at most the in-flight files
+    """
+
+    def __init__(self, db_path):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.db = sqlite3.connect(db_path, timeout=30)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS backfill (
+                path TEXT,
+                mode TEXT,
+                size INTEGER,
+                mtime REAL,
+                status TEXT,
+                result TEXT,
+                finished_at TEXT,
+                PRIMARY KEY (path, mode)
+            )
+        """)
+        self.db.commit()
+
+    def pending(self, paths, mode, retry_failed=False):
+        """Paths not yet processed in this mode (failed ones only with retry_failed)"""
+        done = {}
+        for path, size, mtime, status in self.db.execute(
+                "SELECT path, size, mtime, status FROM backfill WHERE mode = ?", (mode,)):
+            done[path] = (size, mtime, status)
+        pending = []
+        for path in paths:
+            stat = os.stat(path)
+            entry = done.get(os.path.abspath(path))
+            if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime and \
+                    (entry[2] == "done" or (entry[2] == "failed" and not retry_failed)):
+                continue
+            pending.append(path)
+        return pending
+
+    def record(self, path, mode, status, result):
+        stat = os.stat(path)
+        self.db.execute(
+            "INSERT OR REPLACE INTO backfill (path, mode, size, mtime, status, result, finished_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(path), mode, stat.st_size, stat.st_mtime, status, json.dumps(result),
+             time.strftime("%Y-%m-%dT%H:%M:%S"))
+        )
+        self.db.commit()
+
+    def summary(self):
+        return dict(self.db.execute("SELECT status, COUNT(*) FROM backfill GROUP BY status").fetchall())
+
+
+def _init_backfill_worker(config, slots, niceness):
+    """Process pool initializer for the backfill: low priority, one pinned core per worker"""
+    global _worker_service
+    if niceness:
+        os.nice(niceness)
+    _worker_service = VocalSeparationService(config, worker_index=slots.get())
+
+
+def _backfill_job(audio_file_path, mode, output_dir):
+    """
+    Analyze or fully process one library file in a pool worker
+    The track's embedding comes back with the result; the parent writes them in batches
+    """
+    _worker_service.embedding_batch = []
+    try:
+        if mode == "analyze":
+            result = _worker_service.analyze_audio(audio_file_path)
+        else:
+            result = _worker_service.process_setlist_track(audio_file_path, Path(audio_file_path).stem, output_dir)
+    except Exception as e:
+        result = {"error": str(e)}
+    return audio_file_path, result, _worker_service.embedding_batch
+
+
+def run_backfill(paths, mode="analyze", output_dir=None, cpu_share=None, io_mb_per_sec=None,
+                 ledger_path=None, retry_failed=False, niceness=10, config=None):
+    """
+    Analyze (or process) every audio file under paths that the ledger has not seen yet
+    cpu_share caps the worker count as a fraction of the available cores; io_mb_per_sec
+    paces job submission by input file size so reads stay under the rate
+    """
+    config = dict(config or load_config())
+    if mode not in ("analyze", "process"):
+        raise ValueError(f"Unknown backfill mode: {mode}")
+    ledger = BackfillLedger(ledger_path or config["backfill_ledger"])
+    files = find_audio_files(paths)
+    pending = ledger.pending(files, mode, retry_failed)
+    if not pending:
+        return {"success": True, "total": len(files), "processed": 0, "ledger": ledger.summary()}
+
+    cpu_share = float(cpu_share if cpu_share is not None else config.get("backfill_cpu_share", 0.5))
+    io_mb_per_sec = io_mb_per_sec if io_mb_per_sec is not None else config.get("backfill_io_mb_per_sec")
+    cores = available_cores(config)
+    workers = max(1, min(len(pending), int(len(cores) * cpu_share)))
+
+    # One single-threaded worker per core so the backfill never spills onto the rest
+    run_config = dict(config, workers=workers, intra_op_threads=1, inter_op_threads=1,
+                      pin_workers=True, cpu_affinity=cores[:workers])
+    output_dir = output_dir or os.path.join(config.get("playback_root", "playback_tracks"), "library")
+
+    ctx = multiprocessing.get_context("spawn")
+    slots = ctx.Queue()
+    for worker_index in range(workers):
+        slots.put(worker_index)
+
+    embedding_index = EmbeddingIndex(config["embedding_index"]) if config.get("embedding_index") else None
+    embeddings, finished = [], []
+
+    processed = failed = 0
+    started = time.monotonic()
+    submitted_bytes = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_backfill_worker,
+                             initargs=(run_config, slots, niceness)) as pool:
+        in_flight = set()
+        queue = list(pending)
+        while queue or in_flight:
+            # Keep two jobs per worker queued, paced by the read budget
+            while queue and len(in_flight) < 2 * workers:
+                if io_mb_per_sec:
+                    ahead = submitted_bytes / (float(io_mb_per_sec) * 2**20) - (time.monotonic() - started)
+                    if ahead > 0:
+                        if in_flight:
+                            break
+                        time.sleep(ahead)
+                audio_file_path = queue.pop(0)
+                submitted_bytes += os.path.getsize(audio_file_path)
+                in_flight.add(pool.submit(_backfill_job, audio_file_path, mode, output_dir))
+
+            done, in_flight = wait(in_flight, timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                audio_file_path, result, job_embeddings = future.result()
+                ok = "error" not in result
+                embeddings.extend(job_embeddings)
+                finished.append((audio_file_path, "done" if ok else "failed", result))
+                processed += ok
+                failed += not ok
+                logger.info(f"Backfill {processed + failed}/{len(pending)}: {audio_file_path}"
+                            f"{'' if ok else ' failed: ' + str(result['error'])}")
+
+            # Embeddings go in one transaction per batch; files count as done only once theirs is stored
+            if finished and (len(finished) >= EMBEDDING_WRITE_BATCH or not (queue or in_flight)):
+                if embedding_index is not None and embeddings:
+                    embedding_index.add_many(embeddings)
+                for audio_file_path, status, result in finished:
+                    ledger.record(audio_file_path, mode, status, result)
+                embeddings, finished = [], []
+
+    return {
+        "success": not failed,
+        "total": len(files),
+        "skipped": len(files) - len(pending),
+        "processed": processed,
+        "failed": failed,
+        "workers": workers,
+        "wall_seconds": round(time.monotonic() - started, 2),
+        "ledger": ledger.summary()
+    }
+
+
+def _init_variant_worker(config, niceness):
+    global _worker_service
+    if niceness:
+        os.nice(niceness)
+    _worker_service = VocalSeparationService(config)
+
+
+def _variant_job(audio_file_path, semitones, tempo_ratio, target_bpm):
+    return _worker_service.render_variant(audio_file_path, semitones, tempo_ratio, target_bpm)
+
+
+def render_setlist_variants(service, tracks, semitones=0.0, tempo_ratio=1.0, workers=None, niceness=5):
+    """
+    Render a variant of every track in a setlist
+    Tracks may override the shift with semitones / tempoRatio / targetBpm keys. Cache hits are
+    answered directly; misses render in a spawned process pool across the cores.
+    """
+    jobs = []
+    for track in order_setlist([t for t in tracks if not isinstance(t, str)]) + [t for t in tracks if isinstance(t, str)]:
+        if isinstance(track, str):
+            jobs.append((track, track, semitones, tempo_ratio, None))
+            continue
+        jobs.append((track.get("id"), playback_track_audio(track), track.get("semitones", semitones),
+                     track.get("tempoRatio", track.get("tempo_ratio", tempo_ratio)),
+                     track.get("targetBpm", track.get("target_bpm"))))
+
+    results = {}
+    pending = []
+    for index, (track_id, audio_file_path, track_semitones, track_ratio, target_bpm) in enumerate(jobs):
+        cached = None
+        if audio_file_path and not target_bpm and service.variant_cache is not None:
+            cached = service.variant_cache.lookup(content_hash(audio_file_path), round(float(track_semitones), 2),
+                                                  round(float(track_ratio), 4))
+        if cached:
+            results[index] = {"success": True, "source_file": audio_file_path, "output_file": cached,
+                              "semitones": round(float(track_semitones), 2),
+                              "tempo_ratio": round(float(track_ratio), 4), "cached": True}
+        elif audio_file_path:
+            pending.append(index)
+        else:
+            results[index] = {"success": False, "error": "Track has no DJ-ready file"}
+
+    if pending:
+        workers = max(1, min(len(pending), int(workers or len(available_cores(service.config)))))
+        ctx = multiprocessing.get_context("spawn")
+        # Rendering never runs the model. TensorFlow is still imported (with spleeter.separator), but
+        # its thread pools only start with a session, so the separation thread caps are left out
+        worker_config = dict(service.config, intra_op_threads=0, inter_op_threads=0)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_variant_worker,
+                                 initargs=(worker_config, niceness)) as pool:
+            futures = {pool.submit(_variant_job, *jobs[index][1:]): index for index in pending}
+            for future in futures:
+                results[futures[future]] = future.result()
+
+    variants = [dict(results[index], track_id=jobs[index][0]) for index in range(len(jobs))]
+    return {
+        "success": all(v["success"] for v in variants),
+        "variants": variants,
+        "rendered": len(pending),
+        "cached": sum(1 for v in variants if v.get("cached"))
+    }
+
+
+def find_audio_files(paths):
+    """Expand files and directories into a sorted list of audio files"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names
+                             if name.lower().endswith(AUDIO_EXTENSIONS))
+        elif os.path.isfile(path):
+            files.append(path)
+    return sorted(files)
+
+
+def generate_benchmark_fixtures(directory=BENCHMARK_FIXTURES_DIR, count=BENCHMARK_FIXTURE_COUNT,
+                                seconds=BENCHMARK_FIXTURE_SECONDS, sample_rate=44100):
+    """
+    Write deterministic synthetic songs for benchmarking: kick and hi-hat, bass, a chord pad
+    and a vibrato lead standing in for vocals, each at its own tempo and key
+    Existing fixtures are kept, so repeated runs benchmark identical audio
+    """
+    os.makedirs(directory, exist_ok=True)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"fixture_{index + 1:02d}.wav")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        rng = np.random.default_rng(index)
+        beat = 60.0 / (96.0 + 14.0 * index)
+        root = 55.0 * 2.0 ** (((5 * index) % 12) / 12.0)
+        phase = t % beat
+        kick = np.exp(-25.0 * phase) * np.sin(2.0 * np.pi * 55.0 * phase)
+        hat = np.exp(-80.0 * ((t + beat / 2) % beat)) * rng.standard_normal(len(t)) * 0.15
+        bass = 0.3 * np.sin(2.0 * np.pi * root * t)
+        pad = sum(np.sin(2.0 * np.pi * root * 4.0 * ratio * t) for ratio in (1.0, 1.26, 1.5)) * 0.08
+        # Lead: a melody of bar-long notes with 5.5 Hz vibrato, gated like phrases
+        bar = (t // (4 * beat)).astype(int)
+        notes = root * 8.0 * 2.0 ** (np.array([0, 2, 4, 7, 9, 7, 4, 2])[bar % 8] / 12.0)
+        lead_phase = 2.0 * np.pi * np.cumsum(notes * (1.0 + 0.01 * np.sin(2.0 * np.pi * 5.5 * t))) / sample_rate
+        lead = 0.25 * np.sin(lead_phase) * (bar % 4 != 3)
+        mix = np.stack([kick + hat + bass + 0.7 * pad + lead, kick - hat + bass + 1.3 * pad + lead], axis=1)
+        write_wav_atomic(path, (0.5 * mix / np.abs(mix).max()).astype(np.float32), sample_rate)
+    return paths
+
+
+def run_benchmark(fixture_paths=None, workers=1, intra_op_threads=0, inter_op_threads=0,
+                  pin_workers=False, config=None, tier=None, max_mb_per_minute=None):
+    """
+    Separate the benchmark fixtures with a pool of workers
+    Returns throughput (audio seconds separated per wall-clock second) and real-time factor
+    With max_mb_per_minute each job also runs the analysis pass, and the worst peak RSS growth
+    per audio minute is checked against that ceiling
+    """
+    fixtures = find_audio_files(fixture_paths or [BENCHMARK_FIXTURES_DIR])
+    if not fixtures and not fixture_paths:
+        logger.info(f"No benchmark fixtures in {BENCHMARK_FIXTURES_DIR}; generating {BENCHMARK_FIXTURE_COUNT}")
+        fixtures = generate_benchmark_fixtures()
+    if not fixtures:
+        raise FileNotFoundError(f"No benchmark fixtures found in {fixture_paths or BENCHMARK_FIXTURES_DIR}")
+
+    run_config = dict(config or load_config())
+    run_config.update({
+        "workers": workers,
+        "intra_op_threads": intra_op_threads,
+        "inter_op_threads": inter_op_threads,
+        "pin_workers": pin_workers
+    })
+    if tier:
+        run_config["separation_tier"] = tier
+
+    # TensorFlow is not fork-safe, so workers are spawned fresh
+    ctx = multiprocessing.get_context("spawn")
+    slots = ctx.Queue()
+    for worker_index in range(workers):
+        slots.put(worker_index)
+    ready = ctx.Barrier(workers)
+
+    # At least two jobs per worker so the pool stays saturated
+    jobs = fixtures * max(1, -(-2 * workers // len(fixtures)))
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_benchmark_worker,
+                             initargs=(run_config, slots, ready)) as pool:
+        list(pool.map(_warmup_job, range(workers)))
+        started = time.perf_counter()
+        results = list(pool.map(_benchmark_job, jobs, [max_mb_per_minute is not None] * len(jobs)))
+        wall_seconds = time.perf_counter() - started
+
+    audio_seconds = sum(r["duration"] for r in results)
+    inference_seconds = sum(r["seconds"] for r in results)
+    per_minute = [r["peak_mb"] / (r["duration"] / 60.0) for r in results
+                  if r["peak_mb"] is not None and r["duration"] > 0]
+    memory = {"peak_mb_per_audio_minute": round(max(per_minute), 1) if per_minute else None}
+    if max_mb_per_minute is not None:
+        memory["max_mb_per_minute"] = float(max_mb_per_minute)
+        memory["within_memory_ceiling"] = bool(per_minute) and max(per_minute) <= float(max_mb_per_minute)
+    return {
+        "tier": run_config.get("separation_tier", "standard"),
+        "workers": workers,
+        "intra_op_threads": intra_op_threads,
+        "inter_op_threads": inter_op_threads,
+        "pin_workers": pin_workers,
+        "jobs": len(results),
+        "audio_seconds": round(audio_seconds, 2),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": round(audio_seconds / wall_seconds, 3),
+        "real_time_factor": round(inference_seconds / audio_seconds, 4),
+        **memory
+    }
+
+
+def autotune(fixture_paths=None, config_path=CONFIG_PATH, max_cores=None):
+    """
+    Benchmark every (workers x threads) split of the available cores
+    The split with the highest throughput is written to the config file
+    """
+    config = load_config(config_path)
+    cores = available_cores(config)
+    if max_cores:
+        cores = cores[:int(max_cores)]
+    core_count = len(cores)
+
+    trials = []
+    for workers in range(1, core_count + 1):
+        if core_count % workers:
+            continue
+        threads = core_count // workers
+        # Spleeter's graph is mostly one op chain, so a couple of inter-op threads is enough
+        inter_op = 1 if threads <= 2 else 2
+        logger.info(f"Autotune trial: {workers} workers x {threads} threads")
+        try:
+            trials.append(run_benchmark(fixture_paths, workers, threads, inter_op, pin_workers=True,
+                                        config=dict(config, cpu_affinity=cores)))
+        except Exception as e:
+            logger.error(f"Autotune trial {workers}x{threads} failed: {e}")
+            trials.append({"workers": workers, "intra_op_threads": threads, "error": str(e)})
+
+    completed = [t for t in trials if "error" not in t]
+    if not completed:
+        return {"success": False, "error": "All autotune trials failed", "trials": trials}
+
+    best = max(completed, key=lambda t: t["throughput"])
+    updates = {
+        "workers": best["workers"],
+        "intra_op_threads": best["intra_op_threads"],
+        "inter_op_threads": best["inter_op_threads"],
+        "pin_workers": True,
+        "autotune": {
+            "cores": core_count,
+            "throughput": best["throughput"],
+            "real_time_factor": best["real_time_factor"],
+            "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+    }
+    if max_cores:
+        updates["cpu_affinity"] = cores
+    save_config(updates, config_path)
+
+    return {
+        "success": True,
+        "best": best,
+        "trials": trials,
+        "config_path": config_path
+    }
+
+
+def emit_event(event, payload):
+    """Write one JSON-lines progress event to stdout for the spawning process"""
+    sys.stdout.write(json.dumps(dict(payload, event=event), allow_nan=False) + "\n")
+    sys.stdout.flush()
+
+
+def parse_cli_options(args):
+    """Split command arguments into positionals and --key value options"""
+    positional, options = [], {}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith("--"):
+            key = arg[2:].replace("-", "_")
+            if i + 1 < len(args) and not args[i + 1].startswith("--"):
+                options[key] = args[i + 1]
+                i += 2
+                continue
+            options[key] = True
+        else:
+            positional.append(arg)
+        i += 1
+    return positional, options
+
+
 def main():
     """Command-line interface for vocal separation service"""
     if len(sys.argv) < 2:
-        print("Usage: python vocal_separation_service.py <command> [args...]")
+        print("Usage: python vocal_separation_service.py <command> [args...] [--worker N] [--reject-bad]")
         print("Commands:")
         print("  analyze <audio_file> - Analyze audio for vocal content")
-        print("  separate <audio_file> <output_dir> [prefix] - Separate vocals from audio")
-        print("  process <audio_file> <song_title> <output_dir> - Process setlist track")
+        print("  separate <audio_file> <output_dir> [prefix] [--tier draft|standard|studio] [--progressive] - Separate vocals from audio")
+        print("  process <audio_file> <song_title> <output_dir> [--normalize-lufs -14] [--tier name] [--progressive] - Process setlist track")
+        print("  remix <track_dir> <output_file> [--vocals-db -12] [--accompaniment-db 0] [--prefix name] - Mix cached stems")
+        print("  transition <from_file> <to_file> <output_file> [--crossfade 6] - Render one crossfade preview")
+        print("  transitions <setlist.json|-> <output_dir> [--crossfade 6] - Render previews for a booking's setlist")
+        print("  energy <file_or_dir>... [--force] - Energy curve, RMS, onset density and spectral flux per track")
+        print("  optimize <setlist.json|-> [--arc peak] - Order a setlist to follow an energy arc (from sidecars)")
+        print("  compatibility <setlist.json|-> - Pairwise Camelot key distance, BPM ratio and loudness delta")
+        print("  variant <audio_file> [--semitones -1] [--tempo 0.95 | --bpm 118] - Cached pitch/tempo variant")
+        print("  variants <setlist.json|-> [--semitones -1] [--tempo 0.95] [--workers N] - Render a setlist's variants in parallel")
+        print("  peaks <file_or_dir>... [--bits 8|16] [--force] - Backfill waveform peaks sidecars")
+        print("  hooks <file_or_dir>... [--seconds 30] [--output-dir dir] [--format mp3] - Find and extract hook excerpts")
+        print("  quality <file_or_dir>... - Scan inputs for clipping, DC offset, truncation and mono compatibility")
+        print("  loudness <audio_file> - Measure integrated loudness, loudness range and true peak")
+        print("  normalize <audio_file> <target_lufs> [--output file] [--max-true-peak -1] - Normalize loudness")
+        print("  fingerprint <audio_file> [--add] - Look up a recording in the local fingerprint index")
+        print("  similar <audio_file> [--k 10] - Nearest catalog tracks by MFCC embedding")
+        print("  release <booking_id> - Remove a booking's outputs, freeing blobs no other booking uses")
+        print("  gc - Reclaim orphaned blobs in the output store")
+        print("  stats - Report output store deduplication")
+        print("  resume - Finish separate/process jobs interrupted by a crash or restart")
+        print("  storage [--budget-gb N] [--downloads file.json] [--upcoming file.json] [--dry-run|--report] - Enforce the disk budget")
+        print("  stream [--stem accompaniment|vocals] [--format wav|mp3|flac|ogg] - Separate audio bytes from stdin to stdout")
+        print("  serve --socket <path> | --port <port> - Run the streaming separation daemon")
+        print("  backfill <dir>... [--mode analyze|process] [--output-dir dir] [--cpu-share 0.5] [--io-mb-per-sec N] - Process the upload library")
+        print("  benchmark [fixtures...] [--workers N] [--threads N] [--tier name|all] [--record] [--max-mb-per-minute N] - Measure separation throughput")
+        print("  autotune [fixtures...] [--max-cores N] - Find the best workers x threads split")
+        print("With a tuned multi-worker config, start 'workers' processes as --worker 0..workers-1; each gets")
+        print("its share of threads (and cores with pin_workers). Without --worker, TensorFlow uses all cores.")
         sys.exit(1)
     
     command = sys.argv[1].lower()
+    args, options = parse_cli_options(sys.argv[2:])
     
     try:
-        service = VocalSeparationService()
+        if command == "benchmark":
+            # Without flags the configured (autotuned) pool is measured
+            config = load_config()
+            threads = int(options.get("threads", config.get("intra_op_threads") or 0))
+            tier = options.get("tier")
+            tiers = list(SEPARATION_TIERS) if tier == "all" else [tier]
+            results = [run_benchmark(
+                args or None,
+                workers=int(options.get("workers", config.get("workers") or 1)),
+                intra_op_threads=threads,
+                inter_op_threads=int(options.get("inter_op_threads", config.get("inter_op_threads") or 0)),
+                pin_workers=bool(options.get("pin", config.get("pin_workers"))),
+                tier=tier,
+                max_mb_per_minute=options.get("max_mb_per_minute")
+            ) for tier in tiers]
+            
+            # --record keeps the measured real-time factor of each tier in the config
+            if options.get("record"):
+                recorded = load_config().get("tier_benchmarks") or {}
+                for result in results:
+                    recorded[result["tier"]] = {
+                        "real_time_factor": result["real_time_factor"],
+                        "throughput": result["throughput"],
+                        "workers": result["workers"],
+                        "measured_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+                    }
+                save_config({"tier_benchmarks": recorded})
+            print(json.dumps(results[0] if len(results) == 1 else results, indent=2, allow_nan=False))
+            # A run over the --max-mb-per-minute ceiling fails like a test would
+            if any(r.get("within_memory_ceiling") is False for r in results):
+                sys.exit(1)
+            return
+        
+        if command == "backfill":
+            if len(args) < 1:
+                print("Usage: backfill <dir>... [--mode analyze|process] [--output-dir dir] [--cpu-share 0.5] "
+                      "[--io-mb-per-sec N] [--ledger file] [--retry-failed]")
+                sys.exit(1)
+            result = run_backfill(
+                args,
+                mode=options.get("mode", "analyze"),
+                output_dir=options.get("output_dir"),
+                cpu_share=options.get("cpu_share"),
+                io_mb_per_sec=options.get("io_mb_per_sec"),
+                ledger_path=options.get("ledger"),
+                retry_failed=bool(options.get("retry_failed"))
+            )
+            print(json.dumps(result, indent=2, allow_nan=False))
+            if not result["success"]:
+                sys.exit(1)
+            return
+        
+        if command == "autotune":
+            result = autotune(args or None, options.get("config", CONFIG_PATH), options.get("max_cores"))
+            print(json.dumps(result, indent=2, allow_nan=False))
+            if not result["success"]:
+                sys.exit(1)
+            return
+        
+        worker_index = int(options["worker"]) if "worker" in options else None
+        service = VocalSeparationService(worker_index=worker_index)
+        if "normalize_lufs" in options:
+            service.config["normalize_lufs"] = float(options["normalize_lufs"])
+        if options.get("reject_bad"):
+            service.config["reject_bad_inputs"] = True
+        if "tier" in options:
+            service.config["separation_tier"] = options["tier"]
+        # Slow tiers yield the CPU to interactive jobs, whether chosen here or in the config
+        niceness = service.tier_spec()["niceness"]
+        if niceness:
+            os.nice(niceness)
+        
+        if command == "stream":
+            ok = service.stream_separate(
+                sys.stdin.buffer, sys.stdout.buffer,
+                stem=options.get("stem", "accompaniment"),
+                output_format=options.get("format", "wav")
+            )
+            if not ok:
+                sys.exit(1)
+            return
+        
+        if command == "serve":
+            if "socket" not in options and "port" not in options:
+                print("Usage: serve --socket <path> | --port <port> [--host 127.0.0.1]")
+                sys.exit(1)
+            serve(service, options.get("socket"), options.get("host", "127.0.0.1"), options.get("port"))
+            return
         
         if command == "analyze":
-            if len(sys.argv) < 3:
+            if len(args) < 1:
                 print("Usage: analyze <audio_file>")
                 sys.exit(1)
             
-            result = service.analyze_audio(sys.argv[2])
-            print(json.dumps(result, indent=2))
+            result = service.analyze_audio(args[0])
+            print(json.dumps(result, indent=2, allow_nan=False))
         
         elif command == "separate":
-            if len(sys.argv) < 4:
+            if len(args) < 2:
                 print("Usage: separate <audio_file> <output_dir> [prefix]")
                 sys.exit(1)
             
-            prefix = sys.argv[4] if len(sys.argv) > 4 else "track"
-            result = service.separate_vocals(sys.argv[2], sys.argv[3], prefix)
-            print(json.dumps(result, indent=2))
+            prefix = args[2] if len(args) > 2 else "track"
+            if options.get("progressive"):
+                # Preview event first, then the full job at lower priority
+                emit_event("preview", service.preview_separate(args[0], args[1], prefix))
+                os.nice(PREVIEW_BACKGROUND_NICENESS)
+                emit_event("complete", service.separate_vocals(args[0], args[1], prefix))
+                return
+            result = service.separate_vocals(args[0], args[1], prefix)
+            print(json.dumps(result, indent=2, allow_nan=False))
         
         elif command == "process":
-            if len(sys.argv) < 5:
+            if len(args) < 3:
                 print("Usage: process <audio_file> <song_title> <output_dir>")
                 sys.exit(1)
             
-            result = service.process_setlist_track(sys.argv[2], sys.argv[3], sys.argv[4])
-            print(json.dumps(result, indent=2))
+            if options.get("progressive"):
+                # The preview is separated only once analysis has found vocals worth separating
+                previewed = []
+                
+                def preview(output_dir, prefix):
+                    emit_event("preview", service.preview_separate(args[0], output_dir, prefix))
+                    previewed.append(True)
+                    os.nice(PREVIEW_BACKGROUND_NICENESS)
+                
+                result = service.process_setlist_track(args[0], args[1], args[2], before_separation=preview)
+                if not previewed:
+                    emit_event("preview", {"success": True, "skipped": True,
+                                           "message": "No separation needed - the full result follows"})
+                emit_event("complete", result)
+                return
+            result = service.process_setlist_track(args[0], args[1], args[2])
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "remix":
+            if len(args) < 2:
+                print("Usage: remix <track_dir> <output_file> [--vocals-db -12] [--accompaniment-db 0] [--prefix name]")
+                sys.exit(1)
+            
+            prefix = options.get("prefix")
+            vocals_path = options.get("vocals") or find_stem_file(args[0], "vocals", prefix)
+            accompaniment_path = options.get("accompaniment") or find_stem_file(args[0], "accompaniment", prefix)
+            if not vocals_path or not accompaniment_path:
+                print(json.dumps({"success": False, "error": f"No separated stems found in {args[0]}"}))
+                sys.exit(1)
+            
+            result = service.remix_stems(
+                vocals_path, accompaniment_path, args[1],
+                vocals_gain_db=options.get("vocals_db", -12.0),
+                accompaniment_gain_db=options.get("accompaniment_db", 0.0)
+            )
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "transition":
+            if len(args) < 3:
+                print("Usage: transition <from_file> <to_file> <output_file> [--crossfade 6]")
+                sys.exit(1)
+            
+            crossfade = float(options.get("crossfade", TRANSITION_CROSSFADE_SECONDS))
+            result = service.render_transition(args[0], args[1], args[2], crossfade)
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "transitions":
+            if len(args) < 2:
+                print("Usage: transitions <setlist.json|-> <output_dir> [--crossfade 6] [--format ogg]")
+                sys.exit(1)
+            
+            if args[0] == "-":
+                tracks = json.load(sys.stdin)
+            else:
+                with open(args[0]) as f:
+                    tracks = json.load(f)
+            result = service.render_setlist_transitions(
+                tracks, args[1],
+                crossfade_seconds=float(options.get("crossfade", TRANSITION_CROSSFADE_SECONDS)),
+                output_format=options.get("format", "ogg")
+            )
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "energy":
+            if len(args) < 1:
+                print("Usage: energy <file_or_dir>... [--force]")
+                sys.exit(1)
+            
+            result = service.profile_energy(args, force=bool(options.get("force")))
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "optimize":
+            if len(args) < 1:
+                print("Usage: optimize <setlist.json|-> [--arc peak|rise|fall|wave|flat|0.3,0.8,0.5]")
+                sys.exit(1)
+            
+            if args[0] == "-":
+                tracks = json.load(sys.stdin)
+            else:
+                with open(args[0]) as f:
+                    tracks = json.load(f)
+            result = service.optimize_setlist(tracks, arc=options.get("arc", "peak"))
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "compatibility":
+            if len(args) < 1:
+                print("Usage: compatibility <setlist.json|->")
+                sys.exit(1)
+            
+            if args[0] == "-":
+                tracks = json.load(sys.stdin)
+            else:
+                with open(args[0]) as f:
+                    tracks = json.load(f)
+            result = service.setlist_compatibility(tracks)
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "variant":
+            if len(args) < 1:
+                print("Usage: variant <audio_file> [--semitones -1] [--tempo 0.95 | --bpm 118]")
+                sys.exit(1)
+            
+            result = service.render_variant(
+                args[0],
+                semitones=float(options.get("semitones", 0.0)),
+                tempo_ratio=float(options.get("tempo", 1.0)),
+                target_bpm=float(options["bpm"]) if "bpm" in options else None
+            )
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "variants":
+            if len(args) < 1:
+                print("Usage: variants <setlist.json|-> [--semitones -1] [--tempo 0.95] [--workers N]")
+                sys.exit(1)
+            
+            if args[0] == "-":
+                tracks = json.load(sys.stdin)
+            else:
+                with open(args[0]) as f:
+                    tracks = json.load(f)
+            result = render_setlist_variants(
+                service, tracks,
+                semitones=float(options.get("semitones", 0.0)),
+                tempo_ratio=float(options.get("tempo", 1.0)),
+                workers=options.get("workers")
+            )
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "peaks":
+            if len(args) < 1:
+                print("Usage: peaks <file_or_dir>... [--bits 8|16] [--force]")
+                sys.exit(1)
+            
+            bits = int(options.get("bits", service.config.get("peaks_bits", 8)))
+            result = service.backfill_peaks(args, bits=bits, force=bool(options.get("force")))
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "hooks":
+            if len(args) < 1:
+                print("Usage: hooks <file_or_dir>... [--seconds 30] [--output-dir dir] [--format mp3] [--force]")
+                sys.exit(1)
+            
+            result = service.find_hooks(
+                args,
+                seconds=float(options.get("seconds", 30.0)),
+                output_dir=options.get("output_dir"),
+                output_format=options.get("format", "mp3"),
+                force=bool(options.get("force"))
+            )
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "quality":
+            if len(args) < 1:
+                print("Usage: quality <file_or_dir>...")
+                sys.exit(1)
+            
+            result = service.scan_files(args)
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "loudness":
+            if len(args) < 1:
+                print("Usage: loudness <audio_file>")
+                sys.exit(1)
+            
+            print(json.dumps(measure_file_loudness(args[0]), indent=2, allow_nan=False))
+        
+        elif command == "normalize":
+            if len(args) < 2:
+                print("Usage: normalize <audio_file> <target_lufs> [--output file] [--max-true-peak -1]")
+                sys.exit(1)
+            
+            result = service.normalize_loudness(
+                args[0], float(args[1]), options.get("output"),
+                float(options.get("max_true_peak", service.config.get("max_true_peak_dbtp", -1.0)))
+            )
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "fingerprint":
+            if len(args) < 1:
+                print("Usage: fingerprint <audio_file> [--add]")
+                sys.exit(1)
+            
+            result = service.find_duplicate(args[0], add=bool(options.get("add")))
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command == "similar":
+            if len(args) < 1:
+                print("Usage: similar <audio_file> [--k 10]")
+                sys.exit(1)
+            
+            result = service.find_similar(args[0], k=int(options.get("k", 10)))
+            print(json.dumps(result, indent=2, allow_nan=False))
+        
+        elif command in ("release", "gc", "stats"):
+            store = service.blob_store
+            if store is None:
+                print(json.dumps({"success": False, "error": "Blob store is disabled in the configuration"}))
+                sys.exit(1)
+            
+            if command == "release":
+                if len(args) < 1:
+                    print("Usage: release <booking_id>")
+                    sys.exit(1)
+                result = store.release_booking(args[0])
+            elif command == "gc":
+                result = store.gc()
+            else:
+                result = store.stats()
+            print(json.dumps(dict(result, success=True), indent=2, allow_nan=False))
+        
+        elif command == "resume":
+            results = []
+            for job in unfinished_jobs(service.config.get("journal_dir") or os.path.join("audio_cache", "journal")):
+                input_file_path = job["args"][0]
+                if not os.path.exists(input_file_path):
+                    logger.warning(f"Input of interrupted job is gone, dropping journal: {input_file_path}")
+                    for path in glob.glob(job["journal"][:-len(".jsonl")] + ".*.npy") + [job["journal"]]:
+                        os.unlink(path)
+                    continue
+                logger.info(f"Resuming {job['command']} {input_file_path}")
+                if job["command"] == "process":
+                    job_result = service.process_setlist_track(*job["args"], **job.get("options", {}))
+                else:
+                    job_result = service.separate_vocals(*job["args"], **job.get("options", {}))
+                results.append({"command": job["command"], "args": job["args"], "result": job_result})
+            print(json.dumps({"success": all("error" not in r["result"] for r in results), "resumed": results},
+                             indent=2, allow_nan=False))
+        
+        elif command == "storage":
+            # downloads: playback_track_downloads rows ({fileUrl, downloadedAt}) or a {path: time} map
+            downloads = {}
+            if options.get("downloads"):
+                with open(options["downloads"]) as f:
+                    rows = json.load(f)
+                if isinstance(rows, dict):
+                    rows = [{"fileUrl": path, "downloadedAt": when} for path, when in rows.items()]
+                for row in rows:
+                    path = row.get("fileUrl") or row.get("file_url")
+                    when = _parse_timestamp(row.get("downloadedAt") or row.get("downloaded_at"))
+                    # downloaded_at is nullable; such rows carry no recency information
+                    if not path or when is None:
+                        continue
+                    downloads[path] = max(downloads.get(path, 0.0), when)
+            
+            # upcoming: booking ids (or booking objects) whose events have not happened yet
+            upcoming = None
+            if options.get("upcoming"):
+                with open(options["upcoming"]) as f:
+                    upcoming = [b["id"] if isinstance(b, dict) else b for b in json.load(f)]
+            
+            manager = StorageManager(service)
+            budget_gb = options.get("budget_gb", service.config.get("disk_budget_gb"))
+            if options.get("report") or budget_gb is None:
+                result = manager.report(manager.scan(downloads, upcoming))
+            else:
+                result = manager.enforce(int(float(budget_gb) * 2**30), downloads, upcoming,
+                                         dry_run=bool(options.get("dry_run")))
+            print(json.dumps(dict(result, success=True), indent=2, allow_nan=False))
         
         else:
             print(f"Unknown command: {command}")
@@ -239,8 +4539,8 @@ def main():
     
     except Exception as e:
         logger.error(f"Service error: {e}")
-        print(json.dumps({"error": str(e)}))
+        print(json.dumps({"error": str(e)}, allow_nan=False))
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()